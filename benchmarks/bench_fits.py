@@ -0,0 +1,39 @@
+'''FITS write throughput per frame size, as done by the exposure threads.'''
+import tempfile
+from pathlib import Path
+import numpy as np
+
+from astropy.io import fits
+
+from common import result, best_time
+
+
+def write_time(shape, directory):
+    data = np.random.default_rng(1).integers(0, 65535, shape, dtype=np.uint16)
+    header = fits.Header([(f'KEY{i}', i, 'header card') for i in range(100)])
+    hdul = fits.HDUList([fits.PrimaryHDU(data=data, header=header)])
+    count = [0]
+    def write():
+        count[0] += 1
+        file = Path(directory)/f'frame{count[0]}.fits'
+        hdul.writeto(file, overwrite=False)
+        file.unlink()
+    return best_time(write, repeat=5), data.nbytes
+
+
+def run(quick=False):
+    sizes = [512, 2048] if quick else [512, 2048, 4096]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            seconds, nbytes = write_time((size, size), directory)
+            results.append(result('fits_write_seconds', seconds, 's',
+                                  better='lower', frame_size=size))
+            results.append(result('fits_write_MB_per_second', nbytes/seconds/1e6,
+                                  'MB/s', frame_size=size))
+    return results
+
+
+if __name__ == '__main__':
+    for r in run():
+        print(f"{r['name']:28s} {r['params']['frame_size']:5d} {r['value']:10.4f} {r['unit']}")
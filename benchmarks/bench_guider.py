@@ -0,0 +1,65 @@
+'''Guider event throughput: PHD2 GuideStep events handled per second, both
+directly and read from a local socket by the guider's worker thread.
+'''
+import json
+import socket
+import threading
+from time import perf_counter
+
+from common import result, best_time
+from ocs.phd2guiding.guider import Guider
+
+
+def guide_step(i):
+    return {'Event': 'GuideStep', 'Frame': i, 'RADistanceRaw': 0.1*(i % 7),
+            'DECDistanceRaw': -0.1*(i % 5), 'AvgDist': 0.2}
+
+
+def handle_event_rate(n=10000):
+    '''Events per second through Guider._handle_event.'''
+    guider = Guider(auto_reconnect=False)
+    guider._handle_event({'Event': 'StartGuiding'})
+    events = [guide_step(i) for i in range(n)]
+    def handle():
+        for event in events:
+            guider._handle_event(event)
+    return n/best_time(handle, repeat=3)
+
+
+def socket_event_rate(n=20000):
+    '''Events per second read and handled by the guider worker thread from a
+    local server which sends n GuideStep events and then disconnects.
+    '''
+    server = socket.socket()
+    server.bind(('localhost', 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+    lines = b''.join([json.dumps(guide_step(i)).encode() + b'\r\n'
+                      for i in range(n)])
+    def serve():
+        conn, address = server.accept()
+        conn.sendall(lines)
+        conn.close()
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    # The guider connects to port 4400 + instance - 1
+    guider = Guider(instance=port - 4399, auto_reconnect=False)
+    start = perf_counter()
+    guider.Connect()
+    guider.worker.join()
+    elapsed = perf_counter() - start
+    guider.Disconnect()
+    server.close()
+    return n/elapsed
+
+
+def run(quick=False):
+    return [result('guider_events_per_second', handle_event_rate(), '1/s'),
+            result('guider_socket_events_per_second',
+                   socket_event_rate(5000 if quick else 20000), '1/s'),
+            ]
+
+
+if __name__ == '__main__':
+    for r in run():
+        print(f"{r['name']:35s} {r['value']:12.1f} {r['unit']}")
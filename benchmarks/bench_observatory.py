@@ -0,0 +1,67 @@
+'''End to end benchmarks of the simulated observatory: control overhead per
+OB beyond the time spent in device calls, and process startup time.
+'''
+import sys
+import subprocess
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from common import result, best_time, zero_time_config
+
+OB_STATES = ['acquiring', 'configuring', 'focusing', 'observing']
+
+
+def control_overhead(night_length=5):
+    '''Run the simulatedobs OB list with zero-time devices.  Returns the time
+    per OB spent in the OB states which was not spent in device calls made
+    in those states.
+    '''
+    from ocs.observatory import RollOffRoof
+    from simulatedobs import build_OBs
+    with tempfile.TemporaryDirectory() as datadir:
+        config = zero_time_config(night_length=night_length, datadir=datadir)
+        obs = RollOffRoof(OBs=build_OBs(), **config)
+        obs.wake_up()
+        state_time = sum([obs.durations.get(state, 0) for state in OB_STATES])
+        device_time = sum([total for name, labels, n, total, mean, maxval
+                           in obs.metrics.summary()
+                           if name == 'device_call_seconds'
+                           and labels.get('state', None) in OB_STATES])
+        nOBs = max(len(obs.executed), 1)
+    return (state_time - device_time)/nOBs, state_time/nOBs, len(obs.executed)
+
+
+def import_time():
+    '''Seconds to start a new interpreter and import the observatory.'''
+    root = Path(__file__).parent.parent
+    def start():
+        subprocess.run([sys.executable, '-c', 'import ocs.observatory'],
+                       cwd=root, check=True)
+    return best_time(start, repeat=3)
+
+
+def construction_time():
+    '''Seconds to create a simulated RollOffRoof (IERS and ephemeris
+    tables, device setup, state machine).'''
+    from ocs.observatory import RollOffRoof
+    config = zero_time_config()
+    def construct():
+        RollOffRoof(OBs=[], **config).shutdown()
+    return best_time(construct, repeat=3)
+
+
+def run(quick=False):
+    overhead, per_OB, nOBs = control_overhead(night_length=3 if quick else 5)
+    return [result('control_overhead_per_OB', overhead, 's', better='lower',
+                   OBs=nOBs),
+            result('time_per_OB', per_OB, 's', better='lower', OBs=nOBs),
+            result('startup_import_seconds', import_time(), 's', better='lower'),
+            result('startup_construct_seconds', construction_time(), 's',
+                   better='lower'),
+            ]
+
+
+if __name__ == '__main__':
+    for r in run():
+        print(f"{r['name']:30s} {r['value']:10.4f} {r['unit']}")
@@ -0,0 +1,68 @@
+'''Scheduler select latency versus queue size, for OB lists held in memory
+and for on-disk OB catalogs.
+'''
+import tempfile
+from pathlib import Path
+from time import perf_counter
+import numpy as np
+
+from common import result, best_time
+from ocs.scheduler import Scheduler, OBCatalog
+from ocs.scheduler.catalog import write_catalog
+
+
+def catalog_entries(n, seed=1):
+    rng = np.random.default_rng(seed)
+    filters = ['L', 'R', 'G', 'B']
+    return [{'target': {'name': f'target{i}', 'RA': float(rng.uniform(0, 360))},
+             'instconfig': {'filter': filters[i % 4]},
+             'detconfig': {'exptime': 60, 'nexp': 5}}
+            for i in range(n)]
+
+
+def list_select_latency(n, nselect=100):
+    '''Mean seconds per select from a list of n OBs.'''
+    def select():
+        scheduler = Scheduler(OBs=range(n))
+        start = perf_counter()
+        for i in range(min(nselect, n)):
+            scheduler.select()
+        return (perf_counter() - start)/min(nselect, n)
+    return min([select() for i in range(3)])
+
+
+def catalog_select_latency(n, directory, nselect=20):
+    '''Mean seconds per select (filter and RA range criteria) from an OB
+    catalog of n entries, plus the time to open the catalog.'''
+    file = write_catalog(catalog_entries(n), Path(directory)/f'catalog{n}.jsonl')
+    catalog = OBCatalog(file)
+    catalog.close()
+    # Opening again uses the cached index
+    open_time = best_time(lambda: OBCatalog(file).close(), repeat=3)
+    scheduler = Scheduler(catalog=OBCatalog(file))
+    def select():
+        scheduler.select(filter='R', ra_range=(300, 60))
+    latency = best_time(select, repeat=3, number=nselect)
+    scheduler.catalog.close()
+    return latency, open_time
+
+
+def run(quick=False):
+    sizes = [100, 1000, 10000] if quick else [100, 1000, 10000, 100000]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            results.append(result('scheduler_list_select_seconds',
+                                  list_select_latency(n), 's', better='lower',
+                                  queue_size=n))
+            latency, open_time = catalog_select_latency(n, directory)
+            results.append(result('scheduler_catalog_select_seconds', latency,
+                                  's', better='lower', queue_size=n))
+            results.append(result('scheduler_catalog_open_seconds', open_time,
+                                  's', better='lower', queue_size=n))
+    return results
+
+
+if __name__ == '__main__':
+    for r in run():
+        print(f"{r['name']:35s} {r['params']['queue_size']:7d} {r['value']:.2e} {r['unit']}")
@@ -0,0 +1,49 @@
+'''Microbenchmark of state machine trigger dispatch with zero-time simulated
+devices, with and without per trigger condition memoization.
+
+    python benchmarks/bench_triggers.py [night length in seconds]
+'''
+import sys
+from time import perf_counter
+
+from common import result, zero_time_config
+
+
+def dispatch_rate(memoize_conditions=True, night_length=3):
+    '''Run a night with no OBs (the observatory loops in waiting_closed until
+    dawn) and return the number of triggers dispatched per second, the
+    number of triggers, and the number of condition evaluations.
+    '''
+    from ocs.observatory import RollOffRoof
+    config = zero_time_config(night_length=night_length)
+    obs = RollOffRoof(OBs=[], memoize_conditions=memoize_conditions, **config)
+    # Keep every dispatch record
+    obs.conditions.history = None
+    start = perf_counter()
+    obs.wake_up()
+    elapsed = perf_counter() - start
+    records = obs.conditions.records
+    evaluations = sum([r['evaluations'] for r in records])
+    return len(records)/elapsed, len(records), evaluations
+
+
+def run(quick=False):
+    results = []
+    for memoize in [False, True]:
+        rate, n, evaluations = dispatch_rate(memoize_conditions=memoize,
+                                             night_length=1 if quick else 3)
+        results.append(result('transitions_per_second', rate, '1/s',
+                              memoize_conditions=memoize))
+        results.append(result('condition_evaluations_per_trigger',
+                              evaluations/max(n, 1), 'count', better='lower',
+                              memoize_conditions=memoize))
+    return results
+
+
+if __name__ == '__main__':
+    night_length = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for memoize in [False, True]:
+        rate, n, evaluations = dispatch_rate(memoize_conditions=memoize,
+                                             night_length=night_length)
+        print(f'memoize_conditions={memoize}: {n} triggers, {rate:.0f} per second, '
+              f'{evaluations/max(n, 1):.1f} condition evaluations per trigger')
@@ -0,0 +1,86 @@
+'''Throughput of the horizon and visibility checks: alt-az transforms (one
+target at a time as below_horizon does, and vectorized), horizon
+interpolation, and the ephemeris darkness and moon checks.
+'''
+import tempfile
+import numpy as np
+
+from astropy import units as u
+from astropy import coordinates as c
+from astropy.time import Time
+from astropy.table import Table
+
+from common import result, best_time
+from ocs.ephemeris import NightlyEphemeris
+
+LOCATION = c.EarthLocation(lat=20.028790056, lon=-155.714876639, height=677)
+
+
+def targets(n, seed=1):
+    rng = np.random.default_rng(seed)
+    return c.SkyCoord(rng.uniform(0, 360, n)*u.deg,
+                      np.degrees(np.arcsin(rng.uniform(-0.5, 1, n)))*u.deg)
+
+
+def horizon_check_rate():
+    '''below_horizon style checks (one target per transform) per second.'''
+    coord = targets(1)[0]
+    def check():
+        frame = c.AltAz(obstime=Time.now(), location=LOCATION)
+        return coord.transform_to(frame).alt.deg > 25
+    return 1/best_time(check, repeat=3, number=5)
+
+
+def vector_visibility_rate(n=1000):
+    '''Targets per second when n targets are transformed at once.'''
+    coords = targets(n)
+    def check():
+        frame = c.AltAz(obstime=Time.now(), location=LOCATION)
+        return coords.transform_to(frame).alt.deg > 25
+    return n/best_time(check, repeat=3)
+
+
+def horizon_interpolation_rate():
+    '''get_horizon calls per second for a 36 point horizon.'''
+    from ocs.observatory import RollOffRoof
+    class Horizon():
+        horizon = Table({'az': np.arange(0, 360, 10.),
+                         'h': 20 + 10*np.sin(np.radians(np.arange(0, 360, 10.)))})
+    azs = np.random.default_rng(2).uniform(0, 360, 100)
+    def check():
+        for az in azs:
+            RollOffRoof.get_horizon(Horizon, az)
+    return len(azs)/best_time(check, repeat=3)
+
+
+def ephemeris_rates():
+    '''Darkness and moon separation checks per second.'''
+    with tempfile.TemporaryDirectory() as cache_dir:
+        ephemeris = NightlyEphemeris(LOCATION, cache_dir=cache_dir)
+        ephemeris.is_dark()
+        coord = targets(1)[0]
+        dark = 1/best_time(ephemeris.is_dark, repeat=3, number=100)
+        moon = 1/best_time(lambda: ephemeris.moon_separation(coord),
+                           repeat=3, number=100)
+    return dark, moon
+
+
+def run(quick=False):
+    dark, moon = ephemeris_rates()
+    results = [result('horizon_checks_per_second', horizon_check_rate(), '1/s'),
+               result('visibility_targets_per_second',
+                      vector_visibility_rate(1000 if quick else 10000), '1/s'),
+               result('is_dark_per_second', dark, '1/s'),
+               result('moon_separation_per_second', moon, '1/s'),
+               ]
+    try:
+        results.append(result('get_horizon_per_second',
+                              horizon_interpolation_rate(), '1/s'))
+    except ImportError:
+        pass
+    return results
+
+
+if __name__ == '__main__':
+    for r in run():
+        print(f"{r['name']:35s} {r['value']:12.1f} {r['unit']}")
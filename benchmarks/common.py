@@ -0,0 +1,53 @@
+'''Helpers shared by the benchmarks.  Each benchmark module has a run(quick)
+function returning a list of results made with result().
+'''
+import sys
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def result(name, value, unit, better='higher', **params):
+    '''A single measurement.  better is "higher" or "lower" and says which
+    direction is an improvement when comparing runs.
+    '''
+    return {'name': name, 'value': float(value), 'unit': unit,
+            'better': better, 'params': params}
+
+
+def best_time(function, repeat=5, number=1):
+    '''Best time in seconds for one call of function over repeat trials of
+    number calls each.
+    '''
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        for j in range(number):
+            function()
+        elapsed = (perf_counter() - start)/number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def zero_time_config(night_length=3, datadir=None):
+    '''Configuration of the simulated observatory with devices which take no
+    time.  The simulated night lasts night_length seconds.
+    '''
+    from ocs import load_configuration
+    config = load_configuration('simulatedobs')
+    config['loglevel_console'] = 'WARNING'
+    config['logfile'] = None
+    config['log_queue'] = False
+    config['waittime'] = 0
+    # The simulated night lasts maxwait*3 seconds
+    config['maxwait'] = night_length/3
+    config['roof_config'] = {'roof_time_to_open': 0, 'roof_time_to_close': 0}
+    config['telescope_config'] = {'time_to_slew': 0, 'time_to_park': 0}
+    config['instrument_config'] = {'time_to_configure': 0}
+    config['detector_config'] = [{'exposure_overhead': 0,
+                                  'simulate_exposure_time': False}
+                                 for d in config['detector']]
+    if datadir is not None:
+        config['datadir'] = str(datadir)
+    return config
@@ -0,0 +1,116 @@
+'''Run the benchmark suite and write the results as JSON, or compare two
+result files.
+
+    python benchmarks/run.py [--quick] [--only fits,guider] [--output results.json]
+    python benchmarks/run.py --compare base.json new.json [--threshold 0.1]
+
+Results are written to benchmarks/results/<commit>.json by default.  A
+benchmark which can not run (e.g. the observatory benchmarks without odl
+installed) is recorded as skipped with the reason.
+'''
+import argparse
+import importlib
+import json
+import platform
+import subprocess
+import sys
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+import common
+
+BENCHMARKS = ['triggers', 'observatory', 'scheduler', 'visibility', 'fits',
+              'guider']
+ROOT = Path(__file__).parent.parent
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_suite(names=BENCHMARKS, quick=False):
+    output = {'commit': git_commit(),
+              'date': datetime.utcnow().isoformat(),
+              'python': platform.python_version(),
+              'machine': platform.node(),
+              'quick': quick,
+              'results': [],
+              'skipped': {}}
+    for name in names:
+        print(f'Running {name}', file=sys.stderr)
+        try:
+            module = importlib.import_module(f'bench_{name}')
+            output['results'].extend([dict(r, benchmark=name)
+                                      for r in module.run(quick=quick)])
+        except Exception as err:
+            output['skipped'][name] = f'{type(err).__name__}: {err}'
+            traceback.print_exc()
+    return output
+
+
+def key(r):
+    return (r['name'], json.dumps(r['params'], sort_keys=True))
+
+
+def compare(base, new, threshold=0.1):
+    '''Print the change of each result present in both runs.  Returns the
+    list of results which got worse by more than threshold.
+    '''
+    base_results = {key(r): r for r in base['results']}
+    regressions = []
+    print(f"{'result':40s} {'params':28s} {base['commit']:>12s} "
+          f"{new['commit']:>12s} {'change':>8s}")
+    for r in new['results']:
+        b = base_results.get(key(r), None)
+        if b is None or b['value'] == 0:
+            continue
+        ratio = r['value']/b['value']
+        change = ratio - 1 if r['better'] == 'higher' else 1/ratio - 1
+        flag = ''
+        if change < -threshold:
+            flag = ' worse'
+            regressions.append(r)
+        params = ','.join([f'{k}={v}' for k,v in r['params'].items()])
+        print(f"{r['name']:40s} {params:28s} {b['value']:12.4g} "
+              f"{r['value']:12.4g} {change:+8.1%}{flag}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true',
+                        help='Smaller problem sizes')
+    parser.add_argument('--only', default=None,
+                        help=f'Comma separated subset of {",".join(BENCHMARKS)}')
+    parser.add_argument('--output', default=None, help='Output JSON file')
+    parser.add_argument('--compare', nargs=2, default=None,
+                        metavar=('BASE', 'NEW'), help='Compare two result files')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Fractional change reported as a regression')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        with open(args.compare[0]) as FO:
+            base = json.load(FO)
+        with open(args.compare[1]) as FO:
+            new = json.load(FO)
+        regressions = compare(base, new, threshold=args.threshold)
+        sys.exit(1 if len(regressions) > 0 else 0)
+
+    names = args.only.split(',') if args.only is not None else BENCHMARKS
+    output = run_suite(names=names, quick=args.quick)
+    if args.output is None:
+        file = Path(__file__).parent/'results'/f"{output['commit']}.json"
+    else:
+        file = Path(args.output)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    with open(file, 'w') as FO:
+        json.dump(output, FO, indent=2)
+    print(f'Wrote {file}', file=sys.stderr)
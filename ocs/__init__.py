@@ -2,6 +2,11 @@ from pathlib import Path
 import importlib
 import yaml
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
+import json
+from datetime import datetime
 import sys
 from astropy.table import Table
 
@@ -66,32 +71,80 @@ def load_configuration(obsname):
 ##-------------------------------------------------------------------------
 ## Create logger object
 ##-------------------------------------------------------------------------
-def create_log(loglevel_console='INFO', logfile=None, loglevel_file='DEBUG'):
-    if logfile is not None:
+class JSONFormatter(logging.Formatter):
+    '''Format log records as one JSON object per line.  The state and OB
+    attributes are included if they were passed as extras.
+    '''
+    def format(self, record):
+        output = {'time': datetime.fromtimestamp(record.created).isoformat(),
+                  'level': record.levelname,
+                  'logger': record.name,
+                  'thread': record.threadName,
+                  'message': record.getMessage(),
+                  }
+        for key in ['state', 'OB']:
+            if hasattr(record, key):
+                output[key] = getattr(record, key)
+        if record.exc_info:
+            output['exception'] = self.formatException(record.exc_info)
+        return json.dumps(output, default=str)
+
+
+def create_log(loglevel_console='INFO', logfile=None, loglevel_file='DEBUG',
+               jsonlogfile=None, loglevel_json='DEBUG', use_queue=True,
+               logname=None):
+    '''Create the logger.  If use_queue is True, the logger gets a single
+    QueueHandler and the console and file handlers are driven by a
+    QueueListener thread, so no I/O happens on the calling thread.
+
+    The logger level is set to the lowest handler level so that messages
+    which no handler would emit are discarded before they are formatted.
+
+    Loggers are shared by name: if logname is not given it comes from the
+    logfile name (or is RollOffRoof), and a second call with the same name
+    returns the first logger with its handlers unchanged.
+    '''
+    if logname is None and logfile is not None:
         logname = str(Path(logfile).name)
         logname = logname.replace('log_', '').replace('.txt', '')
-    else:
+    elif logname is None:
         logname = 'RollOffRoof'
     log = logging.getLogger(logname)
     if len(log.handlers) == 0:
-        log.setLevel(logging.DEBUG)
+        handlers = []
         ## Set up console output
         LogConsoleHandler = logging.StreamHandler()
         LogConsoleHandler.setLevel(getattr(logging, f'{loglevel_console.upper()}'))
         LogFormat = logging.Formatter('%(asctime)s %(levelname)7s %(message)s')
         LogConsoleHandler.setFormatter(LogFormat)
-        log.addHandler(LogConsoleHandler)
+        handlers.append(LogConsoleHandler)
         ## Set up file output
         if logfile is not None:
             LogFileName = Path(logfile)
             LogFileHandler = logging.FileHandler(LogFileName)
             LogFileHandler.setLevel(getattr(logging, f'{loglevel_file.upper()}'))
             LogFileHandler.setFormatter(LogFormat)
-            log.addHandler(LogFileHandler)
+            handlers.append(LogFileHandler)
+        ## Set up JSON lines output
+        if jsonlogfile is not None:
+            LogJSONHandler = logging.FileHandler(Path(jsonlogfile))
+            LogJSONHandler.setLevel(getattr(logging, f'{loglevel_json.upper()}'))
+            LogJSONHandler.setFormatter(JSONFormatter())
+            handlers.append(LogJSONHandler)
+
+        log.setLevel(min([h.level for h in handlers]))
+        if use_queue is True:
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, *handlers,
+                                     respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop)
+            log.addHandler(QueueHandler(log_queue))
+        else:
+            for handler in handlers:
+                log.addHandler(handler)
 
         log.info(f'Log Started: {logname}')
         if logfile is not None:
             log.info(f'Logging to {LogFileName.absolute()}')
     return log
-
-
@@ -0,0 +1,155 @@
+from copy import deepcopy
+
+
+# Detector config attributes a bias or dark must match
+CALIBRATION_SETTINGS = ['instrument', 'gain', 'binning']
+
+IMAGETYP = {'bias': 'BIAS', 'dark': 'DARK', 'darkflat': 'DARKFLAT'}
+
+
+##-------------------------------------------------------------------------
+## Calibration Frames
+##-------------------------------------------------------------------------
+class Calibration():
+    '''A set of needed calibration frames (bias, dark, or darkflat) for one
+    detector, detector settings, and exposure time.  The key identifies it
+    in the checkpoint journal.
+    '''
+    def __init__(self, kind, detector, dc, exptime, needed, key=None):
+        self.key = key
+        self.kind = kind
+        self.detector = detector
+        self.dc = dc
+        self.exptime = exptime
+        self.needed = needed
+        self.done = 0
+
+
+    def __str__(self):
+        return (f'{self.kind} {self.exptime:.0f}s detector{self.detector} '
+                f'({self.done} of {self.needed})')
+
+
+    @property
+    def remaining(self):
+        return max(0, self.needed - self.done)
+
+
+    @property
+    def imagetyp(self):
+        return IMAGETYP[self.kind]
+
+
+    def detconfig(self):
+        '''A copy of the detector config for one frame of this calibration.
+        '''
+        dc = deepcopy(self.dc)
+        dc.exptime = self.exptime
+        dc.nexp = 1
+        return dc
+
+
+class CalibrationPlan():
+    '''The calibration frames needed for tonight's detector configs, and how
+    many of each have been taken.
+
+    For each detector and each combination of CALIBRATION_SETTINGS used by
+    the OBs, nbias bias frames are needed, and ndark darks at each exposure
+    time used.  Darks for flats (darkflat) are needed at each of the
+    flat_exptimes which is not already covered by a dark.
+    '''
+    def __init__(self, nbias=10, ndark=10, flat_exptimes=[]):
+        self.nbias = nbias
+        self.ndark = ndark
+        self.flat_exptimes = list(flat_exptimes)
+        self.calibrations = {}
+
+
+    def __len__(self):
+        return len(self.calibrations)
+
+
+    @staticmethod
+    def settings(dc):
+        return tuple([str(getattr(dc, attr, None)) for attr in CALIBRATION_SETTINGS])
+
+
+    @staticmethod
+    def key_string(key):
+        detector, settings, exptime = key
+        return '|'.join([str(detector)] + list(settings) + [f'{exptime:g}'])
+
+
+    def add(self, detector, dc):
+        '''Add the calibrations needed for a detector config used on the
+        given detector (by index).
+        '''
+        settings = self.settings(dc)
+        key = (detector, settings, 0)
+        if key not in self.calibrations.keys():
+            self.calibrations[key] = Calibration('bias', detector, dc, 0,
+                                                 self.nbias,
+                                                 key=self.key_string(key))
+        needed = [('dark', float(dc.exptime), self.ndark)]
+        needed.extend([('darkflat', float(t), self.ndark) for t in self.flat_exptimes])
+        for kind, exptime, n in needed:
+            key = (detector, settings, exptime)
+            if exptime > 0 and key not in self.calibrations.keys():
+                self.calibrations[key] = Calibration(kind, detector, dc,
+                                                     exptime, n,
+                                                     key=self.key_string(key))
+
+
+    def add_OBs(self, OBs):
+        '''Add the calibrations needed for the detector configs of a list of
+        OBs (one detector config per detector).
+        '''
+        self.add_detconfigs([getattr(OB, 'detconfig', None) for OB in OBs])
+
+
+    def add_detconfigs(self, detconfigs):
+        '''Add the calibrations needed for a list of OB detector configs (each
+        a list with one detector config per detector), e.g. from
+        Scheduler.detconfigs.
+        '''
+        for detconfig in detconfigs:
+            if detconfig is None:
+                continue
+            if not isinstance(detconfig, (list, tuple)):
+                detconfig = [detconfig]
+            for j,dc in enumerate(detconfig):
+                if dc is not None:
+                    self.add(j, dc)
+
+
+    def missing(self):
+        '''Calibrations with frames still to take: biases first, then darks
+        from the shortest exposure time.
+        '''
+        order = {'bias': 0, 'dark': 1, 'darkflat': 1}
+        missing = [cal for cal in self.calibrations.values() if cal.remaining > 0]
+        return sorted(missing, key=lambda cal: (order[cal.kind], cal.exptime,
+                                                cal.detector))
+
+
+    def next(self):
+        '''The next calibration to take a frame for, or None if done.
+        '''
+        missing = self.missing()
+        return missing[0] if len(missing) > 0 else None
+
+
+    def record(self, calibration):
+        calibration.done += 1
+
+
+    def restore(self, done):
+        '''Set the number of frames already taken from a dict of counts by
+        calibration key (e.g. from the checkpoint journal).
+        '''
+        for cal in self.calibrations.values():
+            cal.done = max(cal.done, int(done.get(cal.key, 0)))
+
+
+    def frames_remaining(self):
+        return sum([cal.remaining for cal in self.calibrations.values()])
@@ -0,0 +1,153 @@
+from pathlib import Path
+from datetime import datetime
+from collections import Counter
+import hashlib
+import threading
+import json
+import os
+import numpy as np
+
+
+def canonical(value, path=()):
+    '''Convert an OB (or a catalog entry) to plain JSON types: objects
+    become a dict of their class and public attributes, so that two OBs
+    with the same contents give the same result regardless of how they
+    print.
+    '''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if id(value) in path:
+        return '<cycle>'
+    path = path + (id(value),)
+    if isinstance(value, dict):
+        return {str(k): canonical(v, path) for k,v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        values = [canonical(v, path) for v in value]
+        return sorted(values, key=json.dumps) if isinstance(value, set) else values
+    if isinstance(value, (np.ndarray, np.generic)):
+        unit = getattr(value, 'unit', None)
+        plain = np.asarray(value).tolist()
+        return plain if unit is None else {'value': plain, 'unit': str(unit)}
+    cls = type(value)
+    fields = getattr(value, '__dict__', None)
+    if fields is None:
+        return {'class': f'{cls.__module__}.{cls.__qualname__}',
+                'value': str(value)}
+    output = {k: canonical(v, path) for k,v in fields.items()
+              if not k.startswith('_') and not callable(v)}
+    output['class'] = f'{cls.__module__}.{cls.__qualname__}'
+    return output
+
+
+def OB_key(OB):
+    '''A key identifying an OB by its contents, which (unlike its position
+    in the OB list) is the same when the list is edited between runs.  A
+    catalog entry is keyed the same way.
+    '''
+    text = json.dumps(canonical(OB), sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def match_OBs(pending, keys):
+    '''Return the IDs of the OBs with the given keys from an iterable of
+    (id, key), e.g. Scheduler.pending_keys().  Each key matches one OB, so
+    a key listed twice matches two identical OBs.
+    '''
+    wanted = Counter(keys)
+    remaining = len(keys)
+    ids = []
+    for id, key in pending:
+        if remaining == 0:
+            break
+        if wanted[key] > 0:
+            wanted[key] -= 1
+            remaining -= 1
+            ids.append(id)
+    return ids
+
+
+##-------------------------------------------------------------------------
+## Checkpoint Journal
+##-------------------------------------------------------------------------
+class Checkpoint():
+    '''Append-only journal of the observatory state used to resume a night
+    after the control process dies.
+
+    Each line is a JSON object with an "event" key:
+    - "state": a snapshot of the observatory state (the latest one wins)
+    - "OB": an OB was completed (all of these are accumulated unless the OB
+      was requeued).  OBs are identified by OB_key.
+    - "calibration": a calibration frame was taken (counted by key)
+    - "end": the night finished normally, there is nothing to resume
+    '''
+    def __init__(self, file, fsync=False):
+        self.file = Path(file).expanduser()
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.FO = None
+
+
+    def write(self, event, **kwargs):
+        entry = {'event': event, 'time': datetime.utcnow().isoformat()}
+        entry.update(kwargs)
+        line = json.dumps(entry, default=str) + '\n'
+        with self.lock:
+            if self.FO is None:
+                self.FO = open(self.file, 'a')
+                if self.FO.tell() > 0 and not self._ends_with_newline():
+                    # Terminate a line left truncated by a crash
+                    self.FO.write('\n')
+            self.FO.write(line)
+            self.FO.flush()
+            if self.fsync is True:
+                os.fsync(self.FO.fileno())
+
+
+    def _ends_with_newline(self):
+        with open(self.file, 'rb') as FO:
+            FO.seek(-1, os.SEEK_END)
+            return FO.read(1) == b'\n'
+
+
+    def close(self):
+        with self.lock:
+            if self.FO is not None:
+                self.FO.close()
+                self.FO = None
+
+
+    def load(self):
+        '''Replay the journal.  Returns None if there is nothing to resume,
+        otherwise the latest state snapshot with a "completed" key listing
+        the keys of all completed OBs and a "calibrations" key with the number
+        of calibration frames taken by calibration key.  A truncated final
+        line (e.g. from a crash mid-write) is ignored.
+        '''
+        if not self.file.exists():
+            return None
+        snapshot = None
+        completed = []
+        calibrations = {}
+        with open(self.file) as FO:
+            for line in FO:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry['event'] == 'state':
+                    snapshot = entry
+                elif entry['event'] == 'OB' and not entry.get('requeued', False):
+                    completed.append(entry['key'])
+                elif entry['event'] == 'calibration':
+                    key = entry['key']
+                    calibrations[key] = calibrations.get(key, 0) + 1
+                elif entry['event'] == 'end':
+                    snapshot = None
+                    completed = []
+                    calibrations = {}
+        if snapshot is None:
+            return None
+        snapshot['completed'] = completed
+        snapshot['calibrations'] = calibrations
+        return snapshot
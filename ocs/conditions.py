@@ -0,0 +1,155 @@
+from functools import wraps
+from time import perf_counter
+import threading
+
+from transitions import Machine, Event
+from transitions.extensions import GraphMachine
+
+
+##-------------------------------------------------------------------------
+## Per Trigger Condition Evaluation
+##-------------------------------------------------------------------------
+class ConditionContext():
+    '''Evaluate each transition condition at most once per trigger.
+
+    The state machine calls begin as a trigger is dispatched (see
+    ConditionEvent), stop once a transition has been chosen
+    (before_state_change), and end when the dispatch is done
+    (finalize_event).  In between, conditions wrapped with the
+    condition decorator return the value they had the first time they were
+    called, so conditions which call each other (e.g. ready_to_open calls
+    not_done_observing which calls done_observing) or which are listed on
+    several candidate transitions are only evaluated once.  Outside of a
+    trigger dispatch conditions are evaluated normally.
+
+    For each dispatch a record is kept of the values of the conditions, how
+    long each took, and which were decisive (see decisive).  Records are
+    kept even when caching is not enabled.
+
+    To replay a recorded night, replay may be set to a deque of recorded
+    records (dicts with trigger, source and values): each dispatch then
+    takes the condition values from the next record instead of evaluating
+    them.
+    '''
+    def __init__(self, transitions=[], enabled=True, history=100):
+        self.enabled = enabled
+        self.candidates = {}
+        for t in transitions:
+            sources = t['source'] if isinstance(t['source'], list) else [t['source']]
+            for source in sources:
+                self.candidates.setdefault((t['trigger'], source), []).append(t)
+        self.history = history
+        self.records = []
+        self.replay = None
+        self.replay_mismatches = 0
+        self.local = threading.local()
+
+
+    @property
+    def active(self):
+        return getattr(self.local, 'record', None)
+
+
+    def begin(self, trigger, source):
+        forced = {}
+        if self.replay is not None:
+            try:
+                recorded = self.replay.popleft()
+            except IndexError:
+                recorded = None
+            if recorded is not None and recorded['trigger'] == trigger\
+               and recorded['source'] == source:
+                forced = recorded['values']
+            else:
+                self.replay_mismatches += 1
+        self.local.record = {'trigger': trigger, 'source': source,
+                             'values': {}, 'seconds': {}, 'calls': 0,
+                             'evaluations': 0, 'forced': forced}
+
+
+    def stop(self):
+        '''Stop caching, so that callbacks of the chosen transition see the
+        current values of any conditions they check.
+        '''
+        record = self.active
+        if record is not None:
+            record['stopped'] = True
+
+
+    def end(self, dest=None):
+        '''Returns the record for this dispatch (or None if there was none in
+        progress).
+        '''
+        record = self.active
+        if record is None:
+            return None
+        self.local.record = None
+        record.pop('stopped', None)
+        record.pop('forced', None)
+        record['dest'] = dest
+        record['decisive'] = self.decisive(record)
+        self.records.append(record)
+        if self.history is not None:
+            self.records = self.records[-self.history:]
+        return record
+
+
+    def evaluate(self, name, function):
+        record = self.active
+        if record is None or record.get('stopped', False) is True:
+            return function()
+        record['calls'] += 1
+        if name in record['forced'].keys():
+            record['values'][name] = record['forced'][name]
+        elif self.enabled is False or name not in record['values'].keys():
+            start = perf_counter()
+            record['values'][name] = function()
+            record['seconds'][name] = perf_counter() - start
+            record['evaluations'] += 1
+        return record['values'][name]
+
+
+    def decisive(self, record):
+        '''The conditions which decided the outcome of a dispatch: for each
+        candidate transition that was checked, the first condition which
+        was False, and all conditions of the transition which was taken.
+        '''
+        decisive = []
+        for t in self.candidates.get((record['trigger'], record['source']), []):
+            values = [(c, record['values'].get(c, None)) for c in t['conditions']]
+            failed = [(c, v) for c,v in values if v is None or not v]
+            if len(failed) == 0:
+                decisive.extend(values)
+                break
+            decisive.append(failed[0])
+        return decisive
+
+
+def condition(method):
+    '''Decorator for RollOffRoof condition methods which evaluates them at
+    most once per trigger (see ConditionContext).
+    '''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.conditions.evaluate(method.__name__,
+                                        lambda: method(self, *args, **kwargs))
+    return wrapper
+
+
+class ConditionEvent(Event):
+    '''Event which starts a ConditionContext (the model's conditions
+    attribute) before the candidate transitions are checked.
+    '''
+    def _process(self, event_data):
+        context = getattr(event_data.model, 'conditions', None)
+        if context is not None:
+            context.begin(self.name, event_data.state.name)
+        return super()._process(event_data)
+
+
+class ConditionMachine(Machine):
+    event_cls = ConditionEvent
+
+
+class ConditionGraphMachine(GraphMachine):
+    event_cls = ConditionEvent
@@ -0,0 +1,114 @@
+import threading
+import logging
+
+from astropy import coordinates as c
+
+from .observatory import RollOffRoof
+from .scheduler import SharedQueue, OBCatalog
+from .targets import TargetResolver
+from .ephemeris import NightlyEphemeris
+from .platesolve import StarCatalog
+from . import create_log
+
+
+##-------------------------------------------------------------------------
+## Run Several Observatories From One Process
+##-------------------------------------------------------------------------
+class Coordinator():
+    '''Run several observatories, each with its own devices and state
+    machine, in one process with one shared queue of OBs (see SharedQueue).
+
+    configs is a list of RollOffRoof keyword arguments, one per observatory
+    (e.g. from ocs.load_configuration, made distinct with
+    ocs.simulator.isolate).  The observatories share one target resolver,
+    one ephemeris per site, and one copy of each star catalog.
+
+    The state machines block while devices move, so each observatory's
+    night runs in its own thread.
+    '''
+    def __init__(self, configs, OBs=[], OB_catalog=None,
+                 target_cache_file=None, candidates=20, lookahead=4*3600,
+                 loglevel_console='INFO', log_queue=True):
+        self.logger = create_log(loglevel_console=loglevel_console,
+                                 use_queue=log_queue, logname='Coordinator')
+        self.resolver = TargetResolver(cache_file=target_cache_file)
+        catalog = OBCatalog(OB_catalog) if OB_catalog is not None else None
+        self.queue = SharedQueue(OBs=OBs, catalog=catalog,
+                                 resolver=self.resolver,
+                                 candidates=candidates, lookahead=lookahead)
+        self.ephemerides = {}
+        self.star_catalogs = {}
+        self.observatories = {}
+        self.threads = {}
+        for config in configs:
+            config = dict(config)
+            key = config.get('name', 'myobservatory')
+            if config.get('instance', None) is not None:
+                key = f"{key}_{config['instance']}"
+            if key in self.observatories.keys():
+                raise ValueError(f'Observatory {key} is configured twice, '
+                                 f'give each an instance')
+            for arg in ['OBs', 'OB_catalog', 'target_cache_file']:
+                config.pop(arg, None)
+            config['ephemeris'] = self.shared_ephemeris(config)
+            if config.get('star_catalog', None) is not None:
+                config['star_catalog'] = self.shared_star_catalog(config['star_catalog'])
+            observatory = RollOffRoof(scheduler=self.queue.view(key),
+                                      resolver=self.resolver, **config)
+            self.queue.register(key, observatory)
+            self.observatories[key] = observatory
+            self.log(f'Added observatory {key}')
+
+
+    def log(self, msg, level=logging.INFO):
+        self.logger.log(level, msg)
+
+
+    def shared_ephemeris(self, config):
+        site = tuple([float(config.get(k, 0)) for k in ['lat', 'lon', 'height']])
+        if site not in self.ephemerides.keys():
+            location = c.EarthLocation(lat=site[0], lon=site[1], height=site[2])
+            cache_dir = config.get('ephemeris_cache_dir', None)
+            self.ephemerides[site] = NightlyEphemeris(location,
+                                                      cache_dir=cache_dir)
+        return self.ephemerides[site]
+
+
+    def shared_star_catalog(self, star_catalog):
+        if isinstance(star_catalog, StarCatalog):
+            return star_catalog
+        if star_catalog not in self.star_catalogs.keys():
+            self.star_catalogs[star_catalog] = StarCatalog(star_catalog)
+        return self.star_catalogs[star_catalog]
+
+
+    def run_night(self, key):
+        observatory = self.observatories[key]
+        try:
+            observatory.wake_up()
+        except Exception as err:
+            self.log(f'{key} stopped: {err}', level=logging.ERROR)
+        self.log(f'{key} finished the night in state {observatory.state}')
+
+
+    def start(self):
+        for key in self.observatories.keys():
+            thread = threading.Thread(target=self.run_night, args=(key,),
+                                      name=key)
+            self.threads[key] = thread
+            thread.start()
+
+
+    def join(self):
+        for thread in self.threads.values():
+            thread.join()
+        self.log(f'{len(self.queue)} OBs were not observed')
+        return {key: str(o.state) for key,o in self.observatories.items()}
+
+
+    def run(self):
+        '''Run the night at every observatory and wait for them all to
+        finish.  Returns the final state of each observatory.
+        '''
+        self.start()
+        return self.join()
@@ -0,0 +1,226 @@
+from time import monotonic
+from copy import deepcopy
+from functools import wraps
+import threading
+import logging
+
+
+##-------------------------------------------------------------------------
+## Device State Mirror
+##-------------------------------------------------------------------------
+_reading = threading.local()
+
+
+def mirror_read():
+    '''True while the current thread is querying a device for a DeviceMirror
+    (from the poller or from a read of an invalid entry).
+    '''
+    return getattr(_reading, 'active', False)
+
+
+class Entry():
+    def __init__(self, function, period):
+        self.function = function
+        self.period = period
+        self.value = None
+        self.timestamp = None
+        self.valid = False
+        self.generation = 0
+        self.due = 0
+        self.error = None
+
+
+class DeviceMirror():
+    '''Keep an in-memory copy of device status, polled in a background thread.
+
+    Each entry (e.g. "telescope.atpark") is a device query which is polled
+    every period seconds.  Reads are served from memory along with the time
+    the value was read, so control logic does not wait on a round trip to
+    the device for each status check.
+
+    Sending a command to a device (see invalidate_on) invalidates all of the
+    entries for that device, both when the command is sent and when it
+    returns, and the poller reads them again immediately.  A read of an
+    invalid entry (or one older than max_age) queries the device directly,
+    so a value from before a command is never returned.
+    '''
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+        self.running = False
+
+
+    def log(self, msg, level=logging.INFO):
+        if self.logger is not None:
+            self.logger.log(level, msg)
+
+
+    def add(self, key, function, period):
+        '''Mirror the result of calling function() as key.  A period of None
+        means the entry is only read on demand.
+        '''
+        with self.lock:
+            self.entries[key] = Entry(function, period)
+
+
+    def watch(self, device, device_name, queries, periods={}):
+        '''Add an entry "{device_name}.{key}" for each key, (method, period) in
+        the queries dict.  Periods may be overridden by key in periods.
+        Methods the device does not have are skipped.
+        '''
+        for key, (method, period) in queries.items():
+            function = getattr(device, method, None)
+            if function is None:
+                continue
+            name = f'{device_name}.{key}'
+            self.add(name, function, periods.get(name, period))
+
+
+    def invalidate_on(self, device, device_name, methods):
+        '''Replace the given command methods on a device instance with
+        versions which invalidate the device's entries.  Methods the device
+        does not have are skipped.
+        '''
+        for method in methods:
+            function = getattr(device, method, None)
+            if function is None:
+                continue
+            setattr(device, method, self.invalidating(function, device_name))
+
+
+    def invalidating(self, function, device_name):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            self.invalidate(device_name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.invalidate(device_name)
+        return wrapper
+
+
+    def invalidate(self, device_name=None):
+        '''Invalidate the entries for a device (or all entries) and have the
+        poller read them again.
+        '''
+        with self.wakeup:
+            for key, entry in self.entries.items():
+                if device_name is None or key.split('.')[0] == device_name:
+                    entry.valid = False
+                    entry.generation += 1
+                    entry.due = 0
+            self.wakeup.notify()
+
+
+    ##-------------------------------------------------------------------------
+    ## Reading
+    def refresh(self, key):
+        '''Query the device and store the result.  A result is discarded if
+        the entry was invalidated while the query was in progress.
+        '''
+        entry = self.entries[key]
+        with self.lock:
+            generation = entry.generation
+        _reading.active = True
+        try:
+            value = entry.function()
+        except Exception as err:
+            with self.lock:
+                entry.error = err
+                if entry.period is not None:
+                    entry.due = monotonic() + entry.period
+            raise
+        finally:
+            _reading.active = False
+        with self.lock:
+            if entry.generation == generation:
+                entry.value = value
+                entry.timestamp = monotonic()
+                entry.valid = True
+                entry.error = None
+                if entry.period is not None:
+                    entry.due = entry.timestamp + entry.period
+        return value
+
+
+    def get(self, key, max_age=None, copy=False):
+        '''Return the mirrored value of key.  If the entry is invalid or older
+        than max_age seconds the device is queried.  Use copy for values
+        such as headers which the caller will modify.
+        '''
+        entry = self.entries[key]
+        with self.lock:
+            fresh = entry.valid and (max_age is None\
+                                     or monotonic() - entry.timestamp <= max_age)
+            value = entry.value
+        if not fresh:
+            value = self.refresh(key)
+        return deepcopy(value) if copy is True else value
+
+
+    def peek(self, key):
+        '''Return the mirrored value of key without querying the device, or
+        None if it is invalid.
+        '''
+        entry = self.entries[key]
+        with self.lock:
+            return entry.value if entry.valid else None
+
+
+    def age(self, key):
+        '''Seconds since the value of key was read, or None if it is invalid.
+        '''
+        entry = self.entries[key]
+        with self.lock:
+            if not entry.valid:
+                return None
+            return monotonic() - entry.timestamp
+
+
+    def ages(self):
+        return {key: self.age(key) for key in list(self.entries.keys())}
+
+
+    ##-------------------------------------------------------------------------
+    ## Poller
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.poll, name='device_state',
+                                       daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        if self.thread is None:
+            return
+        with self.wakeup:
+            self.running = False
+            self.wakeup.notify()
+        self.thread.join()
+        self.thread = None
+
+
+    def poll(self):
+        while True:
+            with self.wakeup:
+                if self.running is False:
+                    return
+                now = monotonic()
+                due = [(entry.due, key) for key, entry in self.entries.items()
+                       if entry.period is not None]
+                if len(due) == 0:
+                    self.wakeup.wait()
+                    continue
+                when, key = min(due)
+                if when > now:
+                    self.wakeup.wait(timeout=when - now)
+                    continue
+            try:
+                self.refresh(key)
+            except Exception as err:
+                self.log(f'Polling {key} failed: {err}', level=logging.WARNING)
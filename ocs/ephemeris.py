@@ -0,0 +1,177 @@
+from pathlib import Path
+from datetime import datetime, timedelta
+import threading
+import numpy as np
+
+from astropy import units as u
+from astropy import coordinates as c
+from astropy.time import Time
+
+
+TWILIGHT_PHASES = [(0, 'day'), (-6, 'civil twilight'),
+                   (-12, 'nautical twilight'), (-18, 'astronomical twilight')]
+
+
+##-------------------------------------------------------------------------
+## Nightly Ephemeris
+##-------------------------------------------------------------------------
+class NightlyEphemeris():
+    '''Sun and moon positions for one night at one site, computed once on a
+    fine time grid and then interpolated.
+
+    The grid covers 24 hours starting at local (mean solar) noon before the
+    night.  The tables are cached on disk keyed by site and date, and a new
+    night is computed automatically when asked about a time outside the
+    current grid.
+    '''
+    def __init__(self, location, step=2*u.min, cache_dir=None):
+        self.location = location
+        self.step = step.to(u.day).value
+        self.cache_dir = Path(cache_dir).expanduser()\
+                         if cache_dir is not None else None
+        self.night = None
+        self.jd = None
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def _interp(jd, jdgrid, values):
+        return np.interp(jd, jdgrid, values)
+
+
+    def night_of(self, time):
+        '''Return the local date of the evening starting the night which
+        contains time.
+        '''
+        local = time.to_datetime() + timedelta(hours=self.location.lon.deg/15)
+        return (local - timedelta(hours=12)).date()
+
+
+    def noon(self, night):
+        '''Return the time of local (mean solar) noon before the given night,
+        which is where the night's grid starts.
+        '''
+        return Time(datetime(night.year, night.month, night.day, 12)\
+                    - timedelta(hours=self.location.lon.deg/15))
+
+
+    def cache_file(self, night):
+        lat = f'{self.location.lat.deg:+.4f}'
+        lon = f'{self.location.lon.deg:+.4f}'
+        return self.cache_dir / f'ephem_{lat}_{lon}_{night.isoformat()}.npz'
+
+
+    def compute(self, night):
+        '''Fill the sun and moon tables for the given night.
+        '''
+        if self.cache_dir is not None and self.cache_file(night).exists():
+            tables = np.load(self.cache_file(night))
+            self.set_tables(night, **{k: tables[k] for k in tables.files})
+            return
+        t0 = self.noon(night)
+        n = int(np.ceil(1/self.step)) + 1
+        times = t0 + np.arange(n)*self.step*u.day
+        altaz = c.AltAz(obstime=times, location=self.location)
+        sun = c.get_sun(times).transform_to(altaz)
+        moon = c.get_body('moon', times, location=self.location)
+        moon_altaz = moon.transform_to(altaz)
+        # Direction to the moon as seen from the site, as unit vectors
+        moon_xyz = moon.cartesian.xyz.value.T
+        moon_xyz /= np.linalg.norm(moon_xyz, axis=1)[:,None]
+        tables = {'jd': times.jd,
+                  'sun_alt': sun.alt.deg,
+                  'moon_alt': moon_altaz.alt.deg,
+                  'moon_xyz': moon_xyz,
+                  }
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            np.savez(self.cache_file(night), **tables)
+        self.set_tables(night, **tables)
+
+
+    def set_tables(self, night, jd=None, sun_alt=None, moon_alt=None,
+                   moon_xyz=None):
+        self.night = night
+        self.jd = jd
+        self.sun_alt_table = sun_alt
+        self.moon_alt_table = moon_alt
+        self.moon_xyz_table = moon_xyz
+
+
+    def _jd(self, time):
+        if time is None:
+            time = Time.now()
+        jd = time.jd
+        if self.jd is None or np.any(jd < self.jd[0]) or np.any(jd > self.jd[-1]):
+            # One instance may be shared by observatories at the same site
+            with self.lock:
+                night = self.night_of(time if time.isscalar else time[0])
+                if night != self.night:
+                    self.compute(night)
+        return jd
+
+
+    def dark_window(self, night, sun_alt=-12):
+        '''Start and end times of the dark part of a night (sun below
+        sun_alt), or None if the sun never gets that low.
+        '''
+        with self.lock:
+            if night != self.night:
+                self.compute(night)
+            jd, alt = self.jd, self.sun_alt_table
+        dark = np.flatnonzero(alt < sun_alt)
+        if len(dark) == 0:
+            return None
+        return Time(jd[dark[0]], format='jd'), Time(jd[dark[-1]], format='jd')
+
+
+    def night_end(self, time=None, sun_alt=-12):
+        '''The end of the dark part of the night in progress at time (or
+        still to come that evening).  If time is after the dark part of its
+        night (i.e. in the morning), this is the end of the next night.
+        Returns None if neither night gets dark.
+        '''
+        time = Time.now() if time is None else time
+        night = self.night_of(time)
+        for n in [night, night + timedelta(days=1)]:
+            window = self.dark_window(n, sun_alt=sun_alt)
+            if window is not None and window[1] > time:
+                return window[1]
+        return None
+
+
+    ##-------------------------------------------------------------------------
+    ## Queries
+    def sun_alt(self, time=None):
+        jd = self._jd(time)
+        return self._interp(jd, self.jd, self.sun_alt_table)
+
+
+    def moon_alt(self, time=None):
+        jd = self._jd(time)
+        return self._interp(jd, self.jd, self.moon_alt_table)
+
+
+    def is_dark(self, time=None, sun_alt=-12):
+        return bool(self.sun_alt(time) < sun_alt)
+
+
+    def twilight_phase(self, time=None):
+        alt = self.sun_alt(time)
+        for limit, phase in TWILIGHT_PHASES:
+            if alt > limit:
+                return phase
+        return 'night'
+
+
+    def moon_separation(self, coord, time=None):
+        '''Angular separation in degrees between coord and the moon.
+        '''
+        jd = self._jd(time)
+        xyz = np.array([self._interp(jd, self.jd, self.moon_xyz_table[:,i])
+                        for i in range(3)])
+        xyz /= np.linalg.norm(xyz, axis=0)
+        target = coord.icrs.cartesian.xyz.value
+        target = target / np.linalg.norm(target, axis=0)
+        cosine = np.clip(np.sum(xyz*target, axis=0), -1, 1)
+        return np.degrees(np.arccos(cosine))
@@ -0,0 +1,133 @@
+from time import monotonic
+import threading
+
+
+##-------------------------------------------------------------------------
+## Exposure Clock
+##-------------------------------------------------------------------------
+class ExposureClock():
+    '''Coordinate the exposure threads of several detectors at one pattern
+    position.
+
+    All threads wait at a barrier (see start) so that the detectors begin
+    exposing together.  Each thread then reports when it expects to finish
+    its required frames (see update).  With free_run, a detector which has
+    finished its required frames keeps taking extra frames as long as each
+    is expected to end before the slowest detector finishes, so no shutter
+    sits closed while another detector is still exposing.
+
+    Threads also report when each frame starts and stops integrating (see
+    begin_frame and end_integration) so that the observatory can move the
+    telescope as soon as the last frame at this position has been
+    integrated, while it is still being read out (see wait_integrated).
+    '''
+    def __init__(self, ndetectors, free_run=False, timeout=60):
+        self.barrier = threading.Barrier(ndetectors, timeout=timeout)
+        self.free_run = free_run
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.finish = [None]*ndetectors
+        self.integrating = [False]*ndetectors
+        self.frame_ids = [0]*ndetectors
+        self.last_required = [False]*ndetectors
+        self.required_done = [False]*ndetectors
+        self.stopped = False
+
+
+    def start(self, index, nframes, frame_time):
+        '''Wait for all detectors to be ready.  Returns False if the barrier
+        was broken (another thread failed or timed out) in which case the
+        exposures start unsynchronized.
+        '''
+        try:
+            self.barrier.wait()
+            synchronized = True
+        except threading.BrokenBarrierError:
+            synchronized = False
+        self.update(index, nframes, frame_time)
+        if nframes <= 0:
+            self.finished(index)
+        return synchronized
+
+
+    def abort(self):
+        '''Release any threads waiting at the barrier, e.g. when one detector
+        fails before it is ready.
+        '''
+        self.barrier.abort()
+
+
+    def update(self, index, remaining, frame_time):
+        '''Record that a detector expects to take remaining more required
+        frames of frame_time seconds each.
+        '''
+        with self.lock:
+            self.finish[index] = monotonic() + remaining*frame_time
+
+
+    def extra_frame_fits(self, index, frame_time):
+        '''True if a detector which has taken its required frames can take
+        another frame of frame_time seconds before the others finish.
+        '''
+        if self.free_run is False:
+            return False
+        with self.lock:
+            if self.stopped is True:
+                return False
+            others = [f for i,f in enumerate(self.finish)
+                      if i != index and f is not None]
+        if len(others) == 0:
+            return False
+        return monotonic() + frame_time <= max(others)
+
+
+    ##-------------------------------------------------------------------------
+    ## Integration Tracking
+    def begin_frame(self, index, last_required=False, extra=False):
+        '''Called as a frame starts.  Returns an ID for the frame to pass to
+        end_integration, or None if an extra (free running) frame may not
+        start because the telescope is about to move.
+        '''
+        with self.lock:
+            if extra is True and self.stopped is True:
+                return None
+            self.integrating[index] = True
+            self.last_required[index] = last_required
+            self.frame_ids[index] += 1
+            return self.frame_ids[index]
+
+
+    def end_integration(self, index, frame_id):
+        '''Called when a frame has finished integrating (it may still be
+        reading out).  Calling it more than once per frame is harmless.
+        '''
+        with self.condition:
+            if frame_id != self.frame_ids[index]:
+                return
+            self.integrating[index] = False
+            if self.last_required[index] is True:
+                self.required_done[index] = True
+            self.condition.notify_all()
+
+
+    def finished(self, index):
+        '''Called when a detector's thread is done (or has failed).
+        '''
+        with self.condition:
+            self.integrating[index] = False
+            self.required_done[index] = True
+            self.condition.notify_all()
+
+
+    def wait_integrated(self, timeout=None):
+        '''Wait until every detector has integrated its required frames and
+        none is integrating, then stop any further free running frames.
+        Returns False on timeout.
+        '''
+        with self.condition:
+            done = self.condition.wait_for(lambda: all(self.required_done)
+                                           and not any(self.integrating),
+                                           timeout=timeout)
+            if done is True:
+                self.stopped = True
+            return done
@@ -1,5 +1,9 @@
+import numpy as np
+
 from odl.block import FocusBlock
 
+from .exceptions import FocusRunFailure
+
 
 ##-------------------------------------------------------------------------
 ## Focus Routines
@@ -22,6 +26,14 @@ class FocusFitParabola(FocusBlock):
         self.refocus_if_near_edge = refocus_if_near_edge
 
 
+    def focus_offsets(self):
+        '''Focuser offsets, relative to the starting position, for each step
+        of the focus series.
+        '''
+        n = self.n_focus_positions
+        return (np.arange(n) - (n-1)/2) * self.focus_step
+
+
 class FocusMaxRun(FocusBlock):
     '''Trigger a FocusMax run.
     '''
@@ -30,3 +42,25 @@ class FocusMaxRun(FocusBlock):
                  ):
         super().__init__(target=target, pattern=pattern, instconfig=instconfig,
                          detconfig=detconfig, align=align, blocktype=blocktype)
+
+
+##-------------------------------------------------------------------------
+## Focus Curve Fitting
+##-------------------------------------------------------------------------
+def fit_parabola(positions, fwhm, min_points=3):
+    '''Fit a parabola to FWHM as a function of focuser position.  Points
+    where the FWHM could not be measured (NaN) are ignored.
+
+    Returns the position of the minimum and the FWHM at that position.
+    '''
+    positions = np.asarray(positions, dtype=float)
+    fwhm = np.asarray(fwhm, dtype=float)
+    ok = np.isfinite(fwhm)
+    if np.sum(ok) < min_points:
+        raise FocusRunFailure(f'Only {np.sum(ok)} focus frames had measurable stars')
+    a, b, c = np.polyfit(positions[ok], fwhm[ok], 2)
+    if a <= 0:
+        raise FocusRunFailure('Focus curve has no minimum')
+    best_position = -b / (2*a)
+    best_fwhm = c - b**2 / (4*a)
+    return best_position, best_fwhm
@@ -0,0 +1,99 @@
+from pathlib import Path
+from datetime import datetime
+import numpy as np
+import yaml
+
+
+##-------------------------------------------------------------------------
+## Focus vs. Temperature Model
+##-------------------------------------------------------------------------
+class FocusModel():
+    '''Persistent linear model of best focus position vs. focuser temperature
+    for each filter and focuser, learned from the results of past focus runs.
+
+    Predictions come with the 1 sigma prediction uncertainty of the linear
+    fit so the caller can decide whether a full focus run is needed.  The
+    scatter about the fit is taken to be at least min_scatter (in focuser
+    steps), so a few points which happen to lie on a line do not give a
+    perfect prediction.
+    '''
+    def __init__(self, file=None, min_points=3, max_points=100,
+                 max_uncertainty=20, min_scatter=5):
+        self.file = Path(file).expanduser() if file is not None else None
+        self.min_points = min_points
+        self.min_scatter = min_scatter
+        self.max_points = max_points
+        self.max_uncertainty = max_uncertainty
+        self.points = {}
+        if self.file is not None and self.file.exists():
+            with open(self.file) as FO:
+                self.points = yaml.safe_load(FO) or {}
+
+
+    @staticmethod
+    def key(filter, focuser):
+        return f'{filter}|{focuser}'
+
+
+    def add(self, filter, focuser, temperature, position, save=True):
+        '''Add the result of a focus run to the model.
+        '''
+        if temperature is None or not np.isfinite(temperature):
+            return
+        key = self.key(filter, focuser)
+        entries = self.points.get(key, [])
+        entries.append({'temperature': float(temperature),
+                        'position': float(position),
+                        'date': datetime.utcnow().isoformat()})
+        self.points[key] = entries[-self.max_points:]
+        if save is True:
+            self.save()
+
+
+    def save(self):
+        if self.file is None:
+            return
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.file.with_suffix('.tmp')
+        with open(tmp, 'w') as FO:
+            yaml.safe_dump(self.points, FO)
+        tmp.replace(self.file)
+
+
+    def predict(self, filter, focuser, temperature):
+        '''Return the predicted focus position and its uncertainty for the
+        given filter, focuser, and temperature.  The uncertainty is infinite
+        if there are too few points to make a prediction: at least
+        min_points, and at least two more than the number of fit parameters
+        so that the scatter is measured.
+        '''
+        entries = self.points.get(self.key(filter, focuser), [])
+        n = len(entries)
+        if n < self.min_points or temperature is None:
+            return None, np.inf
+        T = np.array([e['temperature'] for e in entries])
+        P = np.array([e['position'] for e in entries])
+        Tmean = T.mean()
+        Sxx = np.sum((T - Tmean)**2)
+        if Sxx < 1e-6:
+            # No temperature leverage: only trust the mean near that temperature
+            nparams = 1
+            slope = 0
+            extrapolation = 0 if abs(temperature - Tmean) < 0.5 else np.inf
+        else:
+            nparams = 2
+            slope = np.sum((T - Tmean)*(P - P.mean())) / Sxx
+            extrapolation = (temperature - Tmean)**2 / Sxx
+        if n <= nparams + 1:
+            return None, np.inf
+        intercept = P.mean() - slope*Tmean
+        residuals = P - (intercept + slope*T)
+        scatter = np.sqrt(np.sum(residuals**2) / (n - nparams))
+        scatter = max(scatter, self.min_scatter)
+        position = intercept + slope*temperature
+        uncertainty = scatter * np.sqrt(1 + 1/n + extrapolation)
+        return position, uncertainty
+
+
+    def good_enough(self, uncertainty):
+        return bool(uncertainty <= self.max_uncertainty)
@@ -0,0 +1,166 @@
+from multiprocessing import shared_memory, resource_tracker
+import atexit
+import json
+import numpy as np
+
+from .imageanalysis import downsample
+
+
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('nslots', '<u4'),
+                         ('slot_bytes', '<u8'), ('count', '<u8')])
+HEADER_SIZE = 64
+META_SIZE = 1024
+MAGIC = b'OCSFRAME'
+
+
+def image_data(hdul):
+    '''Return the first 2D image in an HDUList, or None.
+    '''
+    for hdu in hdul:
+        if hdu.data is not None and getattr(hdu.data, 'ndim', 0) == 2:
+            return hdu.data
+    return None
+
+
+##-------------------------------------------------------------------------
+## Shared Memory Frame Ring Buffer
+##-------------------------------------------------------------------------
+class FrameRing():
+    '''A ring buffer of frames in shared memory, written by the observatory
+    and read by quick-look processes without touching the disk.
+
+    The shared memory block starts with a header (magic, number of slots,
+    slot size, and a count of frames written) followed by the slots.  Each
+    slot holds a sequence number, a JSON metadata block (shape, dtype, and
+    whatever the writer passes such as the file name), and the frame data.
+
+    There is one writer.  The slot sequence number is odd while a frame is
+    being written, so a reader can tell if a frame was overwritten while it
+    was reading it (see valid).
+    '''
+    def __init__(self, name, nslots=4, slot_bytes=None, create=False):
+        self.name = name
+        self.create = create
+        if create is True:
+            size = HEADER_SIZE + nslots*(META_SIZE + slot_bytes)
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                      size=size)
+            except FileExistsError:
+                # Left over from a process which did not exit cleanly
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                      size=size)
+            self.header = np.ndarray((), dtype=HEADER_DTYPE,
+                                     buffer=self.shm.buf)
+            self.header['nslots'] = nslots
+            self.header['slot_bytes'] = slot_bytes
+            self.header['count'] = 0
+            self.header['magic'] = MAGIC
+            atexit.register(self.close)
+        else:
+            # Only the creator should remove the block when done
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                self.shm = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            self.header = np.ndarray((), dtype=HEADER_DTYPE,
+                                     buffer=self.shm.buf)
+            if self.header['magic'] != MAGIC:
+                raise ValueError(f'{name} is not a frame ring buffer')
+        self.nslots = int(self.header['nslots'])
+        self.slot_bytes = int(self.header['slot_bytes'])
+        self.seqs = [np.ndarray((), dtype='<u8', buffer=self.shm.buf,
+                                offset=self.slot_offset(i))
+                     for i in range(self.nslots)]
+
+
+    @classmethod
+    def attach(cls, name):
+        return cls(name, create=False)
+
+
+    def __len__(self):
+        return int(self.header['count'])
+
+
+    def slot_offset(self, slot):
+        return HEADER_SIZE + slot*(META_SIZE + self.slot_bytes)
+
+
+    ##-------------------------------------------------------------------------
+    ## Writer
+    def publish(self, data, **metadata):
+        '''Copy a frame in to the next slot.  Returns the frame number, or
+        None if the frame does not fit in a slot.
+        '''
+        data = np.ascontiguousarray(data)
+        if data.nbytes > self.slot_bytes:
+            return None
+        n = int(self.header['count'])
+        slot = n % self.nslots
+        offset = self.slot_offset(slot)
+        metadata.update({'frame': n, 'shape': list(data.shape),
+                         'dtype': data.dtype.str})
+        meta = json.dumps(metadata, default=str).encode()[:META_SIZE-16]
+        self.seqs[slot][...] = 2*n + 1
+        self.shm.buf[offset+8:offset+12] = np.uint32(len(meta)).tobytes()
+        self.shm.buf[offset+16:offset+16+len(meta)] = meta
+        frame = np.ndarray(data.shape, dtype=data.dtype, buffer=self.shm.buf,
+                           offset=offset+META_SIZE)
+        frame[...] = data
+        self.seqs[slot][...] = 2*n + 2
+        self.header['count'] = n + 1
+        return n
+
+
+    ##-------------------------------------------------------------------------
+    ## Reader
+    def valid(self, n):
+        '''True if frame n is completely written and not yet overwritten.
+        '''
+        return int(self.seqs[n % self.nslots]) == 2*n + 2
+
+
+    def read(self, n, copy=True):
+        '''Return (metadata, data) for frame n, or None if it is no longer (or
+        not yet) available.  With copy=False the data are a view in to the
+        shared memory: check valid(n) after using them.
+        '''
+        if not self.valid(n):
+            return None
+        offset = self.slot_offset(n % self.nslots)
+        length = int(np.frombuffer(self.shm.buf, dtype='<u4', count=1,
+                                   offset=offset+8)[0])
+        try:
+            metadata = json.loads(bytes(self.shm.buf[offset+16:offset+16+length]))
+        except ValueError:
+            return None
+        data = np.ndarray(metadata['shape'], dtype=np.dtype(metadata['dtype']),
+                          buffer=self.shm.buf, offset=offset+META_SIZE)
+        if copy is True:
+            data = data.copy()
+        if not self.valid(n):
+            return None
+        return metadata, data
+
+
+    def latest(self, copy=True):
+        n = len(self) - 1
+        if n < 0:
+            return None
+        return self.read(n, copy=copy)
+
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.header = None
+        self.seqs = []
+        self.shm.close()
+        if self.create is True:
+            self.shm.unlink()
+        self.shm = None
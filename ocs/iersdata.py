@@ -0,0 +1,98 @@
+from pathlib import Path
+import shutil
+import numpy as np
+import erfa
+
+from astropy.time import Time
+from astropy.utils import iers
+from astropy.utils.data import download_file
+
+
+IERS_A_NAME = 'finals2000A.all'
+LEAP_SECOND_NAME = 'Leap_Second.dat'
+
+
+##-------------------------------------------------------------------------
+## IERS and Leap Second Tables
+##-------------------------------------------------------------------------
+class IERSData():
+    '''Manage the IERS (earth orientation) and leap second tables used by
+    astropy so that coordinate transforms never go to the network.
+
+    The tables are loaded once from cache_dir if it holds a pre-fetched copy
+    (see fetch) and otherwise from the files bundled with astropy.  Automatic
+    downloads are disabled, and staleness is reported once by load instead
+    of as a warning on every transform.
+    '''
+    def __init__(self, cache_dir=None, max_age=30):
+        self.cache_dir = Path(cache_dir).expanduser()\
+                         if cache_dir is not None else None
+        self.max_age = max_age
+        self.iers_file = None
+        self.leap_second_file = None
+        self.table = None
+        self.leap_seconds = None
+
+
+    def find_file(self, name, bundled):
+        if self.cache_dir is not None and (self.cache_dir/name).exists():
+            return self.cache_dir/name
+        return Path(bundled)
+
+
+    def load(self):
+        '''Load the tables and install them for astropy.  Returns the status
+        dict (see status).
+        '''
+        iers.conf.auto_download = False
+        iers.conf.iers_degraded_accuracy = 'ignore'
+        self.iers_file = self.find_file(IERS_A_NAME, iers.IERS_A_FILE)
+        self.table = iers.IERS_A.open(str(self.iers_file))
+        iers.earth_orientation_table.set(self.table)
+        self.leap_second_file = self.find_file(LEAP_SECOND_NAME,
+                                               iers.IERS_LEAP_SECOND_FILE)
+        self.leap_seconds = iers.LeapSeconds.open(str(self.leap_second_file))
+        erfa.leap_seconds.update(self.leap_seconds)
+        return self.status()
+
+
+    def status(self, now=None):
+        '''Summarize how current the loaded tables are:
+        - measured_until: last date with measured (not predicted) values
+        - predicted_until: last date in the table
+        - leap_seconds_expire: expiration date of the leap second table
+        - age: days since measured_until
+        - stale: True if age exceeds max_age, or predictions or the leap
+          second table have run out
+        '''
+        if now is None:
+            now = Time.now()
+        measured = np.asarray(self.table['PolPMFlag_A']) == 'I'
+        measured_until = Time(self.table['MJD'][measured][-1], format='mjd')
+        predicted_until = Time(self.table['MJD'][-1], format='mjd')
+        expires = Time(self.leap_seconds.expires)
+        age = (now - measured_until).jd
+        stale = bool(age > self.max_age or predicted_until < now
+                     or expires < now)
+        return {'iers_file': str(self.iers_file),
+                'leap_second_file': str(self.leap_second_file),
+                'measured_until': measured_until.iso[:10],
+                'predicted_until': predicted_until.iso[:10],
+                'leap_seconds_expire': expires.iso[:10],
+                'age': float(age),
+                'stale': stale,
+                }
+
+
+    def fetch(self):
+        '''Download current tables in to cache_dir.  This is for use when the
+        network is available (e.g. during the day), not while observing.
+        '''
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        for url, name in [(iers.conf.iers_auto_url, IERS_A_NAME),
+                          (iers.conf.iers_leap_second_auto_url, LEAP_SECOND_NAME)]:
+            downloaded = download_file(url, cache=False,
+                                       timeout=iers.conf.remote_timeout)
+            tmp = self.cache_dir/f'{name}.tmp'
+            shutil.move(downloaded, tmp)
+            tmp.replace(self.cache_dir/name)
@@ -0,0 +1,197 @@
+import numpy as np
+
+
+def downsample(data, factor):
+    '''Block average a 2D image by an integer factor, trimming any partial
+    blocks at the edges.
+    '''
+    if factor <= 1:
+        return data
+    ny, nx = data.shape[0]//factor, data.shape[1]//factor
+    blocks = data[:ny*factor, :nx*factor].reshape(ny, factor, nx, factor)
+    return blocks.mean(axis=(1, 3))
+
+
+##-------------------------------------------------------------------------
+## Background Estimation
+##-------------------------------------------------------------------------
+def background_mesh(data, box=64):
+    '''Estimate the background and background noise of an image on a coarse
+    mesh of box x box pixel cells.  Each cell is sigma clipped once about its
+    median and the mesh is expanded back to the full image size.
+
+    Returns background and rms arrays with the same shape as the input.
+    '''
+    data = np.asarray(data, dtype=np.float32)
+    ny, nx = data.shape
+    box = max(4, min(box, ny, nx))
+    my, mx = ny // box, nx // box
+    cells = data[:my*box, :mx*box].reshape(my, box, mx, box)
+    cells = cells.transpose(0, 2, 1, 3).reshape(my, mx, box*box)
+    med = np.median(cells, axis=2)
+    mad = np.median(np.abs(cells - med[:,:,None]), axis=2)
+    # Clip stars out of each cell and take the mean and rms of the remainder
+    keep = np.abs(cells - med[:,:,None]) < 3*1.4826*mad[:,:,None] + 1e-6
+    n = np.maximum(keep.sum(axis=2), 1)
+    med = np.where(keep, cells, 0).sum(axis=2) / n
+    rms = np.sqrt(np.where(keep, (cells - med[:,:,None])**2, 0).sum(axis=2) / n)
+    # Expand mesh to full frame, repeating the last cell into any remainder
+    iy = np.minimum(np.arange(ny) // box, my - 1)
+    ix = np.minimum(np.arange(nx) // box, mx - 1)
+    bkg = med[iy][:,ix]
+    bkgrms = rms[iy][:,ix]
+    return bkg, bkgrms
+
+
+##-------------------------------------------------------------------------
+## Star Detection and Measurement
+##-------------------------------------------------------------------------
+def find_peaks(data, threshold, border=8):
+    '''Return y, x indices of local maxima (in a 3x3 neighborhood) which are
+    above the threshold array and at least border pixels from the edge.
+
+    Only pixels above the threshold are compared to their neighbors, so the
+    cost scales with the number of bright pixels rather than the image size.
+    '''
+    ny, nx = data.shape
+    y, x = np.nonzero(data > threshold)
+    ok = (y >= border) & (y < ny - border) & (x >= border) & (x < nx - border)
+    y, x = y[ok], x[ok]
+    dy, dx = np.mgrid[-1:2, -1:2]
+    neighbors = data[y[:,None,None] + dy[None], x[:,None,None] + dx[None]]
+    is_peak = data[y, x] >= neighbors.max(axis=(1, 2))
+    return y[is_peak], x[is_peak]
+
+
+def measure_stars(data, nsigma=5, box=64, radius=7, saturation=None,
+                  max_stars=500, background=None):
+    '''Detect stars and measure them using image moments.
+
+    All stars are measured at once by stacking cutouts of size
+    (2*radius+1)^2 around each peak into a single (N, size, size) array.
+    A precomputed (background, rms) pair may be given to skip the
+    background estimate.
+
+    Returns a dict of arrays: x, y, flux, peak, fwhm, hfd, ellipticity.
+    '''
+    data = np.asarray(data, dtype=np.float32)
+    if background is None:
+        background = background_mesh(data, box=box)
+    bkg, bkgrms = background
+    sub = data - bkg
+    y, x = find_peaks(sub, nsigma*bkgrms, border=radius+1)
+    peak = sub[y, x]
+    if saturation is not None:
+        ok = data[y, x] < saturation
+        y, x, peak = y[ok], x[ok], peak[ok]
+    # Keep the brightest
+    order = np.argsort(peak)[::-1][:max_stars]
+    y, x, peak = y[order], x[order], peak[order]
+
+    size = 2*radius + 1
+    dy, dx = np.mgrid[-radius:radius+1, -radius:radius+1]
+    cutouts = sub[y[:,None,None] + dy[None,:,:], x[:,None,None] + dx[None,:,:]]
+    cutouts = np.clip(cutouts, 0, None)
+    flux = cutouts.sum(axis=(1, 2))
+    good = flux > 0
+    cutouts, flux, y, x, peak = cutouts[good], flux[good], y[good], x[good], peak[good]
+
+    # First and second moments
+    cx = (cutouts*dx).sum(axis=(1, 2)) / flux
+    cy = (cutouts*dy).sum(axis=(1, 2)) / flux
+    ddx = dx[None,:,:] - cx[:,None,None]
+    ddy = dy[None,:,:] - cy[:,None,None]
+    mxx = (cutouts*ddx**2).sum(axis=(1, 2)) / flux
+    myy = (cutouts*ddy**2).sum(axis=(1, 2)) / flux
+    mxy = (cutouts*ddx*ddy).sum(axis=(1, 2)) / flux
+    # Eigenvalues of the second moment matrix
+    half_trace = (mxx + myy) / 2
+    root = np.sqrt(((mxx - myy) / 2)**2 + mxy**2)
+    a2 = half_trace + root
+    b2 = np.clip(half_trace - root, 0, None)
+    sigma = np.sqrt((a2 + b2) / 2)
+    fwhm = 2*np.sqrt(2*np.log(2)) * sigma
+    ellipticity = np.where(a2 > 0, 1 - np.sqrt(b2 / np.where(a2 > 0, a2, 1)), 0)
+
+    # Half flux diameter
+    r = np.hypot(ddx, ddy).reshape(len(flux), size*size)
+    f = cutouts.reshape(len(flux), size*size)
+    order = np.argsort(r, axis=1)
+    r_sorted = np.take_along_axis(r, order, axis=1)
+    cumflux = np.cumsum(np.take_along_axis(f, order, axis=1), axis=1)
+    ihalf = np.argmax(cumflux >= 0.5*flux[:,None], axis=1)
+    hfd = 2*r_sorted[np.arange(len(flux)), ihalf]
+
+    # Reject hot pixels and blends which fill the cutout
+    ok = (fwhm > 1.0) & (fwhm < radius)
+    return {'x': (x + cx)[ok], 'y': (y + cy)[ok], 'flux': flux[ok],
+            'peak': peak[ok], 'fwhm': fwhm[ok], 'hfd': hfd[ok],
+            'ellipticity': ellipticity[ok]}
+
+
+def measure_frame(data, **kwargs):
+    '''Summarize the star measurements for a single frame.  This is a module
+    level function so that it can be sent to a process pool.
+    '''
+    if data is None:
+        return {'nstars': 0, 'fwhm': np.nan, 'hfd': np.nan,
+                'ellipticity': np.nan}
+    stars = measure_stars(data, **kwargs)
+    nstars = len(stars['fwhm'])
+    if nstars == 0:
+        return {'nstars': 0, 'fwhm': np.nan, 'hfd': np.nan,
+                'ellipticity': np.nan}
+    return {'nstars': nstars,
+            'fwhm': float(np.median(stars['fwhm'])),
+            'hfd': float(np.median(stars['hfd'])),
+            'ellipticity': float(np.median(stars['ellipticity'])),
+            }
+
+
+##-------------------------------------------------------------------------
+## Frame Quality
+##-------------------------------------------------------------------------
+def frame_quality(data, factor=2, saturation=None, box=64, **kwargs):
+    '''Quality metrics for a single frame: background, noise (per pixel),
+    number of saturated pixels, and the number of stars with their median
+    FWHM, HFD, and ellipticity.
+
+    The background mesh, which is most of the cost, is estimated on a block
+    averaged copy of the frame.  Stars are measured at full resolution so
+    that they are not undersampled.  If no saturation level is given, the
+    maximum value of an integer data type is used.
+    '''
+    data = np.asarray(data)
+    if saturation is None and np.issubdtype(data.dtype, np.integer):
+        saturation = np.iinfo(data.dtype).max
+    nsaturated = int(np.count_nonzero(data >= saturation))\
+                 if saturation is not None else 0
+    factor = max(int(factor), 1)
+    binned = downsample(np.asarray(data, dtype=np.float32), factor)
+    bkg, bkgrms = background_mesh(binned, box=max(box//factor, 4))
+    # Expand to full resolution, scaling the noise back to a single pixel
+    iy = np.minimum(np.arange(data.shape[0]) // factor, binned.shape[0] - 1)
+    ix = np.minimum(np.arange(data.shape[1]) // factor, binned.shape[1] - 1)
+    background = (bkg[iy][:,ix], bkgrms[iy][:,ix]*factor)
+    quality = {'background': float(np.median(bkg)),
+               'noise': float(np.median(bkgrms))*factor,
+               'nsaturated': nsaturated,
+               }
+    quality.update(measure_frame(data, background=background, **kwargs))
+    return quality
+
+
+def quality_problems(quality, limits):
+    '''Compare frame quality metrics with limits, a dict which may contain
+    max_fwhm, max_ellipticity, min_nstars, max_nsaturated, and
+    max_background.  Returns a list of problems (empty if the frame is good).
+    '''
+    problems = []
+    for key, value in limits.items():
+        kind, metric = key.split('_', 1)
+        measured = quality.get(metric, np.nan)
+        if kind == 'max' and not measured <= value:
+            problems.append(f'{metric} {measured:.2f} > {value}')
+        elif kind == 'min' and not measured >= value:
+            problems.append(f'{metric} {measured:.2f} < {value}')
+    return problems
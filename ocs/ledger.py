@@ -0,0 +1,161 @@
+from pathlib import Path
+from datetime import datetime
+import json
+import numpy as np
+
+from astropy.table import Table
+from astropy.time import Time
+
+
+##-------------------------------------------------------------------------
+## Executed OB Ledger
+##-------------------------------------------------------------------------
+class OBLedger():
+    '''Record of executed observing blocks.
+
+    Rows are appended to per-column buffers (numpy arrays which double in
+    size when full for the numeric columns, lists for the string columns so
+    names are never truncated) and, if a file is given, written immediately
+    as one JSON object per line.  An astropy Table is only built on request.
+    If the file already exists, its rows dated since the given time (e.g.
+    the start of tonight) are loaded first so that a restarted process
+    continues the same ledger without counting earlier nights.
+    '''
+    string_columns = ['date', 'type', 'target', 'pattern', 'instconfig',
+                      'filter', 'detconfig']
+    numeric_columns = {'nframes': np.int32, 'failed': bool,
+                       'nbad': np.int32, 'background': np.float32,
+                       'fwhm': np.float32, 'ellipticity': np.float32}
+
+    def __init__(self, file=None, capacity=64, since=None):
+        self.file = Path(file).expanduser() if file is not None else None
+        self.n = 0
+        self.truncated = False
+        self.strings = {col: [] for col in self.string_columns}
+        self.numbers = {col: np.zeros(capacity, dtype=dtype)
+                        for col,dtype in self.numeric_columns.items()}
+        if self.file is not None:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            if self.file.exists():
+                self._read(self.file, since=since)
+
+
+    def __len__(self):
+        return self.n
+
+
+    def __getitem__(self, col):
+        if col in self.strings.keys():
+            return self.strings[col]
+        return self.numbers[col][:self.n]
+
+
+    def _append(self, row):
+        if self.n == len(self.numbers['failed']):
+            for col in self.numbers.keys():
+                self.numbers[col] = np.resize(self.numbers[col], max(2*self.n, 1))
+        for col in self.string_columns:
+            self.strings[col].append(str(row.get(col, '')))
+        for col,dtype in self.numeric_columns.items():
+            default = np.nan if np.issubdtype(dtype, np.floating) else 0
+            value = row.get(col, default)
+            self.numbers[col][self.n] = default if value is None else value
+        self.n += 1
+
+
+    def add_row(self, row):
+        '''Append a row (a dict keyed by column name) and write it to the
+        ledger file.
+        '''
+        row = dict(row)
+        if 'date' not in row.keys():
+            row['date'] = datetime.utcnow().isoformat()
+        self._append(row)
+        if self.file is not None:
+            with open(self.file, 'a') as FO:
+                if self.truncated is True:
+                    # Terminate a line left truncated by a crash
+                    FO.write('\n')
+                    self.truncated = False
+                FO.write(json.dumps(row, default=str) + '\n')
+
+
+    @classmethod
+    def read(cls, files, since=None):
+        '''Build a ledger (not attached to any file) from one or more ledger
+        files, e.g. the ledgers of many nights.  Only rows dated since the
+        given time (a datetime or astropy Time in UTC) are read.
+        '''
+        if isinstance(files, (str, Path)):
+            files = [files]
+        ledger = cls()
+        for file in files:
+            ledger._read(file, since=since)
+        return ledger
+
+
+    def _read(self, file, since=None):
+        # Dates are UTC ISO strings, so they sort as strings
+        if isinstance(since, Time):
+            since = since.to_datetime()
+        since = since.isoformat() if since is not None else None
+        with open(Path(file).expanduser()) as FO:
+            for line in FO:
+                # A crash can leave the last line without its newline
+                self.truncated = not line.endswith('\n')
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if since is not None and str(row.get('date', '')) < since:
+                    continue
+                self._append(row)
+
+
+    def to_table(self):
+        columns = [self.strings[col] for col in self.string_columns]
+        columns += [self.numbers[col][:self.n] for col in self.numeric_columns]
+        names = self.string_columns + list(self.numeric_columns.keys())
+        if self.n == 0:
+            dtypes = [str]*len(self.string_columns) + list(self.numeric_columns.values())
+            return Table(names=names, dtype=dtypes)
+        return Table(columns, names=names)
+
+
+    ##-------------------------------------------------------------------------
+    ## Queries
+    def select(self, **criteria):
+        '''Return a boolean mask of rows matching all criteria, where each
+        criterion is a column name and a value (or list of values).
+        '''
+        mask = np.ones(self.n, dtype=bool)
+        for col, value in criteria.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            if col in self.strings.keys():
+                values = set([str(v) for v in values])
+                mask &= np.array([v in values for v in self.strings[col]],
+                                 dtype=bool)
+            else:
+                mask &= np.isin(self[col], list(values))
+        return mask
+
+
+    def frames_per_target(self, **criteria):
+        '''Total frames from successful OBs per target, for OBs matching the
+        criteria.  For example frames_per_target(filter='R').
+        '''
+        mask = self.select(failed=False, **criteria)
+        targets = np.array(self.strings['target'], dtype=object)[mask]
+        nframes = self['nframes'][mask]
+        totals = {}
+        for target, n in zip(targets, nframes):
+            totals[target] = totals.get(target, 0) + int(n)
+        return totals
+
+
+    def targets_with_frames(self, nframes, **criteria):
+        '''Targets with at least nframes frames from successful OBs matching
+        the criteria.
+        '''
+        totals = self.frames_per_target(**criteria)
+        return sorted([t for t,n in totals.items() if n >= nframes])
@@ -0,0 +1,191 @@
+from pathlib import Path
+from time import perf_counter
+from contextlib import contextmanager
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import threading
+import bisect
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120,
+                   300, 600)
+
+
+def escape_label(value):
+    '''Escape a label value for the Prometheus text format.
+    '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')\
+                     .replace('\n', '\\n')
+
+
+##-------------------------------------------------------------------------
+## Latency Histograms
+##-------------------------------------------------------------------------
+class Histogram():
+    '''Cumulative latency histogram in the Prometheus style.  Observing a
+    value is a bisect and a few additions under a lock.
+    '''
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+
+
+    def cumulative(self):
+        with self.lock:
+            counts = list(self.counts)
+        total = 0
+        output = []
+        for le, n in zip(self.buckets + (float('inf'),), counts):
+            total += n
+            output.append((le, total))
+        return output
+
+
+class Metrics():
+    '''Registry of latency histograms keyed by metric name and labels.
+    '''
+    def __init__(self, prefix='ocs', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        h = self.histograms.get(key, None)
+        if h is None:
+            with self.lock:
+                h = self.histograms.setdefault(key, Histogram(self.buckets))
+        return h
+
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+
+    @contextmanager
+    def timer(self, name, **labels):
+        h = self.histogram(name, **labels)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            h.observe(perf_counter() - start)
+
+
+    def timed(self, function, name, labeler=None, **labels):
+        '''Wrap a function so that each call is recorded in a histogram.  If
+        given, labeler is called as each call starts and returns a dict of
+        more labels (e.g. the current state).
+        '''
+        h = self.histogram(name, **labels) if labeler is None else None
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            call_h = h if labeler is None\
+                     else self.histogram(name, **labels, **labeler())
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                call_h.observe(perf_counter() - start)
+        return wrapper
+
+
+    def instrument_device(self, device, device_name, methods, labeler=None):
+        '''Replace the given methods on a device instance with timed versions.
+        Methods the device does not have are skipped.
+        '''
+        for method in methods:
+            function = getattr(device, method, None)
+            if function is None:
+                continue
+            setattr(device, method,
+                    self.timed(function, 'device_call_seconds',
+                               labeler=labeler, device=device_name,
+                               method=method))
+
+
+    ##-------------------------------------------------------------------------
+    ## Output
+    def to_prometheus(self):
+        '''Render all histograms in the Prometheus text exposition format.
+        '''
+        lines = []
+        with self.lock:
+            items = sorted(self.histograms.items())
+        last_name = None
+        for (name, labels), h in items:
+            metric = f'{self.prefix}_{name}'
+            if metric != last_name:
+                lines.append(f'# TYPE {metric} histogram')
+                last_name = metric
+            label_str = ','.join([f'{k}="{escape_label(v)}"' for k,v in labels])
+            sep = ',' if label_str else ''
+            for le, n in h.cumulative():
+                le_str = '+Inf' if le == float('inf') else f'{le:g}'
+                lines.append(f'{metric}_bucket{{{label_str}{sep}le="{le_str}"}} {n}')
+            label_str = f'{{{label_str}}}' if label_str else ''
+            lines.append(f'{metric}_sum{label_str} {h.sum:.6f}')
+            lines.append(f'{metric}_count{label_str} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+
+    def summary(self):
+        '''Return a list of (name, labels, count, total, mean, max) tuples.
+        '''
+        with self.lock:
+            items = sorted(self.histograms.items())
+        return [(name, dict(labels), h.count, h.sum,
+                 h.sum / h.count if h.count > 0 else 0, h.max)
+                for (name, labels), h in items]
+
+
+    def dump(self, file):
+        file = Path(file).expanduser()
+        file.parent.mkdir(parents=True, exist_ok=True)
+        with open(file, 'w') as FO:
+            FO.write(self.to_prometheus())
+        return file
+
+
+    def serve(self, port=9464, host='localhost'):
+        '''Serve the metrics over HTTP from a daemon thread.
+        '''
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, format, *args):
+                pass
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        return self.server
+
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
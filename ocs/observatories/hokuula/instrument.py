@@ -70,6 +70,7 @@ class InstrumentController():
         self.filterwheel = FilterWheel(logger=logger, IP=IP, port=port)
         self.focuserSVQ = Focuser(logger=logger, IP=IP, port=port, device_number=0)
         self.focuserSVX = Focuser(logger=logger, IP=IP, port=port, device_number=1)
+        self.focusers = [self.focuserSVQ, self.focuserSVX]
 
 
     def configure(self, ic):
@@ -83,6 +84,18 @@ class InstrumentController():
             self.focuserSVX.move(ic.focusposSVX)
 
 
+    def get_focus(self, focuser=0):
+        return self.focusers[focuser].position()
+
+
+    def set_focus(self, position, focuser=0):
+        self.focusers[focuser].move(int(round(position)))
+
+
+    def get_focus_temperature(self, focuser=0):
+        return self.focusers[focuser].temperature()
+
+
     def collect_header_metadata(self):
         h = fits.Header()
         # FilterWheel
@@ -1,14 +1,18 @@
 #!python3
 import os
 from pathlib import Path
-from time import sleep
+from time import sleep, perf_counter
 from datetime import datetime
 import random
 import numpy as np
 import yaml
 from logging import DEBUG, INFO, WARNING, ERROR
 from copy import deepcopy
+from functools import partial
 import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pymongo
 
 from astropy import units as u
@@ -17,20 +21,32 @@ from astropy import coordinates as c
 from astropy.time import Time, TimeDelta
 from astropy.table import Table, Row
 
-# Suppress IERS download failure
-from astropy.utils.iers import conf
-conf.auto_max_age = None
-
-from transitions.extensions import GraphMachine
-from transitions import Machine
 from transitions import State
 
 from odl.block import ObservingBlockList, ScienceBlock, FocusBlock
 from odl.alignment import BlindAlign
 
 from .exceptions import *
-from .scheduler import Scheduler
-from .focusing import FocusFitParabola, FocusMaxRun
+from .scheduler import Scheduler, OBCatalog
+from .focusing import FocusFitParabola, FocusMaxRun, fit_parabola
+from .focusmodel import FocusModel
+from .imageanalysis import measure_frame, frame_quality, quality_problems
+from .metrics import Metrics
+from .ledger import OBLedger
+from .checkpoint import Checkpoint, match_OBs
+from .targets import TargetResolver
+from .ephemeris import NightlyEphemeris
+from .iersdata import IERSData
+from .status import StatusStream
+from .framebuffer import FrameRing, image_data
+from .exposureclock import ExposureClock
+from .slewmodel import SlewModel, hadec
+from .platesolve import StarCatalog, PlateSolver
+from .devicestate import DeviceMirror
+from .trace import TraceRecorder, Trace, ReplayDevice
+from .calibrations import CalibrationPlan
+from .conditions import (ConditionContext, ConditionMachine,
+                         ConditionGraphMachine, condition)
 from . import load_configuration, create_log
 
 
@@ -40,7 +56,7 @@ from . import load_configuration, create_log
 class RollOffRoof():
     '''Simple observatory with roll off roof.
     '''
-    def __init__(self, name='myobservatory', OTA='OTA',
+    def __init__(self, name='myobservatory', instance=None, OTA='OTA',
                  states_file='states.yaml',
                  transitions_file='transitions.yaml',
                  location_file = 'location.yaml',
@@ -51,26 +67,143 @@ class RollOffRoof():
                  telescope=None, telescope_config={},
                  instrument=None, instrument_config={},
                  detector=None, detector_config=[{}],
+                 guider=None, guider_config={},
                  datadir='~', lat=0, lon=0, height=0,
-                 horizon=0,
+                 horizon=0, analysis_workers=2,
+                 simulate_darkness=False, dark_sun_alt=-12,
+                 ephemeris_cache_dir=None,
+                 iers_cache_dir=None, iers_max_age=30,
+                 focus_model_file=None, focus_max_uncertainty=20,
+                 focus_min_scatter=5,
                  mongoIP='192.168.4.49', mongoport=32768,
                  loglevel_console='INFO', logfile=None, loglevel_file='DEBUG',
-                 OBs=[],
+                 jsonlogfile=None, log_queue=True,
+                 metrics_port=None, metrics_file=None, ledger_file=None,
+                 status_port=None, status_history_size=10000,
+                 preview_slots=0, preview_slot_bytes=None,
+                 frame_quality=False, quality_factor=2, saturation=None,
+                 quality_limits={}, requeue_bad_fraction=None, max_requeues=1,
+                 free_run=False, exposure_sync_timeout=60,
+                 slew_model_file=None, park_hadec=[0, 90], slew_candidates=1,
+                 star_catalog=None, plate_scale=None, plate_rotation=0,
+                 plate_parity=-1, acquisition_exptime=5, acquisition_detector=0,
+                 acquisition_tolerance=10, acquisition_iterations=3,
+                 device_poll_periods={}, header_max_age=2,
+                 memoize_conditions=True,
+                 calibrate=False, calibration_nbias=10, calibration_ndark=10,
+                 calibration_flat_exptimes=[],
+                 trace_file=None, replay_file=None,
+                 checkpoint_file=None, resume=False, target_cache_file=None,
+                 target_catalogs=[],
+                 OBs=[], OB_catalog=None,
+                 scheduler=None, resolver=None, ephemeris=None,
                  ):
         self.name = name
+        # Several instances of one observatory (e.g. simulations run side by
+        # side) need their own logger, database, and preview buffers
+        self.instance = instance
+        self.instance_name = name if instance is None else f'{name}_{instance}'
         self.datadir = Path(datadir).expanduser().absolute()
         self.logger = create_log(loglevel_console=loglevel_console,
                                  logfile=logfile,
-                                 loglevel_file=loglevel_file)
+                                 loglevel_file=loglevel_file,
+                                 jsonlogfile=jsonlogfile,
+                                 use_queue=log_queue,
+                                 logname=None if instance is None\
+                                         else self.instance_name)
         self.uname_result = os.uname()
+        # Replay a recorded night with stand in devices
+        self.replay = Trace(replay_file) if replay_file is not None else None
+        if self.replay is not None:
+            weather = partial(ReplayDevice, self.replay, 'weather')
+            roof = partial(ReplayDevice, self.replay, 'roof')
+            telescope = partial(ReplayDevice, self.replay, 'telescope')
+            instrument = partial(ReplayDevice, self.replay, 'instrument')
+            detector = [partial(ReplayDevice, self.replay, f'detector{j}')
+                        for j in range(len(detector))]
+            if guider is not None:
+                guider = partial(ReplayDevice, self.replay, 'guider')
+            waittime = 0
+            device_poll_periods = {key: None for key in
+                                   ['telescope.atpark', 'telescope.tracking',
+                                    'telescope.header', 'telescope.sideofpier',
+                                    'roof.shutterstatus',
+                                    'instrument.header']}
         # Components
         self.weather = weather(logger=self.logger, **weather_config)
         self.roof = roof(logger=self.logger, **roof_config)
         self.telescope = telescope(logger=self.logger, **telescope_config)
         self.instrument = instrument(logger=self.logger, **instrument_config)
         self.detector = [d(logger=self.logger, **detector_config[i]) for i,d in enumerate(detector)]
-        self.scheduler = Scheduler(OBs=OBs)
-        
+        self.guider = guider(**guider_config) if guider is not None else None
+        # The scheduler, resolver, ephemeris, and star catalog may be shared
+        # with other observatories (see ocs.coordinator)
+        if scheduler is None:
+            catalog = OBCatalog(OB_catalog) if OB_catalog is not None else None
+            scheduler = Scheduler(OBs=OBs, catalog=catalog)
+        self.scheduler = scheduler
+        self.resolver = TargetResolver(cache_file=target_cache_file,
+                                       extra_catalogs=target_catalogs)\
+                        if resolver is None else resolver
+        # Night Trace
+        self.trace = TraceRecorder(trace_file) if trace_file is not None else None
+        if self.trace is not None:
+            self.trace.write('start', name=name,
+                             queue=self.scheduler.signature())
+            for device_name, device in [('weather', self.weather),
+                                        ('roof', self.roof),
+                                        ('telescope', self.telescope),
+                                        ('instrument', self.instrument),
+                                        ('guider', self.guider)]:
+                if device is not None:
+                    self.trace.record_device(device, device_name)
+            for j,d in enumerate(self.detector):
+                self.trace.record_device(d, f'detector{j}')
+            self.trace.record_scheduler(self.scheduler)
+        if self.replay is not None:
+            self.replay.replay_scheduler(self.scheduler)
+        # Latency Instrumentation
+        self.metrics = Metrics()
+        self.metrics_file = metrics_file
+        self.metrics.instrument_device(self.roof, 'roof', ['open', 'close'],
+                                       labeler=self.call_labels)
+        self.metrics.instrument_device(self.telescope, 'telescope',
+                                       ['slew', 'park', 'collect_header_metadata'],
+                                       labeler=self.call_labels)
+        self.metrics.instrument_device(self.instrument, 'instrument',
+                                       ['configure', 'collect_header_metadata'],
+                                       labeler=self.call_labels)
+        for j,d in enumerate(self.detector):
+            self.metrics.instrument_device(d, f'detector{j}', ['expose'],
+                                           labeler=self.call_labels)
+        if self.guider is not None:
+            self.metrics.instrument_device(self.guider, 'guider', ['Call'],
+                                           labeler=self.call_labels)
+        if metrics_port is not None:
+            self.metrics.serve(port=metrics_port)
+        # Device State Mirror
+        self.device_state = DeviceMirror(logger=self.logger)
+        self.device_state.watch(self.telescope, 'telescope',
+                                {'atpark': ('atpark', 5),
+                                 'tracking': ('tracking', 5),
+                                 'sideofpier': ('sideofpier', 5),
+                                 'header': ('collect_header_metadata', 10)},
+                                periods=device_poll_periods)
+        self.device_state.watch(self.roof, 'roof',
+                                {'shutterstatus': ('shutterstatus', 5)},
+                                periods=device_poll_periods)
+        self.device_state.watch(self.instrument, 'instrument',
+                                {'header': ('collect_header_metadata', 10)},
+                                periods=device_poll_periods)
+        self.device_state.invalidate_on(self.telescope, 'telescope',
+                                        ['slew', 'park', 'unpark',
+                                         'set_tracking', 'offset'])
+        self.device_state.invalidate_on(self.roof, 'roof', ['open', 'close'])
+        self.device_state.invalidate_on(self.instrument, 'instrument',
+                                        ['configure', 'set_focus'])
+        # Headers written to frames are read again if older than this
+        self.header_max_age = header_max_age
+
         # Load States File
         with open(Path(states_file).expanduser()) as FO:
             self.states = yaml.safe_load(FO)
@@ -80,45 +213,135 @@ class RollOffRoof():
         # Load Location
         self.location = c.EarthLocation(lat=lat, lon=lon, height=height)
         self.horizon = horizon
+        self.ephemeris = NightlyEphemeris(self.location,
+                                          cache_dir=ephemeris_cache_dir)\
+                         if ephemeris is None else ephemeris
+        self.simulate_darkness = simulate_darkness
+        self.dark_sun_alt = dark_sun_alt
+        self.slew_model = SlewModel(file=slew_model_file)
+        self.park_hadec = tuple(park_hadec)
+        # Choose the quickest slew among the first slew_candidates OBs
+        self.slew_candidates = slew_candidates
+        self.pointing = None
+        self.plate_solver = None
+        if star_catalog is not None and plate_scale is not None:
+            if not isinstance(star_catalog, StarCatalog):
+                star_catalog = StarCatalog(star_catalog)
+            self.plate_solver = PlateSolver(star_catalog,
+                                            plate_scale,
+                                            rotation=plate_rotation,
+                                            parity=plate_parity,
+                                            tolerance=acquisition_tolerance)
+        self.acquisition_exptime = acquisition_exptime
+        self.acquisition_detector = acquisition_detector
+        self.acquisition_tolerance = acquisition_tolerance
+        self.acquisition_iterations = acquisition_iterations
+        # Conditions are evaluated at most once per trigger
+        self.conditions = ConditionContext(transitions=self.transitions,
+                                           enabled=memoize_conditions)
+        if self.replay is not None:
+            self.conditions.replay = self.replay.conditions
         # Instantiate State Machine
         try:
-            self.machine = GraphMachine(model=self,
-                                        states=self.states,
-                                        transitions=self.transitions,
-                                        initial=initial_state,
-                                        queued=True,
-                                        use_pygraphviz=True,
-                                        show_conditions=True,
-                                        )
+            self.machine = ConditionGraphMachine(model=self,
+                                                 states=self.states,
+                                                 transitions=self.transitions,
+                                                 initial=initial_state,
+                                                 queued=True,
+                                                 prepare_event='start_event_timer',
+                                                 before_state_change=self.conditions.stop,
+                                                 finalize_event=['end_conditions',
+                                                                 'stop_event_timer'],
+                                                 use_pygraphviz=True,
+                                                 show_conditions=True,
+                                                 )
             # Generate state diagram
 #             self.machine.get_graph().draw('state_diagram.png', prog='dot')
         except:
-            self.machine = Machine(model=self,
-                                   states=self.states,
-                                   transitions=self.transitions,
-                                   initial=initial_state,
-                                   queued=True,
-                                   )
+            self.machine = ConditionMachine(model=self,
+                                            states=self.states,
+                                            transitions=self.transitions,
+                                            initial=initial_state,
+                                            queued=True,
+                                            prepare_event='start_event_timer',
+                                            before_state_change=self.conditions.stop,
+                                            finalize_event=['end_conditions',
+                                                            'stop_event_timer'],
+                                            )
         # Operational Properties
         self.waittime = waittime
         self.maxwait = maxwait
         self.wait_duration = 0
         self.max_allowed_errors = max_allowed_errors
+        self.analysis_workers = analysis_workers
+        self.preview_slots = preview_slots
+        self.preview_slot_bytes = preview_slot_bytes
+        self.previews = {}
+        self.preview_lock = threading.Lock()
+        self.frame_quality = frame_quality
+        self.quality_factor = quality_factor
+        self.saturation = saturation
+        self.quality_limits = quality_limits
+        self.requeue_bad_fraction = requeue_bad_fraction
+        self.max_requeues = max_requeues
+        self.requeue_counts = {}
+        # One persistent pool for focus runs and frame quality, created here
+        # and not on first use as frames from several detectors arrive in
+        # their own exposure threads.  No processes start until it is used.
+        self.analysis_pool = ProcessPoolExecutor(max_workers=analysis_workers,
+                                                 mp_context=analysis_context())
+        self.analysis_lock = threading.Lock()
+        self.quality_futures = []
+        self.free_run = free_run
+        self.exposure_sync_timeout = exposure_sync_timeout
+        self.exposure_pools = [ThreadPoolExecutor(max_workers=1,
+                                                  thread_name_prefix=f'detector{j}')
+                               for j in range(len(self.detector))]
+        self.focus_model = FocusModel(file=focus_model_file,
+                                      max_uncertainty=focus_max_uncertainty,
+                                      min_scatter=focus_min_scatter)
         
         # Initialize Status Values
         self.startup_at = datetime.now()
+        self.night_ends_at = None
         self.entered_state_at = datetime.now()
         self.last_state = str(self.state)
-        self.executed = Table(names=('type', 'target', 'pattern', 'instconfig',
-                                     'detconfig', 'failed'),
-                              dtype=('a20', 'a40', 'a20', 'a40', 'a40', np.bool))
+        self.event_started_at = None
+        # A ledger file may hold many nights, only tonight's OBs are loaded
+        tonight = self.ephemeris.night_of(Time.now())
+        self.executed = OBLedger(file=ledger_file,
+                                 since=self.ephemeris.noon(tonight))
         self.current_OB = None
+        self.current_OB_id = None
+        self.current_OB_key = None
+        self.current_target = None
+        self.position_index = 0
+        self.position_timings = []
+        self.frames_done = []
+        self.resume_position = 0
+        self.resume_frames = None
+        self.resume_calibrations = {}
+        self.roof_open = False
+        self.static_status = None
+        self.checkpoint = Checkpoint(checkpoint_file)\
+                          if checkpoint_file is not None else None
         self.we_are_done = False
         self.durations = {}
         self.errors = []
         self.error_count = 0
         self.software_errors = []
 
+        # Load IERS and leap second tables (never downloaded while running)
+        self.iers = IERSData(cache_dir=iers_cache_dir, max_age=iers_max_age)
+        iers_status = self.iers.load()
+        self.log(f'Loaded IERS table {iers_status["iers_file"]}')
+        self.log(f'IERS measured until {iers_status["measured_until"]}, '
+                 f'predicted until {iers_status["predicted_until"]}, '
+                 f'leap seconds expire {iers_status["leap_seconds_expire"]}')
+        if iers_status['stale'] is True:
+            self.log(f'IERS data are {iers_status["age"]:.0f} days old, '
+                     f'run IERSData.fetch to update', level=WARNING)
+
         # Configure telescope hardware
         self.log(f'Sending location info to mount')
         self.telescope.set_sitelatitude(lat)
@@ -137,28 +360,67 @@ class RollOffRoof():
         mountnow = datetime.fromisoformat(mountnow_str)
         dt = mountnow - now
         assert dt.total_seconds() < 0.25
+        if self.replay is None:
+            self.log(f'Starting device state polling')
+            self.device_state.start()
+        elif not self.replay.matches_queue(self.scheduler):
+            self.log(f'The OBs differ from those of the replayed night',
+                     level=WARNING)
 
         # Mongo Connection
         self.mongoIP = mongoIP
         self.mongoport = mongoport
         try:
             self.client = pymongo.MongoClient(mongoIP, mongoport)
-            self.db = self.client[name]
-            self.status_collection = self.db['status']
+            self.db = self.client[self.instance_name]
             self.log(f'Connected to Mongo DB')
         except:
             self.client = None
             self.db = None
-            self.status_collection = None
             self.log(f'Failed to connect to Mongo DB', level=WARNING)
+        self.status_stream = StatusStream(db=self.db,
+                                          history_size=status_history_size)
+        self.status_keys = set()
+        if status_port is not None:
+            self.status_stream.serve(port=status_port)
+
+        # Calibration frames for tonight's detector configs, taken while
+        # waiting closed
+        self.calibrate = calibrate
+        self.calibrations = CalibrationPlan(nbias=calibration_nbias,
+                                            ndark=calibration_ndark,
+                                            flat_exptimes=calibration_flat_exptimes)
+
+        # Resolve target names once, up front
+        for name, err in self.scheduler.resolve_targets(self.resolver):
+            self.log(f'Could not resolve target {name}: {err}', level=WARNING)
+
+        if resume is True:
+            self.resume_from_checkpoint()
+        if self.calibrate is True:
+            self.calibrations.add_detconfigs(self.scheduler.detconfigs())
+            self.calibrations.add_OBs([self.current_OB])
+            self.calibrations.restore(self.resume_calibrations)
+            self.log(f'Calibrations needed: {len(self.calibrations)} sets, '
+                     f'{self.calibrations.frames_remaining()} frames')
 
 
     ##-------------------------------------------------------------------------
     ## Record Keeping Utilities
-    def log(self, msg, level=INFO):
+    def log(self, msg, *args, level=INFO):
+        '''Log a message prefixed with the state and current OB.  Like the
+        standard logging calls, args are merged in to msg with % formatting,
+        and nothing is formatted if the logger would discard the message.
+        '''
+        if not self.logger.isEnabledFor(level):
+            return
         current_OB = f'{self.current_OB.blocktype} @ {self.current_OB.target}'\
                      if self.current_OB is not None else 'None'
-        self.logger.log(level, f'{self.state:15s}|{current_OB:30s}: {msg}')
+        prefix = f'{self.state:15s}|{current_OB:30s}: '
+        if len(args) > 0:
+            prefix = prefix.replace('%', '%%')
+        self.logger.log(level, prefix + msg, *args,
+                        extra={'state': str(self.state), 'OB': current_OB})
 
 
     def entry_timestamp(self):
@@ -168,13 +430,14 @@ class RollOffRoof():
             self.entered_state_at = datetime.now()
         if str(self.state) == 'acquiring':
             self.wait_duration = 0
+        self.write_checkpoint()
         self.update_db()
 
 
     def exit_timestamp(self):
         self.last_state = str(self.state)
         duration = (datetime.now() - self.entered_state_at).total_seconds()
-        self.log(f'Exiting state {self.state} after {duration:.1f}s',
+        self.log('Exiting state %s after %.1fs', self.state, duration,
                  level=DEBUG)
         if self.state in self.durations.keys():
             self.durations[self.state] += duration
@@ -182,16 +445,51 @@ class RollOffRoof():
             self.durations[self.state] = duration
 
 
+    def start_event_timer(self):
+        self.event_started_at = perf_counter()
+
+
+    def stop_event_timer(self):
+        '''Record the time taken to process a trigger, which is dominated by
+        the on_enter callbacks of the destination state.
+        '''
+        if self.event_started_at is not None:
+            self.metrics.observe('state_enter_seconds',
+                                 perf_counter() - self.event_started_at,
+                                 state=str(self.state))
+            self.event_started_at = None
+
+
+    def end_conditions(self):
+        '''Record the conditions evaluated for a trigger and which of them
+        decided the transition.
+        '''
+        record = self.conditions.end(dest=str(self.state))
+        if record is None:
+            return
+        for name, seconds in record['seconds'].items():
+            self.metrics.observe('condition_seconds', seconds, condition=name)
+        if self.trace is not None:
+            self.trace.write('conditions', trigger=record['trigger'],
+                             source=record['source'], dest=record['dest'],
+                             values=record['values'])
+        decided_by = ', '.join([f'{c}={v}' for c,v in record['decisive']])
+        self.log('%s: %s -> %s (%d conditions, %d calls) decided by: %s',
+                 record['trigger'], record['source'], record['dest'],
+                 len(record['values']), record['calls'], decided_by or 'none',
+                 level=DEBUG)
+
+
     def log_wakeup(self):
         self.log(f'Waking up observatory: {self.name}')
         # log states
-        self.log('States', DEBUG)
+        self.log('States', level=DEBUG)
         for state in self.states:
-            self.log(f'  {state}', DEBUG)
+            self.log('  %s', state, level=DEBUG)
         # log transitions
-        self.log('Transitions', DEBUG)
+        self.log('Transitions', level=DEBUG)
         for transition in self.transitions:
-            self.log(f'  {transition}', DEBUG)
+            self.log('  %s', transition, level=DEBUG)
         # log location
         self.log(f'  Location:')
         self.log(f'    latitude = {self.location.lat:.6f}')
@@ -199,18 +497,113 @@ class RollOffRoof():
         self.log(f'    height = {self.location.height:.0f}')
 
 
-    def record_OB(self, failed=False):
+    def write_checkpoint(self):
+        if self.checkpoint is None:
+            return
+        current_OB_key = self.current_OB_key if self.current_OB is not None else None
+        self.checkpoint.write('state', state=str(self.state),
+                              error_count=self.error_count,
+                              we_are_done=self.we_are_done,
+                              roof_open=self.roof_open,
+                              current_OB=current_OB_key,
+                              position=self.position_index,
+                              frames=list(self.frames_done),
+                              requeue_counts=dict(self.requeue_counts))
+
+
+    def resume_from_checkpoint(self):
+        '''Restore the state of the night from the checkpoint journal: drop
+        completed OBs from the scheduler, restore the error count, requeue
+        counts, and roof state, and set up the interrupted OB (if any) to
+        continue from the pattern position and frame where it stopped.  OBs
+        are matched by OB_key, so the OB list may have been edited.
+        '''
+        snapshot = self.checkpoint.load() if self.checkpoint is not None else None
+        if snapshot is None:
+            self.log('No checkpoint to resume from')
+            return
+        self.log(f'Resuming from checkpoint at {snapshot["time"]} in state {snapshot["state"]}')
+        completed = match_OBs(self.scheduler.pending_keys(), snapshot['completed'])
+        self.scheduler.skip(completed)
+        self.log(f'  Skipping {len(completed)} completed OBs')
+        missing = len(snapshot['completed']) - len(completed)
+        if missing > 0:
+            self.log(f'  {missing} completed OBs are no longer in the list',
+                     level=WARNING)
+        self.error_count = snapshot['error_count']
+        self.requeue_counts = snapshot.get('requeue_counts', {})
+        self.we_are_done = snapshot['we_are_done']
+        self.resume_calibrations = snapshot.get('calibrations', {})
+        self.roof_open = snapshot['roof_open']
+        if snapshot['current_OB'] is not None:
+            ids = match_OBs(self.scheduler.pending_keys(), [snapshot['current_OB']])
+            if len(ids) > 0:
+                self.current_OB = self.scheduler.take(ids[0])
+                self.current_OB_id = self.scheduler.current_id
+                self.current_OB_key = snapshot['current_OB']
+            else:
+                self.log('  The interrupted OB is no longer in the list',
+                         level=WARNING)
+            if self.current_OB is not None and snapshot['state'] == 'observing':
+                self.resume_position = snapshot['position']
+                self.resume_frames = snapshot['frames']
+                self.log(f'  Continuing {self.current_OB} at position {self.resume_position+1}, frames {self.resume_frames}')
+
+
+    def exposure_progress(self, detector_index, nframes):
+        '''Called from the exposure threads as each frame is written.
+        '''
+        self.frames_done[detector_index] = nframes
+        self.write_checkpoint()
+
+
+    def record_OB(self, failed=False, nframes=0, quality={}):
+        instconfig = self.current_OB.instconfig
         row = {'type': self.current_OB.blocktype,
                'target': self.current_OB.target.name,
                'pattern': self.current_OB.pattern.name,
-               'instconfig': self.current_OB.instconfig.name,
+               'instconfig': instconfig.name,
+               'filter': getattr(instconfig, 'filter', ''),
                'detconfig': ','.join([dc.name for dc in self.current_OB.detconfig]),
+               'nframes': nframes,
                'failed': failed}
+        row.update(quality)
         self.executed.add_row(row)
+        requeued = self.requeue_if_bad(quality, nframes)
+        if self.checkpoint is not None:
+            self.checkpoint.write('OB', key=self.current_OB_key,
+                                  id=self.current_OB_id, failed=failed,
+                                  requeued=requeued)
         sorf_string = {False: 'Succeeded', True: 'Failed'}[failed]
         sorf_level = {False: INFO, True: WARNING}[failed]
         self.log(f'OB {sorf_string}', level=sorf_level)
         self.current_OB = None
+        self.current_OB_id = None
+        self.current_OB_key = None
+        self.position_index = 0
+        self.frames_done = []
+        self.resume_position = 0
+        self.resume_frames = None
+
+
+    def requeue_if_bad(self, quality, nframes):
+        '''Put the current OB back in the scheduler if too many of its frames
+        were bad (see requeue_bad_fraction).  Returns True if requeued.
+        '''
+        if self.requeue_bad_fraction is None or nframes == 0:
+            return False
+        if quality.get('nbad', 0) / nframes <= self.requeue_bad_fraction:
+            return False
+        count = self.requeue_counts.get(self.current_OB_key, 0)
+        if count >= self.max_requeues:
+            self.log(f'Too many bad frames, but OB already requeued {count} times',
+                     level=WARNING)
+            return False
+        self.requeue_counts[self.current_OB_key] = count + 1
+        self.scheduler.requeue(self.current_OB_id, self.current_OB)
+        self.log(f'Requeued OB: {quality["nbad"]} of {nframes} frames were bad',
+                 level=WARNING)
+        return True
 
 
     def begin_end_of_night_shutdown(self):
@@ -218,6 +611,9 @@ class RollOffRoof():
 
 
     def night_summary(self):
+        if self.checkpoint is not None:
+            self.checkpoint.write('end')
+            self.checkpoint.close()
         if self.error_count > 0:
             self.log(f'Encountered {self.error_count} errors',
                      level=WARNING)
@@ -235,7 +631,69 @@ class RollOffRoof():
         duration_table['Duration'].format = '.0f'
         duration_table['Duration'].unit = u.second
         self.log(f'\n\n====== Timing ======\n{duration_table}\n')
-        self.log(f'\n\n====== Observed ======\n{self.executed}\n')
+        self.log(f'\n\n====== Observed ======\n{self.executed.to_table()}\n')
+        latency_table = Table(names=('Metric', 'Labels', 'N', 'Total', 'Mean', 'Max'),
+                              dtype=(str, str, int, float, float, float))
+        for name, labels, n, total, mean, maxval in self.metrics.summary():
+            latency_table.add_row({'Metric': name,
+                                   'Labels': ','.join(labels.values()),
+                                   'N': n, 'Total': total,
+                                   'Mean': mean, 'Max': maxval})
+        for col in ['Total', 'Mean', 'Max']:
+            latency_table[col].format = '.3f'
+            latency_table[col].unit = u.second
+        self.log(f'\n\n====== Latency ======\n{latency_table}\n')
+        if self.calibrate is True:
+            calibration_table = Table(names=('Type', 'Detector', 'Exptime',
+                                             'Done', 'Missing'),
+                                      dtype=(str, int, float, int, int))
+            for cal in self.calibrations.calibrations.values():
+                calibration_table.add_row({'Type': cal.kind,
+                                           'Detector': cal.detector,
+                                           'Exptime': cal.exptime,
+                                           'Done': cal.done,
+                                           'Missing': cal.remaining})
+            self.log(f'\n\n====== Calibrations ======\n{calibration_table}\n')
+        if self.metrics_file is not None:
+            metrics_file = self.metrics.dump(self.metrics_file)
+            self.log(f'Wrote metrics to {metrics_file}')
+        self.shutdown()
+        if self.trace is not None:
+            self.trace.write('end', state=str(self.state),
+                             error_count=self.error_count)
+            self.trace.close()
+            self.log(f'Wrote night trace to {self.trace.file}')
+        if self.replay is not None:
+            self.log(f'Replayed {self.replay.file}: {self.replay.divergences} '
+                     f'device or scheduler divergences, '
+                     f'{self.conditions.replay_mismatches} trigger mismatches')
+
+
+    def shutdown(self):
+        '''Stop the background threads and processes: device state polling,
+        the exposure and analysis pools, the preview buffers, and the
+        metrics server.
+        '''
+        self.metrics.shutdown()
+        for ring in self.previews.values():
+            ring.close()
+        self.previews = {}
+        with self.analysis_lock:
+            pool, self.analysis_pool = self.analysis_pool, None
+        if pool is not None:
+            pool.shutdown()
+        for pool in self.exposure_pools:
+            pool.shutdown()
+        self.device_state.stop()
+
+
+    def call_labels(self):
+        '''Labels for the device call metrics: the state the call was made
+        in, or device_state for calls by the device state poller.
+        '''
+        if threading.current_thread().name == 'device_state':
+            return {'state': 'device_state'}
+        return {'state': str(getattr(self, 'state', None))}
 
 
     def to_dict(self):
@@ -243,8 +701,10 @@ class RollOffRoof():
         database for both record keeping and for live status display on a web
         page.
         '''
-        output = {'timestamp': datetime.now(),
+        if self.static_status is None:
+            self.static_status = {
                   'name': self.name,
+                  'instance': self.instance,
                   'sysname': self.uname_result.sysname,
                   'nodename': self.uname_result.nodename,
                   'lat': self.location.lat.deg,
@@ -256,55 +716,93 @@ class RollOffRoof():
                   'telescope': str(self.telescope),
                   'instrument': str(self.instrument),
                   'detector': [str(d) for d in self.detector],
-                  'current_OB': str(self.current_OB),
-                  'N_executed_OBs': len(self.executed),
                   }
+        output = {'timestamp': datetime.now()}
+        output.update(self.static_status)
+        output['current_OB'] = str(self.current_OB)
+        output['N_executed_OBs'] = len(self.executed)
+        output['calibration_frames_missing'] = self.calibrations.frames_remaining()
         properties = ['name', 'waittime', 'maxwait', 'wait_duration',
                       'max_allowed_errors', 'state', 'last_state',
                       'startup_at', 'entered_state_at', 'we_are_done',
                       'error_count']
         for prop in properties:
             output[prop] = getattr(self, prop, 'unknown')
+        # Mirrored device state (never queries the devices)
+        for key in ['telescope.atpark', 'telescope.tracking',
+                    'roof.shutterstatus']:
+            if key in self.device_state.entries.keys():
+                output[key.replace('.', '_')] = self.device_state.peek(key)
 
         return output
 
 
     def update_db(self):
-        if self.status_collection is None:
+        '''Publish the fields of the status which changed (see StatusStream).
+        '''
+        status = self.to_dict()
+        status.pop('timestamp')
+        # Fields which to_dict no longer reports are removed
+        removed = [key for key in self.status_keys if key not in status]
+        self.status_keys = set(status.keys())
+        try:
+            with self.metrics.timer('mongo_seconds', op='status_update'):
+                message = self.status_stream.update(status, remove=removed)
+        except Exception as err:
+            self.log(f'Failed to update status: {err}', level=WARNING)
             return
-        statid = self.status_collection.insert_one(self.to_dict()).inserted_id
-        self.log(f'Inserted status entry ID = {statid}', level=DEBUG)
+        if message is not None:
+            self.log('Published status %d (%d fields)', message['seq'],
+                     len(message['changes']), level=DEBUG)
 
 
     ##-------------------------------------------------------------------------
     ## Status Checks
+    @condition
     def is_safe(self):
         safe = self.weather.is_safe()
-        self.log(f'Weather is Safe? {safe}', level=DEBUG)
+        self.log('Weather is Safe? %s', safe, level=DEBUG)
         return safe
 
 
+    @condition
     def is_unsafe(self):
         safe = self.weather.is_safe()
-        self.log(f'Weather is Safe? {safe}', level=DEBUG)
+        self.log('Weather is Safe? %s', safe, level=DEBUG)
         return not safe
 
 
 
+    @condition
     def is_dark(self):
-        obstime = Time.now()
-#         sun = c.get_sun(time=obstime)
-#         altaz = c.AltAz(location=self.location, obstime=obstime,
-#                         obswl=0.5*u.micron)
-#         sun_is_down = sun.transform_to(altaz).alt < 0
-#         self.log(f'Sun is Down? {sun_is_down}', level=DEBUG)
-        # Replace this with a simple timer which has sunrise after a set time
-        uptime = (datetime.now() - self.startup_at).total_seconds()
-        sun_is_down = uptime < self.maxwait*3
-        self.log(f'Is it dark? {sun_is_down}', level=DEBUG)
+        if self.simulate_darkness is True:
+            # Simple timer which has sunrise after a set time
+            uptime = (datetime.now() - self.startup_at).total_seconds()
+            sun_is_down = uptime < self.maxwait*3
+        else:
+            # Interpolated from the precomputed nightly sun table
+            sun_is_down = self.ephemeris.is_dark(sun_alt=self.dark_sun_alt)
+        self.log('Is it dark? %s', sun_is_down, level=DEBUG)
         return sun_is_down
 
 
+    def night_is_over(self):
+        '''True once the dark part of tonight has ended.  Before dusk (e.g.
+        when started in the afternoon) the night is still to come.
+        '''
+        if self.simulate_darkness is True:
+            uptime = (datetime.now() - self.startup_at).total_seconds()
+            return uptime >= self.maxwait*3
+        if self.night_ends_at is None:
+            self.night_ends_at = self.ephemeris.night_end(sun_alt=self.dark_sun_alt)
+            if self.night_ends_at is None:
+                self.log('The sun does not set tonight', level=WARNING)
+                return True
+            self.log(f'Tonight ends at {self.night_ends_at.isot} UT')
+        return Time.now() > self.night_ends_at
+
+
+    @condition
     def done_observing(self):
         too_many_errors = self.error_count > self.max_allowed_errors
         if too_many_errors is True:
@@ -312,31 +810,41 @@ class RollOffRoof():
             self.begin_end_of_night_shutdown()
         done_string = {True: '', False: 'not '}[self.we_are_done]
 
-        if self.state == 'waiting_closed' and not self.is_dark():
+        if self.state == 'waiting_closed' and self.night_is_over():
             self.begin_end_of_night_shutdown()
 
-        self.log(f'We are {done_string}shutting down', level=DEBUG)
+        self.log('We are %sshutting down', done_string, level=DEBUG)
         return self.we_are_done
 
 
+    @condition
     def long_wait(self):
         return (self.wait_duration > self.maxwait)
 
 
+    @condition
     def not_done_observing(self):
         done = self.done_observing()
         self.log(f'Done observing? {done}')
         return not done
 
 
+    @condition
+    def roof_is_open(self):
+        return self.roof_open
+
+
+    @condition
     def no_target(self):
         return self.current_OB is None
 
 
+    @condition
     def have_target(self):
         return self.current_OB is not None
 
 
+    @condition
     def ready_to_open(self):
         '''Exit waiting closed only if
         
@@ -351,20 +859,33 @@ class RollOffRoof():
         return ready_to_open
 
 
+    def guider_ok(self):
+        '''Non-blocking check of the guider connection health.  Returns True
+        if no guider is configured.
+        '''
+        if self.guider is None:
+            return True
+        return self.guider.IsHealthy()
+
+
+    @condition
     def acquisition_failed(self):
         acq_warnings = [isinstance(w, AcquisitionFailure) for w in self.errors]
         return np.any(acq_warnings)
 
 
+    @condition
     def focus_next(self):
         return isinstance(self.current_OB, FocusBlock)
 
 
+    @condition
     def focus_failed(self):
         foc_warnings = [isinstance(w, FocusFailure) for w in self.errors]
         return np.any(foc_warnings)
 
 
+    @condition
     def roof_err(self):
         roof_errors = [isinstance(w, RoofFailure) for w in self.errors]
         return np.any(roof_errors)
@@ -393,22 +914,90 @@ class RollOffRoof():
         return h
 
 
+    def current_hadec(self, time=None):
+        '''Hour angle and dec in degrees of the telescope (the park position if
+        it is parked).
+        '''
+        if self.pointing is None:
+            return self.park_hadec
+        return hadec(*self.pointing, Time.now() if time is None else time,
+                     self.location.lon.deg)
+
+
+    def side_of_pier(self, query=False):
+        '''The telescope's side of the pier ('east' or 'west') if it reports
+        one (the optional sideofpier method), otherwise None.  Unless query
+        is set only the mirrored value is used, so there is no device call.
+        '''
+        key = 'telescope.sideofpier'
+        if key not in self.device_state.entries.keys():
+            return None
+        try:
+            if query is True:
+                return self.device_state.get(key)
+            return self.device_state.peek(key)
+        except Exception as err:
+            self.log(f'Could not read side of pier: {err}', level=WARNING)
+            return None
+
+
+    def slew_time(self, coords, time=None):
+        '''Predicted time to slew from the current pointing to coords (which
+        may be an array SkyCoord, e.g. to compare many candidate targets).
+        '''
+        time = Time.now() if time is None else time
+        end = hadec(coords.ra.deg, coords.dec.deg, time, self.location.lon.deg)
+        return self.slew_model.predict(self.current_hadec(time), end,
+                                       pier=self.side_of_pier())
+
+
+    def OB_slew_times(self, OBs):
+        '''Predicted slew times to the targets of a list of OBs.  OBs with no
+        target need no slew, those whose target does not resolve are never
+        moved ahead.
+        '''
+        times = np.full(len(OBs), np.inf)
+        found = []
+        coords = []
+        for i,OB in enumerate(OBs):
+            target = getattr(OB, 'target', None)
+            if target is None or target == self.current_target:
+                times[i] = 0
+                continue
+            try:
+                coords.append(self.resolver.coord(target))
+            except Exception:
+                continue
+            found.append(i)
+        if len(found) > 0:
+            coords = c.SkyCoord([coord.icrs for coord in coords])
+            times[found] = self.slew_time(coords)
+        return times
+
+
+    @condition
     def below_horizon(self):
         '''Check of the current OB is below the defined horizon or is about to
         set within the duration of the OB.
         '''
-        duration = TimeDelta(self.current_OB.estimate_duration(), format='sec')
+        coord = self.resolver.coord(self.current_OB.target)
+        duration = self.current_OB.estimate_duration()
+        if self.current_target != self.current_OB.target:
+            duration += float(self.slew_time(coord))
+        duration = TimeDelta(duration, format='sec')
         altazframe = c.AltAz(obstime=Time.now() + duration,
                              location=self.location,
                              obswl=self.current_OB.instconfig.obswl,
 #                              pressure=, temperature=,
 #                              relative_humidity=,
                              )
-        altaz_coord = self.current_OB.target.coord().transform_to(altazframe)
+        altaz_coord = coord.transform_to(altazframe)
         self.log(f'OB will end at (alt, az) = ({altaz_coord.alt:.1f}, {altaz_coord.az:.1f})')
 
         h = self.get_horizon(altaz_coord.az.value)
         self.log(f'Horizon is {h:.1f} at {altaz_coord.az:.1f}')
+        moon_sep = self.ephemeris.moon_separation(coord, altazframe.obstime)
+        self.log('Moon separation is %.0f deg', moon_sep, level=DEBUG)
         below = altaz_coord.alt.value <= h
         if below is True:
             self.log(f'Target is or will set below the horizon', level=ERROR)
@@ -419,7 +1008,12 @@ class RollOffRoof():
     ## Scheduler
     def get_OB(self):
         try:
-            self.current_OB = self.scheduler.select()
+            self.current_OB = self.scheduler.select(slew_times=self.OB_slew_times,
+                                                    candidates=self.slew_candidates)
+            self.current_OB_id = self.scheduler.current_id
+            self.current_OB_key = self.scheduler.key(self.current_OB_id,
+                                                     self.current_OB)\
+                                  if self.current_OB is not None else None
             self.log(f'Got OB: {self.current_OB}')
         except SchedulingFailure as err:
             self.log(f'Scheduling error: {err}', level=ERROR)
@@ -437,10 +1031,15 @@ class RollOffRoof():
         sleep(0.0006)
         self.wait_duration = (datetime.now() - self.entered_state_at).total_seconds()
         if self.wait_duration > 0.001:
-            self.log(f'Waiting {self.waittime} s')
-            sleep(self.waittime)
+            if self.state == 'waiting_closed' and self.calibrate is True\
+               and self.calibrations.next() is not None:
+                self.take_calibrations()
+            else:
+                self.log(f'Waiting {self.waittime} s')
+                sleep(self.waittime)
         if self.state == 'waiting_closed':
-            self.get_OB()
+            if self.current_OB is None:
+                self.get_OB()
             self.done_waiting()
         elif self.state == 'waiting_open':
             if self.current_OB is None:
@@ -451,6 +1050,86 @@ class RollOffRoof():
             self.acquire()
 
 
+    def take_calibrations(self):
+        '''Take missing calibration frames, one at a time, until they are all
+        done or we are ready to open the roof.
+        '''
+        if self.current_OB is None:
+            self.get_OB()
+        while self.we_are_done is False:
+            calibration = self.calibrations.next()
+            if calibration is None:
+                self.log('Calibrations complete')
+                return
+            if self.ready_to_open():
+                self.log(f'Ready to open, stopping calibrations with '
+                         f'{self.calibrations.frames_remaining()} frames missing')
+                return
+            if self.take_calibration_frame(calibration) is False:
+                return
+
+
+    def take_calibration_frame(self, calibration):
+        '''Take one frame of a calibration.  Returns False if it failed or
+        was aborted because we are ready to open the roof.
+        '''
+        j = calibration.detector
+        dc = calibration.detconfig()
+        self.log(f'Taking calibration frame: {calibration}')
+        hdr = mirrored_header(self.device_state, ['instrument.header'],
+                              max_age=self.header_max_age)
+        hdr.set('IMAGETYP', value=calibration.imagetyp, comment='Image type')
+        hdr.set('OBJECT', value=calibration.imagetyp.lower())
+        hdr += dc.to_header()
+        exposed = threading.Event()
+        aborted = threading.Event()
+        watcher = threading.Thread(target=self.watch_calibration_frame,
+                                   args=(self.detector[j], exposed, aborted),
+                                   name=f'calibration{j}', daemon=True)
+        try:
+            self.detector[j].setup_detector(dc)
+            watcher.start()
+            hdul = self.detector[j].expose(additional_header=hdr)
+        except DetectorFailure as err:
+            self.log(f'Calibration frame failed: {err}', level=WARNING)
+            return False
+        finally:
+            exposed.set()
+        if aborted.is_set():
+            self.log('Ready to open, aborted calibration frame')
+            return False
+        if hdul is not None:
+            ff = build_fits_filename(camera=f'{dc.instrument}_{calibration.kind}',
+                                     datadir=self.datadir)
+            self.log(f'Writing {ff.name}')
+            hdul.writeto(ff, overwrite=False)
+        self.calibrations.record(calibration)
+        if self.checkpoint is not None:
+            self.checkpoint.write('calibration', key=calibration.key)
+            self.write_checkpoint()
+        return True
+
+
+    def watch_calibration_frame(self, detector, exposed, aborted):
+        '''While a calibration frame is exposing, check every waittime
+        seconds whether we are ready to open the roof and if so abort the
+        exposure.  Detectors without abort_exposure are not interrupted.
+        '''
+        abort_exposure = getattr(detector, 'abort_exposure', None)
+        if abort_exposure is None:
+            return
+        while not exposed.wait(timeout=max(self.waittime, 1)):
+            try:
+                ready = self.ready_to_open()
+            except Exception as err:
+                self.log(f'Ready to open check failed: {err}', level=WARNING)
+                continue
+            if ready:
+                aborted.set()
+                abort_exposure()
+                return
+
+
     def open_roof(self):
         self.log('Opening the roof')
         try:
@@ -461,6 +1140,8 @@ class RollOffRoof():
             self.errors.append(err)
             self.error_count += 1
             self.begin_end_of_night_shutdown()
+        else:
+            self.roof_open = True
         self.done_opening()
 
 
@@ -469,10 +1150,12 @@ class RollOffRoof():
         try:
             self.roof.close()
         except RoofFailure as err:
-            self.log('Roof failure on closing', ERROR)
+            self.log('Roof failure on closing', level=ERROR)
             self.log(f'{err}', level=ERROR)
             self.errors.append(err)
             self.error_count += 1
+        else:
+            self.roof_open = False
         self.done_closing()
 
 
@@ -481,30 +1164,22 @@ class RollOffRoof():
             self.log(f'Executing {self.current_OB.align.name}')
 
             # Unpark
-            if self.telescope.atpark() is True:
+            if self.device_state.get('telescope.atpark') is True:
                 self.log('Unparking telescope')
                 self.telescope.unpark()
             # Set tracking
-            if self.telescope.tracking() is False:
+            if self.device_state.get('telescope.tracking') is False:
                 self.log('Turning on tracking')
                 self.telescope.set_tracking(True)
 
             # Blind Align
             if isinstance(self.current_OB.align, BlindAlign):
-                # Slew Telescope
-                self.log(f'Slewing to: {self.current_OB.target}')
-                try:
-                    self.telescope.slew(self.current_OB.target.coord())
-                except TelescopeFailure as err:
-                    self.log('Telescope slew failed', level=ERROR)
-                    self.log(f'{err}', level=ERROR)
-                    self.errors.append(err)
-                    self.error_count += 1
-                else:
-                    self.log('Slew complete')
-                    self.current_target = self.current_OB.target
+                self.slew_to_target()
                 # End of Acquisition
-            # Other Align methods go here
+            # Other Align methods are done by plate solving
+            elif self.plate_solver is not None:
+                if self.slew_to_target() is True:
+                    self.plate_solve_align()
             else:
                 msg = f"Did not recognize alignment {self.current_OB.align.name}"
                 self.log(msg, level=ERROR)
@@ -515,6 +1190,85 @@ class RollOffRoof():
         self.done_acquiring()
 
 
+    def slew_to_target(self):
+        '''Slew to the current OB's target.  Returns True if the slew succeeded.
+        '''
+        self.log(f'Slewing to: {self.current_OB.target}')
+        coord = self.resolver.coord(self.current_OB.target)
+        now = Time.now()
+        start = self.current_hadec(now)
+        end = hadec(coord.ra.deg, coord.dec.deg, now, self.location.lon.deg)
+        pier0 = self.side_of_pier(query=True)
+        predicted = float(self.slew_model.predict(start, end, pier=pier0))
+        slew_start = perf_counter()
+        try:
+            self.telescope.slew(coord)
+        except TelescopeFailure as err:
+            self.log('Telescope slew failed', level=ERROR)
+            self.log(f'{err}', level=ERROR)
+            self.errors.append(err)
+            self.error_count += 1
+            return False
+        duration = perf_counter() - slew_start
+        self.log(f'Slew complete in {duration:.1f}s (predicted {predicted:.1f}s)')
+        self.slew_model.add(start, end, duration, pier0=pier0,
+                            pier1=self.side_of_pier(query=True))
+        self.pointing = (coord.ra.deg, coord.dec.deg)
+        self.current_target = self.current_OB.target
+        return True
+
+
+    def plate_solve_align(self):
+        '''Take short acquisition exposures, plate solve them against the local
+        star catalog, and offset the telescope to put the target at the
+        center of the field.  Repeats until the pointing error is within
+        acquisition_tolerance or after acquisition_iterations tries.  If the
+        images can not be solved the OB continues with the blind pointing.
+        '''
+        coord = self.resolver.coord(self.current_OB.target)
+        detector = self.detector[self.acquisition_detector]
+        for i in range(self.acquisition_iterations):
+            try:
+                detector.set_exptime(self.acquisition_exptime)
+                hdul = detector.expose()
+            except DetectorFailure as err:
+                self.log('Acquisition exposure failed', level=ERROR)
+                self.log(f'{err}', level=ERROR)
+                self.errors.append(err)
+                self.error_count += 1
+                return False
+            data = image_data(hdul)
+            with self.metrics.timer('acquisition_seconds', op='plate_solve'):
+                solution = self.plate_solver.solve(data, coord.ra.deg,
+                                                   coord.dec.deg)\
+                           if data is not None else None
+            if solution is None:
+                msg = 'Plate solve failed, continuing with blind pointing'
+                self.log(msg, level=WARNING)
+                self.errors.append(AcquisitionFailure(msg))
+                return False
+            east = solution['offset_east']
+            north = solution['offset_north']
+            self.log(f'  Plate solution: {solution["nmatched"]} stars, '
+                     f'error ({east:.1f}, {north:.1f}) arcsec, '
+                     f'rotation {solution["rotation"]:.2f} deg')
+            if np.hypot(east, north) <= self.acquisition_tolerance:
+                self.log('Target acquired')
+                return True
+            # The telescope is pointed at the target plus the error
+            try:
+                self.telescope.offset(-east, -north)
+            except TelescopeFailure as err:
+                self.log('Telescope offset failed', level=ERROR)
+                self.log(f'{err}', level=ERROR)
+                self.errors.append(err)
+                self.error_count += 1
+                return False
+        self.log(f'Pointing not within {self.acquisition_tolerance} arcsec '
+                 f'after {self.acquisition_iterations} iterations', level=WARNING)
+        return False
+
+
     def park_telescope(self):
         # Otherwise, park the telescope
         self.log(f'Parking Telescope')
@@ -528,6 +1282,7 @@ class RollOffRoof():
         else:
             self.log('Telescope parked')
             self.current_target = None
+            self.pointing = None
 
 
     def configure_instrument(self):
@@ -544,11 +1299,28 @@ class RollOffRoof():
 
     def begin_focusing(self):
         self.log('starting focusing')
-        take_data_failed = True
-        analyze_data_failed = True
-        if isinstance(self.current_OB, FocusFitParabola):
-            self.log(f'Focusing using simple parambola fit')
+        if isinstance(self.current_OB, FocusFitParabola)\
+           and self.apply_focus_model() is True:
+            self.log(f'Focus set from focus model')
             failed = False
+        elif isinstance(self.current_OB, FocusFitParabola):
+            self.log(f'Focusing using simple parambola fit')
+            try:
+                fitted = self.focus_fit_parabola()
+            except HardwareFailure as err:
+                self.log('Hardware failure during focus run', level=ERROR)
+                self.log(f'{err}', level=ERROR)
+                self.errors.append(err)
+                self.error_count += 1
+                failed = True
+            except Exception as err:
+                self.log('Focus run failed', level=ERROR)
+                self.log(f'{err}', level=ERROR)
+                self.software_errors.append(err)
+                failed = True
+            else:
+                self.update_focus_model(fitted)
+                failed = False
         elif isinstance(self.current_OB, FocusMaxRun):
             self.log(f'Focusing using FocusMax')
             failed = False
@@ -560,75 +1332,587 @@ class RollOffRoof():
         self.focusing_complete()
 
 
-    def begin_observation(self):
+    def focus_filter(self):
+        instconfig = self.current_OB.instconfig
+        return getattr(instconfig, 'filter', instconfig.name)
+
+
+    def apply_focus_model(self):
+        '''If the focus model can predict the best focus position for every
+        focuser in use with an uncertainty below the threshold, move the
+        focusers to the predicted positions and return True.  Otherwise return
+        False to indicate a full focus run is needed.
+        '''
+        filter = self.focus_filter()
+        predictions = []
+        for j,dc in enumerate(self.current_OB.detconfig):
+            temperature = self.instrument.get_focus_temperature(focuser=j)
+            position, uncertainty = self.focus_model.predict(filter, j, temperature)
+            if not self.focus_model.good_enough(uncertainty):
+                self.log(f'  Focus model uncertainty for focuser {j} is {uncertainty:.0f}, running focus')
+                return False
+            predictions.append((position, uncertainty, temperature))
+        for j,(position, uncertainty, temperature) in enumerate(predictions):
+            self.log(f'  Focus model: focuser {j} to {position:.0f} +/- {uncertainty:.0f} at T={temperature:.1f}')
+            self.instrument.set_focus(position, focuser=j)
+        return True
+
+
+    def update_focus_model(self, fitted):
+        filter = self.focus_filter()
+        for j,position in fitted.items():
+            temperature = self.instrument.get_focus_temperature(focuser=j)
+            self.focus_model.add(filter, j, temperature, position)
+
+
+    def take_focus_series(self, centers):
+        '''Step the focusers through the focus offsets of the current OB
+        around the given center positions, exposing all detectors at each step.
+
+        Each frame is handed to the analysis pool as soon as it is read out,
+        so it is measured while the next focus position is being exposed.
+        Returns a list (one entry per detector) of (position, future) tuples,
+        where the future is None if the detector returned no data.
+        '''
+        OB = self.current_OB
+        detconfig = OB.detconfig
+        measurements = [[] for dc in detconfig]
+        with ThreadPoolExecutor(max_workers=len(detconfig)) as cameras:
+            for i,offset in enumerate(OB.focus_offsets()):
+                for j,center in enumerate(centers):
+                    self.instrument.set_focus(center + offset, focuser=j)
+                self.log(f'  Focus position {i+1} of {OB.n_focus_positions} (offset {offset:+.0f})')
+                for k in range(OB.images_per_position):
+                    hdr = mirrored_header(self.device_state,
+                                          ['telescope.header', 'instrument.header'],
+                                          max_age=self.header_max_age)
+                    hdr += OB.to_header()
+                    exposures = [cameras.submit(self.detector[j].expose,
+                                                additional_header=deepcopy(hdr))
+                                 for j,dc in enumerate(detconfig)]
+                    for j,exposure in enumerate(exposures):
+                        try:
+                            hdul = exposure.result()
+                        except HardwareFailure:
+                            raise
+                        except Exception as err:
+                            raise FocusRunFailure(f'Detector {j} exposure failed: {err}') from err
+                        if hdul is None:
+                            measurements[j].append((centers[j] + offset, None))
+                        else:
+                            measurements[j].append((centers[j] + offset,
+                                                    self.submit_analysis(measure_frame, hdul[0].data)))
+        return measurements
+
+
+    def focus_measurement(self, future, pool):
+        '''The measurement of a focus frame, or an empty one (which the fit
+        ignores) if there was no data or the analysis failed.
+        '''
+        if future is None:
+            return measure_frame(None)
+        try:
+            return future.result()
+        except Exception as err:
+            self.log(f'  Focus frame analysis failed: {err}', level=WARNING)
+            if isinstance(err, BrokenProcessPool):
+                self.restart_analysis_pool(pool)
+            return measure_frame(None)
+
+
+    def focus_fit_parabola(self):
+        '''Take a focus series, measure the FWHM of stars in each frame, fit a
+        parabola to the FWHM vs. position for each focuser, and move each
+        focuser to its best position.  If the best focus is outside the range
+        sampled and refocus_if_near_edge is set, the run is repeated once
+        centered on the new position.
+
+        Returns a dict of best focus positions keyed by focuser number for
+        each focuser which was fit.  Raises FocusRunFailure if no detector
+        returned image data.
         '''
+        OB = self.current_OB
+        for j,dc in enumerate(OB.detconfig):
+            self.detector[j].setup_detector(dc)
+        start = [self.instrument.get_focus(focuser=j) for j,dc in enumerate(OB.detconfig)]
+        centers = list(start)
+        offsets = OB.focus_offsets()
+        fitted = {}
+        try:
+            for attempt in range(2):
+                pool = self.analysis_pool
+                measurements = self.take_focus_series(centers)
+                near_edge = False
+                for j,series in enumerate(measurements):
+                    if np.all([f is None for p,f in series]):
+                        self.log(f'  No image data from detector {j}, focus unchanged',
+                                 level=WARNING)
+                        continue
+                    positions = np.array([p for p,f in series])
+                    results = [self.focus_measurement(f, pool) for p,f in series]
+                    fwhm = np.array([r['fwhm'] for r in results])
+                    for pos,r in zip(positions, results):
+                        self.log(f'  Focuser {j} at {pos:.0f}: FWHM={r["fwhm"]:.2f} pix ({r["nstars"]} stars)',
+                                 level=DEBUG)
+                    best, best_fwhm = fit_parabola(positions, fwhm)
+                    self.log(f'  Focuser {j} best focus {best:.0f} (FWHM={best_fwhm:.2f} pix)')
+                    low = centers[j] + offsets.min()
+                    high = centers[j] + offsets.max()
+                    if best < low or best > high:
+                        near_edge = True
+                        best = min(max(best, low), high)
+                        self.log(f'  Focuser {j} best focus is outside sampled range',
+                                 level=WARNING)
+                    centers[j] = best
+                    fitted[j] = best
+                if near_edge is False or OB.refocus_if_near_edge is False:
+                    break
+            if len(fitted) == 0:
+                raise FocusRunFailure('No image data from any detector')
+        except:
+            for j,position in enumerate(start):
+                self.instrument.set_focus(position, focuser=j)
+            raise
+        for j,position in enumerate(centers):
+            self.log(f'  Moving focuser {j} to {position:.0f}')
+            self.instrument.set_focus(position, focuser=j)
+        return fitted
+
+
+    def publish_preview(self, detector_index, hdul, filename):
+        '''Copy a new frame in to the shared memory ring buffer for this
+        detector, named {instance_name}_det{detector_index}, for quick-look
+        displays.  The buffer is created on the first frame.
+        '''
+        data = image_data(hdul)
+        if data is None:
+            return
+        with self.preview_lock:
+            if detector_index not in self.previews.keys():
+                slot_bytes = max(data.nbytes, self.preview_slot_bytes or 0)
+                ring = FrameRing(f'{self.instance_name}_det{detector_index}',
+                                 nslots=self.preview_slots,
+                                 slot_bytes=slot_bytes, create=True)
+                self.previews[detector_index] = ring
+                self.log(f'Created preview buffer {ring.name}')
+        header = hdul[0].header
+        n = self.previews[detector_index].publish(data,
+                    filename=str(filename), detector=detector_index,
+                    **{key: header.get(key, None)
+                       for key in ['DATE-OBS', 'EXPTIME', 'OBJECT', 'EXPNO',
+                                   'POSITION']})
+        if n is None:
+            self.log(f'Frame too large for preview buffer', level=WARNING)
+
+
+    def analyze_frame(self, detector_index, hdul, filename):
+        '''Measure the quality of a new frame in the analysis process pool.  The
+        frame is handed to the pool without waiting, so the exposure thread
+        is not held up.
+        '''
+        data = image_data(hdul)
+        pool = self.analysis_pool
+        if data is None or pool is None:
+            return
+        try:
+            future = self.submit_analysis(measure_frame_quality, data,
+                                          filename, factor=self.quality_factor,
+                                          saturation=self.saturation)
+        except Exception as err:
+            self.log(f'Could not analyze {filename.name}: {err}', level=WARNING)
+            return
+        future.add_done_callback(partial(self.frame_quality_done,
+                                         detector_index, filename, pool))
+        self.quality_futures.append(future)
+
+
+    def submit_analysis(self, function, *args, **kwargs):
+        '''Submit a job to the analysis pool.  If the pool is broken (e.g. a
+        worker process died) it is replaced and the job submitted again.
+        '''
+        pool = self.analysis_pool
+        try:
+            return pool.submit(function, *args, **kwargs)
+        except BrokenProcessPool:
+            self.restart_analysis_pool(pool)
+            return self.analysis_pool.submit(function, *args, **kwargs)
+
+
+    def restart_analysis_pool(self, broken):
+        '''Replace the analysis pool with a new one if it is still the given
+        broken pool, so later focus runs and frame analysis still work.
+        '''
+        with self.analysis_lock:
+            if broken is None or self.analysis_pool is not broken:
+                return
+            self.log('Analysis pool is broken, starting a new one',
+                     level=WARNING)
+            broken.shutdown(wait=False)
+            self.analysis_pool = ProcessPoolExecutor(max_workers=self.analysis_workers,
+                                                     mp_context=analysis_context())
+
+
+    def frame_quality_done(self, detector_index, filename, pool, future):
+        try:
+            quality = future.result()
+        except Exception as err:
+            self.log(f'Frame analysis of {filename.name} failed: {err}',
+                     level=WARNING)
+            if isinstance(err, BrokenProcessPool):
+                self.restart_analysis_pool(pool)
+            return
+        problems = quality_problems(quality, self.quality_limits)
+        quality['bad'] = len(problems) > 0
+        self.log('%s: %d stars, FWHM %.1f, ellipticity %.2f, background %.0f',
+                 filename.name, quality['nstars'], quality['fwhm'],
+                 quality['ellipticity'], quality['background'])
+        if quality['bad'] is True:
+            self.log(f'{filename.name} is bad: {", ".join(problems)}',
+                     level=WARNING)
+        quality['filename'] = filename.name
+        try:
+            self.status_stream.update({f'frame_quality{detector_index}': quality})
+        except Exception as err:
+            self.log(f'Failed to update status: {err}', level=WARNING)
+
+
+    def collect_frame_quality(self):
+        '''Wait for the analysis of this OB's frames and summarize it for the
+        ledger: the number of bad frames and the median background, FWHM,
+        and ellipticity.
+        '''
+        futures, self.quality_futures = self.quality_futures, []
+        results = []
+        for future in futures:
+            try:
+                quality = future.result()
+            except Exception:
+                continue
+            quality['bad'] = len(quality_problems(quality, self.quality_limits)) > 0
+            results.append(quality)
+        if len(results) == 0:
+            return {}
+        summary = {'nbad': sum([q['bad'] for q in results])}
+        for key in ['background', 'fwhm', 'ellipticity']:
+            values = np.array([q[key] for q in results])
+            finite = np.isfinite(values)
+            summary[key] = float(np.median(values[finite]))\
+                           if np.any(finite) else np.nan
+        return summary
+
+
+    def move_to_offset(self, current, target):
+        '''Offset the telescope from the current (east, north) offset in arcsec
+        to the target offset.  Returns the offset the telescope is now at.
+        '''
+        east, north = target[0] - current[0], target[1] - current[1]
+        if east == 0 and north == 0:
+            return current
+        self.log(f'  Offsetting telescope by ({east:.1f}, {north:.1f}) arcsec')
+        try:
+            self.telescope.offset(east, north)
+        except TelescopeFailure as err:
+            self.log('Telescope offset failed', level=ERROR)
+            self.log(f'{err}', level=ERROR)
+            self.errors.append(err)
+            self.error_count += 1
+            return current
+        return target
+
+
+    def record_position_timing(self, i, start, exposing, integrated, moved,
+                               done):
+        '''Log and record how the time at one pattern position was spent:
+        - offset: waiting for the telescope before exposing
+        - integrate: until every detector finished integrating
+        - readout: from then until all frames were read out and written
+        - move: the offset to the next position (hidden in readout unless
+          longer)
+        '''
+        timing = {'position': i+1,
+                  'offset': exposing - start,
+                  'integrate': integrated - exposing,
+                  'readout': done - integrated,
+                  'move': moved - integrated,
+                  'total': done - start}
+        self.position_timings.append(timing)
+        for phase in ['offset', 'integrate', 'readout', 'move']:
+            self.metrics.observe('position_seconds', timing[phase], phase=phase)
+        dead = timing['offset'] + timing['readout']
+        self.log('  Position %d took %.1fs: offset %.1fs, integrate %.1fs, '
+                 'readout %.1fs, move %.1fs (%.0f%% dead time)', i+1,
+                 timing['total'], timing['offset'], timing['integrate'],
+                 timing['readout'], timing['move'],
+                 100*dead/timing['total'] if timing['total'] > 0 else 0)
+
+
+    def begin_observation(self):
+        '''Take data at each position in the offset pattern.  The move to the
+        next position starts as soon as the last frame at this position has
+        been integrated, overlapping with its readout and the FITS writes.
         '''
         self.log(f'Starting observations: {self.current_OB.pattern}')
         obhdr = self.current_OB.to_header()
-        for i,position in enumerate(self.current_OB.pattern):
-            self.log(f'  Starting observation at position {i+1} of {len(self.current_OB.pattern)}')
+        nframes = 0
+        detconfig = self.current_OB.detconfig
+        pattern = list(self.current_OB.pattern)
+        offsets = [pattern_offset(position) for position in pattern]
+        offset = (0, 0)
+        self.position_timings = []
+        for i,position in enumerate(pattern):
+            if i < self.resume_position:
+                self.log(f'  Skipping position {i+1} (completed before restart)')
+                continue
+            if i == self.resume_position and self.resume_frames is not None:
+                first_frames = list(self.resume_frames)
+            else:
+                first_frames = [0 for dc in detconfig]
+            self.position_index = i
+            self.frames_done = list(first_frames)
+            self.write_checkpoint()
+            self.log(f'  Starting observation at position {i+1} of {len(pattern)}')
             obhdr.set('POSITION', value=i+1, comment='Offset pattern position number')
-            # Offset to position
+            # Offset to position (usually already done during the readout of
+            # the previous position)
+            position_start = perf_counter()
+            offset = self.move_to_offset(offset, offsets[i])
+            exposure_start = perf_counter()
 
             # Set guiding for this position
             if position.guide is True:
+                if not self.guider_ok():
+                    self.log('  Guider connection is down', level=WARNING)
                 raise NotImplementedError('Guiding not implemented')
             else:
                 self.log(f'  No guiding at this position')
                 # Turn off guiding
 
-            # Start exposures on all cameras
+            # Start exposures on all cameras, each in its own persistent
+            # worker thread, synchronized by the clock
             threads = []
-            headers = [deepcopy(obhdr) for dc in self.current_OB.detconfig]
-            for j,dc in enumerate(self.current_OB.detconfig):
+            headers = [deepcopy(obhdr) for dc in detconfig]
+            clock = ExposureClock(len(detconfig), free_run=self.free_run,
+                                  timeout=self.exposure_sync_timeout)
+            for j,dc in enumerate(detconfig):
                 self.log(f'Starting exposure thread {j}')
                 threadargs = (headers[j], dc, self.telescope, self.instrument,
-                              self.detector[j], self.datadir, self.logger)
-                x = threading.Thread(target=start_obseravtion_thread,
-                              args=threadargs)
-                threads.append(x)
-                x.start()
+                              self.detector[j], self.datadir, self.logger,
+                              self.metrics, first_frames[j],
+                              partial(self.exposure_progress, j))
+                callbacks = []
+                if self.preview_slots > 0:
+                    callbacks.append(partial(self.publish_preview, j))
+                if self.frame_quality is True:
+                    callbacks.append(partial(self.analyze_frame, j))
+                threadargs += (callbacks, clock, j, self.device_state,
+                               self.header_max_age)
+                threads.append(self.exposure_pools[j].submit(start_obseravtion_thread,
+                                                             *threadargs))
+            # Move to the next position (or back to 0, 0) while reading out.
+            # If the detectors do not report the end of integration in time
+            # (allowing exposure_sync_timeout per frame for overheads), wait
+            # for the exposure threads before moving.
+            timeout = max([max(0, dc.nexp - first_frames[j])\
+                           *(float(dc.exptime) + self.exposure_sync_timeout)
+                           for j,dc in enumerate(detconfig)]\
+                          + [self.exposure_sync_timeout])
+            integrated_in_time = clock.wait_integrated(timeout=timeout)
+            if integrated_in_time is False:
+                msg = f'Detectors did not finish integrating within {timeout:.0f}s'
+                self.log(msg, level=ERROR)
+                self.errors.append(DetectorFailure(msg))
+                self.error_count += 1
+            integrated = perf_counter()
+            next_offset = offsets[i+1] if i+1 < len(pattern) else (0, 0)
+            if integrated_in_time is True:
+                offset = self.move_to_offset(offset, next_offset)
+            moved = perf_counter()
             for index, thread in enumerate(threads):
-                thread.join()
-                self.log(f"Exposure thread {index} done")
-
-        # return to offset 0, 0
-        self.record_OB(failed=False)
+                try:
+                    nframes += sum(thread.result())
+                except Exception as err:
+                    self.log(f"Exposure thread {index} failed: {err}",
+                             level=ERROR)
+                else:
+                    self.log(f"Exposure thread {index} done")
+            if integrated_in_time is False:
+                offset = self.move_to_offset(offset, next_offset)
+                moved = perf_counter()
+            self.record_position_timing(i, position_start, exposure_start,
+                                        integrated, moved, perf_counter())
+
+        self.record_OB(failed=False, nframes=nframes,
+                       quality=self.collect_frame_quality())
         self.observation_complete()
 
 
+def analysis_context():
+    '''Start the analysis worker processes with forkserver (or spawn where
+    it is not available) rather than forking the threads of the control
+    process.
+    '''
+    methods = multiprocessing.get_all_start_methods()
+    method = 'forkserver' if 'forkserver' in methods else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def pattern_offset(position):
+    '''Return the (east, north) offset in arcsec of a position in an offset
+    pattern.  Offsets may be numbers (arcsec) or angle quantities.
+    '''
+    offset = []
+    for name in ['dx', 'dy']:
+        value = getattr(position, name, 0)
+        if hasattr(value, 'unit'):
+            value = value.to(u.arcsec).value
+        offset.append(float(value))
+    return tuple(offset)
+
+
+QUALITY_KEYWORDS = {'background': ('QBKG', 'Background level'),
+                    'noise': ('QNOISE', 'Background noise per pixel'),
+                    'nsaturated': ('QNSAT', 'Number of saturated pixels'),
+                    'nstars': ('QNSTARS', 'Number of stars measured'),
+                    'fwhm': ('QFWHM', 'Median star FWHM (pix)'),
+                    'hfd': ('QHFD', 'Median star HFD (pix)'),
+                    'ellipticity': ('QELLIP', 'Median star ellipticity'),
+                    }
+
+
+def measure_frame_quality(data, filename, factor=2, saturation=None):
+    '''Measure frame quality and write it in to the header of the (already
+    written) FITS file.  This runs in the analysis process pool.
+    '''
+    quality = frame_quality(data, factor=factor, saturation=saturation)
+    with fits.open(filename, mode='update') as hdul:
+        for key, (keyword, comment) in QUALITY_KEYWORDS.items():
+            if np.isfinite(quality[key]):
+                hdul[0].header.set(keyword, value=quality[key], comment=comment)
+    return quality
+
+
+fits_filename_lock = threading.Lock()
+fits_filenames_taken = set()
+
+
 def build_fits_filename(camera='cam', datadir=Path('.')):
+    '''Build a file name from the camera name and the time.  Frames from the
+    same camera in the same second (e.g. from two observatories sharing a
+    datadir) get a sequence number, so a name is never handed out twice or
+    used for a file which already exists.
+    '''
     date_time_string = datetime.utcnow().strftime(f'%Y%m%d_at_%H%M%S')
-    fits_filename = f"{camera}_{date_time_string}UT.fits"
-    fits_file = datadir.joinpath(fits_filename)
+    with fits_filename_lock:
+        fits_file = datadir.joinpath(f"{camera}_{date_time_string}UT.fits")
+        n = 1
+        while fits_file in fits_filenames_taken or fits_file.exists():
+            fits_file = datadir.joinpath(f"{camera}_{date_time_string}UT_{n}.fits")
+            n += 1
+        fits_filenames_taken.add(fits_file)
     return fits_file
 
 
+def mirrored_header(device_state, keys, max_age=None):
+    '''Combine the mirrored headers with the given keys (e.g.
+    'telescope.header'), reading any older than max_age seconds from the
+    device.  The age of the oldest is written as HDRAGE.
+    '''
+    hdr = fits.Header()
+    ages = []
+    for key in keys:
+        hdr += device_state.get(key, max_age=max_age, copy=True)
+        ages.append(device_state.age(key))
+    ages = [age for age in ages if age is not None]
+    hdr.set('HDRAGE', value=round(max(ages), 2) if len(ages) > 0 else 0,
+            comment='[s] Age of the device header metadata')
+    return hdr
+
+
 def start_obseravtion_thread(obhdr, dc, telescope, instrument, detector, 
-                             datadir, log):
+                             datadir, log, metrics=None, first_frame=0,
+                             progress=None, callbacks=[], clock=None,
+                             index=0, device_state=None, header_max_age=None):
     # Set detector parameters
     log.info(f'{dc.instrument} : Setting detector parameters')
-    detector.setup_detector(dc)
+    try:
+        detector.setup_detector(dc)
+    except Exception:
+        if clock is not None:
+            clock.abort()
+            clock.finished(index)
+        raise
+
+    # Wait for the other detectors
+    frame_time = dc.exptime
+    if clock is not None:
+        if not clock.start(index, dc.nexp - first_frame, frame_time):
+            log.warning(f'{dc.instrument} : Exposure start not synchronized')
 
     # Take Data
     filesok = []
+    report_integrated = getattr(detector, 'set_integration_callback', None)
     obhdr += dc.to_header()
-    for j in range(dc.nexp):
-        obhdr.set('EXPNO', value=j+1, comment='Exposure number at this position')
-        log.info(f'{dc.instrument} : Starting {dc.exptime:.0f}s exposure ({j+1} of {dc.nexp})')
-        hdr = telescope.collect_header_metadata()
-        hdr += instrument.collect_header_metadata()
-        hdr += obhdr
-        try:
-            hdul = detector.expose(additional_header=hdr)
-        except DetectorFailure as err:
-            log.error('{dc.instrument} : Detector failure')
-            log.error(f'{dc.instrument} : {err}')
-            hdul = None
-        else:
-            ff = build_fits_filename(camera=dc.instrument,
-                                     datadir=datadir)
-            log.info(f'{dc.instrument} : Writing {ff.name}')
-            hdul.writeto(ff, overwrite=False)
-            filesok.append(ff.exists())
+    j = first_frame
+    try:
+        while j < dc.nexp or\
+              (clock is not None and clock.extra_frame_fits(index, frame_time)):
+            frame_start = perf_counter()
+            obhdr.set('EXPNO', value=j+1, comment='Exposure number at this position')
+            if j < dc.nexp:
+                log.info(f'{dc.instrument} : Starting {dc.exptime:.0f}s exposure ({j+1} of {dc.nexp})')
+            else:
+                log.info(f'{dc.instrument} : Starting {dc.exptime:.0f}s exposure ({j+1}, free running)')
+            if device_state is not None:
+                hdr = mirrored_header(device_state,
+                                      ['telescope.header', 'instrument.header'],
+                                      max_age=header_max_age)
+            else:
+                hdr = telescope.collect_header_metadata()
+                hdr += instrument.collect_header_metadata()
+            hdr += obhdr
+            if clock is not None:
+                frame_id = clock.begin_frame(index, last_required=(j == dc.nexp-1),
+                                             extra=(j >= dc.nexp))
+                if frame_id is None:
+                    break
+                # A detector which reports when the shutter closes lets the
+                # telescope move while the frame reads out, otherwise the
+                # frame counts as integrating until expose returns
+                if report_integrated is not None:
+                    report_integrated(partial(clock.end_integration, index,
+                                              frame_id))
+            try:
+                hdul = detector.expose(additional_header=hdr)
+            except DetectorFailure as err:
+                log.error('{dc.instrument} : Detector failure')
+                log.error(f'{dc.instrument} : {err}')
+                hdul = None
+            if clock is not None:
+                if report_integrated is not None:
+                    report_integrated(None)
+                clock.end_integration(index, frame_id)
+            if hdul is None:
+                log.debug(f'{dc.instrument} : No data returned')
+            else:
+                ff = build_fits_filename(camera=dc.instrument,
+                                         datadir=datadir)
+                log.info(f'{dc.instrument} : Writing {ff.name}')
+                if metrics is not None:
+                    with metrics.timer('writeto_seconds', instrument=dc.instrument):
+                        hdul.writeto(ff, overwrite=False)
+                else:
+                    hdul.writeto(ff, overwrite=False)
+                filesok.append(ff.exists())
+                for callback in callbacks:
+                    callback(hdul, ff)
+            j += 1
+            if progress is not None:
+                progress(min(j, dc.nexp))
+            # Use the measured time per frame (with overheads) from here on
+            frame_time = perf_counter() - frame_start
+            if clock is not None and j <= dc.nexp:
+                clock.update(index, dc.nexp - j, frame_time)
+    finally:
+        if clock is not None:
+            clock.finished(index)
     return filesok
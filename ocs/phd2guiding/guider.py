@@ -108,8 +108,14 @@ class _Conn:
                 if events:
                     break
             #print("DBG: call recv")
-            s = self.sock.recv(4096)
+            try:
+                s = self.sock.recv(4096)
+            except OSError:
+                s = b''
             #print(f"DBG: recvd: {len(s)}: {s}")
+            if not s:
+                # peer closed the socket
+                return ''
             i0 = 0
             i = i0
             while i < len(s):
@@ -142,15 +148,25 @@ class Guider:
 
     DEFAULT_STOPCAPTURE_TIMEOUT = 10
 
-    def __init__(self, hostname = "localhost", instance = 1):
+    def __init__(self, hostname = "localhost", instance = 1,
+                 auto_reconnect = True, reconnect_delay = 1,
+                 max_reconnect_delay = 30):
         self.hostname = hostname
         self.instance = instance
         self.conn = None
         self.terminate = False
+        self.terminate_event = threading.Event()
         self.worker = None
         self.lock = threading.Lock()
+        self.conn_lock = threading.Lock()  # held while self.conn is swapped
         self.cond = threading.Condition()
         self.response = None
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.Connected = False
+        self.ReconnectCount = 0
+        self.DisconnectedAt = None
         self.AppState = ''
         self.AvgDist = 0
         self.Version = ''
@@ -253,6 +269,58 @@ class Guider:
             #print(f"DBG: todo: handle event {e}")
             pass
         
+    def _on_disconnect(self):
+        """mark the connection as down and release anything waiting on it
+        so callers fail immediately instead of waiting out their timeouts
+
+        """
+        with self.lock:
+            self.AppState = ''
+            self.AvgDist = 0
+            self.accum_active = False
+            if self.Settle and not self.Settle.Done:
+                s = SettleProgress()
+                s.Done = True
+                s.Status = 1
+                s.Error = "PHD2 Server disconnected"
+                self.Settle = s
+        with self.cond:
+            self.Connected = False
+            self.DisconnectedAt = time.time()
+            self.cond.notify_all()
+
+    def _reconnect(self):
+        """reconnect to PHD2 with exponential backoff. PHD2 sends Version
+        and AppState events to every new client, so the event stream
+        rebuilds AppState without any further requests.
+
+        """
+        delay = self.reconnect_delay
+        while not self.terminate:
+            if self.terminate_event.wait(delay):
+                break
+            conn = _Conn()
+            try:
+                conn.Connect(self.hostname, 4400 + self.instance - 1)
+            except OSError:
+                #print(f"DBG: reconnect failed, retry in {delay}s")
+                delay = min(2 * delay, self.max_reconnect_delay)
+                continue
+            with self.conn_lock:
+                if self.terminate:
+                    # Disconnect was called while we were connecting
+                    conn.Disconnect()
+                    return False
+                old_conn = self.conn
+                self.conn = conn
+            if old_conn is not None:
+                old_conn.Disconnect()
+            with self.cond:
+                self.Connected = True
+                self.ReconnectCount += 1
+            return True
+        return False
+
     def _worker(self):
         while not self.terminate:
             line = self.conn.ReadLine()
@@ -261,7 +329,9 @@ class Guider:
                 if not self.terminate:
                     # server disconnected
                     #print("DBG: server disconnected")
-                    pass
+                    self._on_disconnect()
+                    if self.auto_reconnect and self._reconnect():
+                        continue
                 break
             try:
                 j = json.loads(line)
@@ -285,6 +355,8 @@ class Guider:
             self.conn = _Conn()
             self.conn.Connect(self.hostname, 4400 + self.instance - 1)
             self.terminate = False
+            self.terminate_event.clear()
+            self.Connected = True
             self.worker = threading.Thread(target=self._worker)
             self.worker.start()
             #print("DBG: connect done")
@@ -298,13 +370,19 @@ class Guider:
             if self.worker.is_alive():
                 #print("DBG: terminating worker")
                 self.terminate = True
-                self.conn.Terminate()
+                self.terminate_event.set()
+                with self.conn_lock:
+                    if self.conn is not None:
+                        self.conn.Terminate()
                 #print("DBG: joining worker")
                 self.worker.join()
             self.worker = None
-        if self.conn is not None:
-            self.conn.Disconnect()
+        with self.conn_lock:
+            conn = self.conn
             self.conn = None
+        if conn is not None:
+            conn.Disconnect()
+        self.Connected = False
         #print("DBG: disconnect done")
 
     @staticmethod
@@ -333,22 +411,39 @@ class Guider:
         """
         s = self._make_jsonrpc(method, params)
         #print(f"DBG: Call: {s}")
+        self._CheckConnected()
+        with self.conn_lock:
+            conn = self.conn
+        if conn is None:
+            raise GuiderException("PHD2 Server disconnected")
         # send request
-        self.conn.WriteLine(s + "\r\n")
-        # wait for response
+        try:
+            conn.WriteLine(s + "\r\n")
+        except (OSError, RuntimeError) as err:
+            raise GuiderException(f"PHD2 Server disconnected: {err}")
+        # wait for response, giving up as soon as the connection drops
         with self.cond:
-            while not self.response:
+            while not self.response and self.Connected:
                 self.cond.wait()
             response = self.response
             self.response = None
+        if response is None:
+            raise GuiderException("PHD2 Server disconnected")
         if self._failed(response):
             raise GuiderException(response["error"]["message"])
         return response
 
     def _CheckConnected(self):
-        if not self.conn.IsConnected():
+        if not self.Connected or self.conn is None or not self.conn.IsConnected():
             raise GuiderException("PHD2 Server disconnected")
 
+    def IsHealthy(self):
+        """cheap, non-blocking check that the connection is up and the
+        AppState has been rebuilt from the event stream
+
+        """
+        return self.Connected and self.AppState != ''
+
     def Guide(self, settlePixels, settleTime, settleTimeout):
         """Start guiding with the given settling parameters. PHD2 takes care
         of looping exposures, guide star selection, and settling. Call
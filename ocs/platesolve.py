@@ -0,0 +1,257 @@
+from pathlib import Path
+import numpy as np
+
+from .imageanalysis import measure_stars, downsample
+
+
+##-------------------------------------------------------------------------
+## Tangent Plane Projection
+##-------------------------------------------------------------------------
+def project(ra, dec, ra0, dec0):
+    '''Gnomonic projection of ra, dec (degrees) about ra0, dec0.  Returns
+    standard coordinates xi (east) and eta (north) in arcsec.
+    '''
+    ra, dec = np.radians(ra), np.radians(dec)
+    ra0, dec0 = np.radians(ra0), np.radians(dec0)
+    cosc = np.sin(dec0)*np.sin(dec) + np.cos(dec0)*np.cos(dec)*np.cos(ra - ra0)
+    xi = np.cos(dec)*np.sin(ra - ra0) / cosc
+    eta = (np.cos(dec0)*np.sin(dec) - np.sin(dec0)*np.cos(dec)*np.cos(ra - ra0)) / cosc
+    return np.degrees(xi)*3600, np.degrees(eta)*3600
+
+
+def deproject(xi, eta, ra0, dec0):
+    '''Inverse of project: standard coordinates in arcsec to ra, dec.
+    '''
+    xi, eta = np.radians(np.asarray(xi)/3600), np.radians(np.asarray(eta)/3600)
+    ra0, dec0 = np.radians(ra0), np.radians(dec0)
+    denom = np.cos(dec0) - eta*np.sin(dec0)
+    ra = ra0 + np.arctan2(xi, denom)
+    dec = np.arctan2(np.sin(dec0) + eta*np.cos(dec0), np.hypot(xi, denom))
+    return np.degrees(ra) % 360, np.degrees(dec)
+
+
+def separation(ra1, dec1, ra2, dec2):
+    '''Angular separation in degrees (haversine).
+    '''
+    ra1, dec1, ra2, dec2 = [np.radians(a) for a in [ra1, dec1, ra2, dec2]]
+    h = np.sin((dec2 - dec1)/2)**2 + np.cos(dec1)*np.cos(dec2)*np.sin((ra2 - ra1)/2)**2
+    return np.degrees(2*np.arcsin(np.sqrt(np.clip(h, 0, 1))))
+
+
+##-------------------------------------------------------------------------
+## Indexed Star Catalog
+##-------------------------------------------------------------------------
+class StarCatalog():
+    '''A local star catalog indexed on a grid of sky cells.
+
+    The sky is divided into declination bands of band_height degrees, and
+    each band into RA cells of about the same width on the sky.  Stars are
+    stored sorted by cell in stars.npy (ra, dec, mag) with the index of the
+    first star in each cell in index.npz, so a cone search only reads the
+    cells it overlaps from the memory mapped catalog.
+
+    Use build_catalog to write a catalog directory.
+    '''
+    def __init__(self, directory):
+        self.directory = Path(directory).expanduser()
+        self.stars = np.load(self.directory/'stars.npy', mmap_mode='r')
+        index = np.load(self.directory/'index.npz')
+        self.band_height = float(index['band_height'])
+        self.nra = index['nra']
+        self.band_start = index['band_start']
+        self.cell_start = index['cell_start']
+
+
+    def __len__(self):
+        return len(self.stars)
+
+
+    def cone(self, ra, dec, radius, max_mag=None):
+        '''Return the stars within radius degrees of ra, dec.
+        '''
+        h = self.band_height
+        nbands = len(self.nra)
+        first = int(np.clip(np.floor((dec - radius + 90)/h), 0, nbands-1))
+        last = int(np.clip(np.floor((dec + radius + 90)/h), 0, nbands-1))
+        chunks = []
+        for band in range(first, last+1):
+            nra = int(self.nra[band])
+            edge = max(abs(band*h - 90), abs((band+1)*h - 90))
+            cosdec = np.cos(np.radians(min(edge, 90)))
+            halfwidth = radius/cosdec if cosdec > 0 else 360
+            if halfwidth >= 180 or nra == 1:
+                cells = np.arange(nra)
+            else:
+                lo = int(np.floor((ra - halfwidth) % 360 / 360 * nra))
+                hi = int(np.floor((ra + halfwidth) % 360 / 360 * nra))
+                cells = np.arange(lo, hi+1) if lo <= hi else\
+                        np.concatenate([np.arange(lo, nra), np.arange(0, hi+1)])
+            for cell in np.unique(cells):
+                i = self.band_start[band] + cell
+                start, end = self.cell_start[i], self.cell_start[i+1]
+                if end > start:
+                    chunks.append(self.stars[start:end])
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=self.stars.dtype)
+        stars = np.concatenate(chunks)
+        keep = separation(ra, dec, stars['ra'], stars['dec']) <= radius
+        if max_mag is not None:
+            keep &= stars['mag'] <= max_mag
+        return stars[keep]
+
+
+def build_catalog(ra, dec, mag, directory, band_height=1.0):
+    '''Write an indexed StarCatalog directory from arrays of ra, dec (degrees)
+    and magnitude.
+    '''
+    directory = Path(directory).expanduser()
+    directory.mkdir(parents=True, exist_ok=True)
+    ra = np.asarray(ra, dtype=np.float64) % 360
+    dec = np.asarray(dec, dtype=np.float64)
+    nbands = int(np.ceil(180/band_height))
+    centers = -90 + (np.arange(nbands) + 0.5)*band_height
+    nra = np.maximum(1, np.round(360*np.cos(np.radians(centers))/band_height)).astype(np.int64)
+    band_start = np.concatenate([[0], np.cumsum(nra)])
+    band = np.clip(np.floor((dec + 90)/band_height).astype(np.int64), 0, nbands-1)
+    cell = np.minimum(np.floor(ra/360*nra[band]).astype(np.int64), nra[band]-1)
+    cell_id = band_start[band] + cell
+    order = np.argsort(cell_id, kind='stable')
+    stars = np.zeros(len(ra), dtype=[('ra', 'f8'), ('dec', 'f8'), ('mag', 'f4')])
+    stars['ra'], stars['dec'], stars['mag'] = ra[order], dec[order], np.asarray(mag)[order]
+    counts = np.bincount(cell_id, minlength=band_start[-1])
+    cell_start = np.concatenate([[0], np.cumsum(counts)])
+    np.save(directory/'stars.npy', stars)
+    np.savez(directory/'index.npz', band_height=band_height, nra=nra,
+             band_start=band_start, cell_start=cell_start)
+    return directory
+
+
+##-------------------------------------------------------------------------
+## Plate Solver
+##-------------------------------------------------------------------------
+class PlateSolver():
+    '''Solve for the pointing of an image near a known position, given the
+    plate scale (arcsec/pixel), rotation (degrees, of north from the +y axis
+    toward east), and parity (-1 if east is toward -x, i.e. north up, east
+    left).
+
+    Stars detected in the image (on a binned copy for speed) are matched to
+    the brightest catalog stars in the field by voting on the offset
+    between every pair of detected and catalog stars, for each rotation
+    in rotation_search.  The matched pairs then give a least squares
+    similarity transform: the pointing error, rotation, and scale.
+    '''
+    def __init__(self, catalog, scale, rotation=0, parity=-1,
+                 search_radius=600, tolerance=10, binning=2, max_stars=40,
+                 max_catalog_stars=200, min_matches=6,
+                 rotation_search=[-2, -1, 0, 1, 2]):
+        self.catalog = catalog
+        self.scale = scale
+        self.rotation = rotation
+        self.parity = parity
+        self.search_radius = search_radius
+        self.tolerance = tolerance
+        self.binning = binning
+        self.max_stars = max_stars
+        self.max_catalog_stars = max_catalog_stars
+        self.min_matches = min_matches
+        self.rotation_search = rotation_search
+
+
+    def detect(self, data):
+        '''Pixel positions of the brightest stars in full frame pixels.
+        '''
+        binned = downsample(np.asarray(data, dtype=np.float32), self.binning)
+        stars = measure_stars(binned, max_stars=self.max_stars)
+        f = max(self.binning, 1)
+        return stars['x']*f + (f - 1)/2, stars['y']*f + (f - 1)/2
+
+
+    def pixels_to_sky(self, x, y, shape, rotation=None):
+        '''Offsets from the image center in arcsec (east, north).
+        '''
+        rotation = self.rotation if rotation is None else rotation
+        dx = (np.asarray(x) - (shape[1] - 1)/2) * self.parity * self.scale
+        dy = (np.asarray(y) - (shape[0] - 1)/2) * self.scale
+        theta = np.radians(rotation)
+        return (dx*np.cos(theta) + dy*np.sin(theta),
+                -dx*np.sin(theta) + dy*np.cos(theta))
+
+
+    def vote(self, sky, ref, bin_size):
+        '''Find the most common offset between detected (sky) and catalog
+        (ref) positions.  Returns the number of votes and the offset.
+        '''
+        dxi = (ref[0][:,None] - sky[0][None,:]).ravel()
+        deta = (ref[1][:,None] - sky[1][None,:]).ravel()
+        r = self.search_radius
+        nbins = int(np.ceil(2*r/bin_size))
+        counts, xedges, yedges = np.histogram2d(dxi, deta, bins=nbins,
+                                                range=[[-r, r], [-r, r]])
+        # Sum 2x2 blocks so matches split across bin edges still count
+        counts = counts[:-1,:-1] + counts[1:,:-1] + counts[:-1,1:] + counts[1:,1:]
+        i, j = np.unravel_index(np.argmax(counts), counts.shape)
+        near = (np.abs(dxi - xedges[i+1]) < bin_size)\
+               & (np.abs(deta - yedges[j+1]) < bin_size)
+        if not np.any(near):
+            return 0, (0, 0)
+        return counts[i, j], (np.median(dxi[near]), np.median(deta[near]))
+
+
+    def solve(self, data, ra, dec):
+        '''Solve an image expected to be centered near ra, dec (degrees).
+        Returns None if no solution is found, otherwise a dict with the
+        solved center (ra, dec), the pointing error (offset_east,
+        offset_north in arcsec, solved minus expected), rotation, scale,
+        the number of matched stars, and the rms of the fit in arcsec.
+        '''
+        x, y = self.detect(data)
+        if len(x) < self.min_matches:
+            return None
+        halfdiag = np.hypot(*data.shape)/2*self.scale
+        ref = self.catalog.cone(ra, dec, (halfdiag + self.search_radius)/3600)
+        if len(ref) < self.min_matches:
+            return None
+        ref = ref[np.argsort(ref['mag'])][:self.max_catalog_stars]
+        ref_xy = project(ref['ra'], ref['dec'], ra, dec)
+
+        # Coarse offset and rotation
+        best = (0, None, None)
+        for rotation in self.rotation_search:
+            sky = self.pixels_to_sky(x, y, data.shape, self.rotation + rotation)
+            votes, offset = self.vote(sky, ref_xy, 2*self.tolerance)
+            if votes > best[0]:
+                best = (votes, rotation, offset)
+        votes, rotation, offset = best
+        if votes < self.min_matches:
+            return None
+
+        # Match each detected star to the nearest catalog star
+        sky = self.pixels_to_sky(x, y, data.shape, self.rotation + rotation)
+        dist = np.hypot(ref_xy[0][:,None] - sky[0][None,:] - offset[0],
+                        ref_xy[1][:,None] - sky[1][None,:] - offset[1])
+        nearest = np.argmin(dist, axis=0)
+        matched = dist[nearest, np.arange(len(x))] < self.tolerance
+        if np.sum(matched) < self.min_matches:
+            return None
+        u, v = sky[0][matched], sky[1][matched]
+        xi, eta = ref_xy[0][nearest[matched]], ref_xy[1][nearest[matched]]
+
+        # Least squares similarity transform:
+        # xi = a*u + b*v + c, eta = -b*u + a*v + d
+        n = len(u)
+        A = np.zeros((2*n, 4))
+        A[:n] = np.column_stack([u, v, np.ones(n), np.zeros(n)])
+        A[n:] = np.column_stack([v, -u, np.zeros(n), np.ones(n)])
+        (a, b, c, d), *_ = np.linalg.lstsq(A, np.concatenate([xi, eta]),
+                                           rcond=None)
+        residuals = np.concatenate([xi, eta]) - A @ np.array([a, b, c, d])
+        solved_ra, solved_dec = deproject(c, d, ra, dec)
+        return {'ra': float(solved_ra), 'dec': float(solved_dec),
+                'offset_east': float(c), 'offset_north': float(d),
+                'rotation': float(self.rotation + rotation
+                                  + np.degrees(np.arctan2(b, a))),
+                'scale': float(self.scale*np.hypot(a, b)),
+                'nmatched': int(n),
+                'rms': float(np.sqrt(np.mean(residuals**2))),
+                }
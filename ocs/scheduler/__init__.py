@@ -1 +1,3 @@
 from .scheduler import Scheduler
+from .shared import SharedQueue, QueueView
+from .catalog import OBCatalog, build_object, write_catalog, ALLOWED_CLASSES
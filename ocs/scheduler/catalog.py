@@ -0,0 +1,224 @@
+from pathlib import Path
+from functools import partial
+import importlib
+import json
+import numpy as np
+import yaml
+
+
+##-------------------------------------------------------------------------
+## Build OBs from Catalog Entries
+##-------------------------------------------------------------------------
+# Modules (or full class paths) whose classes a catalog entry may name: the
+# odl blocks and their parts, and the focus blocks
+ALLOWED_CLASSES = ['odl.block', 'odl.target', 'odl.offset', 'odl.alignment',
+                   'odl.instrument_config', 'odl.detector_config',
+                   'ocs.focusing']
+
+
+def build_object(spec, allowed=ALLOWED_CLASSES):
+    '''Recursively instantiate an object from a catalog entry.  Any dict with
+    a "class" key (a dotted path such as "odl.block.ScienceBlock") is
+    replaced by an instance of that class called with the remaining keys as
+    keyword arguments.  Lists are built element by element.
+
+    Only classes in (or modules listed in) allowed are imported, so a
+    catalog file can not run arbitrary code.
+    '''
+    if isinstance(spec, list):
+        return [build_object(s, allowed=allowed) for s in spec]
+    if not isinstance(spec, dict):
+        return spec
+    kwargs = {key: build_object(value, allowed=allowed)
+              for key,value in spec.items() if key != 'class'}
+    if 'class' not in spec.keys():
+        return kwargs
+    module_name, class_name = str(spec['class']).rsplit('.', 1)
+    if module_name not in allowed and spec['class'] not in allowed:
+        raise ValueError(f'Class {spec["class"]} is not allowed in an OB catalog')
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)(**kwargs)
+
+
+def index_fields(entry):
+    '''Extract the fields the catalog is indexed on from a raw entry.
+    '''
+    target = entry.get('target', {}) or {}
+    instconfig = entry.get('instconfig', {}) or {}
+    ra = target.get('RA', target.get('ra', None))
+    try:
+        ra = float(ra)
+    except (TypeError, ValueError):
+        ra = np.nan
+    detconfig = json.dumps(entry.get('detconfig', None), sort_keys=True)
+    return (str(target.get('name', '')), ra,
+            str(instconfig.get('filter', '')), detconfig)
+
+
+##-------------------------------------------------------------------------
+## OB Catalog
+##-------------------------------------------------------------------------
+class OBCatalog():
+    '''An on-disk catalog of OBs stored as JSON lines (one OB per line).
+
+    Only a compact index is held in memory: the byte offset of each line
+    plus its target, RA, filter, and detector configs.  The index is cached next to the
+    catalog in a .npz file and rebuilt if the catalog changes.  OB objects
+    are only built when requested.
+
+    A YAML catalog (a list of entries) is converted to JSON lines once.
+    '''
+    def __init__(self, file, builder=None, allowed=ALLOWED_CLASSES):
+        file = Path(file).expanduser()
+        if file.suffix in ['.yaml', '.yml']:
+            file = self.convert_yaml(file)
+        self.file = file
+        self.builder = partial(build_object, allowed=allowed)\
+                       if builder is None else builder
+        self.FO = open(self.file, 'rb')
+        self.load_index()
+
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+    @staticmethod
+    def convert_yaml(file):
+        jsonl_file = file.with_suffix('.jsonl')
+        if jsonl_file.exists() and\
+           jsonl_file.stat().st_mtime >= file.stat().st_mtime:
+            return jsonl_file
+        with open(file) as FO:
+            entries = yaml.safe_load(FO)
+        write_catalog(entries, jsonl_file)
+        return jsonl_file
+
+
+    def index_file(self):
+        return self.file.with_name(self.file.name + '.index.npz')
+
+
+    def load_index(self):
+        stat = self.file.stat()
+        signature = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        index_file = self.index_file()
+        if index_file.exists():
+            index = np.load(index_file, allow_pickle=False)
+            if np.array_equal(index['signature'], signature)\
+               and 'detconfig_specs' in index.files:
+                self.offsets = index['offsets']
+                self.ra = index['ra']
+                self.target_names = list(index['target_names'])
+                self.target_ids = index['target_ids']
+                self.filter_names = list(index['filter_names'])
+                self.filter_ids = index['filter_ids']
+                self.detconfig_specs = list(index['detconfig_specs'])
+                self.detconfig_ids = index['detconfig_ids']
+                return
+        self.build_index()
+        try:
+            np.savez(index_file, signature=signature, offsets=self.offsets,
+                     ra=self.ra, target_names=np.array(self.target_names),
+                     target_ids=self.target_ids,
+                     filter_names=np.array(self.filter_names),
+                     filter_ids=self.filter_ids,
+                     detconfig_specs=np.array(self.detconfig_specs),
+                     detconfig_ids=self.detconfig_ids)
+        except OSError:
+            pass
+
+
+    def build_index(self):
+        offsets, ras, target_ids, filter_ids, detconfig_ids = [], [], [], [], []
+        targets, filters, detconfigs = {}, {}, {}
+        self.FO.seek(0)
+        offset = 0
+        for line in self.FO:
+            if line.strip() != b'':
+                name, ra, filter, detconfig = index_fields(json.loads(line))
+                offsets.append(offset)
+                ras.append(ra)
+                target_ids.append(targets.setdefault(name, len(targets)))
+                filter_ids.append(filters.setdefault(filter, len(filters)))
+                detconfig_ids.append(detconfigs.setdefault(detconfig,
+                                                           len(detconfigs)))
+            offset += len(line)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.ra = np.array(ras, dtype=np.float64)
+        self.target_names = list(targets.keys())
+        self.target_ids = np.array(target_ids, dtype=np.int32)
+        self.filter_names = list(filters.keys())
+        self.filter_ids = np.array(filter_ids, dtype=np.int32)
+        self.detconfig_specs = list(detconfigs.keys())
+        self.detconfig_ids = np.array(detconfig_ids, dtype=np.int32)
+
+
+    def entry(self, id):
+        self.FO.seek(int(self.offsets[id]))
+        return json.loads(self.FO.readline())
+
+
+    def get(self, id):
+        '''Build the OB object for the given catalog index.
+        '''
+        return self.builder(self.entry(id))
+
+
+    def select(self, mask=None, target=None, filter=None, ra_range=None):
+        '''Return a boolean mask of catalog entries matching the criteria,
+        combined with an optional input mask.  ra_range is (low, high) in
+        degrees and wraps through 0 if low > high.
+        '''
+        output = np.ones(len(self), dtype=bool) if mask is None else mask.copy()
+        if target is not None:
+            if target not in self.target_names:
+                return np.zeros(len(self), dtype=bool)
+            output &= self.target_ids == self.target_names.index(target)
+        if filter is not None:
+            if filter not in self.filter_names:
+                return np.zeros(len(self), dtype=bool)
+            output &= self.filter_ids == self.filter_names.index(filter)
+        if ra_range is not None:
+            low, high = ra_range
+            if low <= high:
+                output &= (self.ra >= low) & (self.ra <= high)
+            else:
+                output &= (self.ra >= low) | (self.ra <= high)
+        return output
+
+
+    def detconfigs(self, mask=None):
+        '''Build each distinct detector config (as given in the entries, e.g.
+        a list with one per detector) used by the entries in mask, without
+        building the OBs.
+        '''
+        ids = self.detconfig_ids if mask is None else self.detconfig_ids[mask]
+        return [self.builder(json.loads(self.detconfig_specs[i]))
+                for i in np.unique(ids)]
+
+
+    def named_targets(self, mask=None):
+        '''Return a dict of the target names of entries (those in mask) with
+        no coordinates of their own, each with the index of the first such
+        entry.  Only the index is used, no OBs are built.
+        '''
+        use = np.isnan(self.ra) if mask is None else mask & np.isnan(self.ra)
+        ids, first = np.unique(self.target_ids[use], return_index=True)
+        entries = np.flatnonzero(use)[first]
+        return {self.target_names[i]: int(id) for i,id in zip(ids, entries)
+                if self.target_names[i] != ''}
+
+
+    def close(self):
+        self.FO.close()
+
+
+def write_catalog(entries, file):
+    '''Write a list of catalog entries (dicts) as JSON lines.
+    '''
+    file = Path(file).expanduser()
+    with open(file, 'w') as FO:
+        for entry in entries:
+            FO.write(json.dumps(entry) + '\n')
+    return file
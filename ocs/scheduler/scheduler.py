@@ -1,13 +1,188 @@
+from itertools import islice
+from contextlib import nullcontext
+import hashlib
+import json
+import numpy as np
+
+from ..checkpoint import OB_key
+
+
 ##-------------------------------------------------------------------------
 ## Scheduler
 ##-------------------------------------------------------------------------
 class Scheduler():
-    def __init__(self, OBs=[]):
-        self.OBs = OBs
+    '''Hand out OBs in the order given.  Each OB is identified by its index
+    in the original list so that progress can be recorded and resumed.
+
+    If an OBCatalog is given instead of a list, only a mask of pending
+    entries is held in memory and each OB is built from the catalog when it
+    is selected.  Selected OBs are dropped from the pending mask.
+    '''
+    def __init__(self, OBs=[], catalog=None):
+        self.catalog = catalog
+        if catalog is not None:
+            self.OBs = []
+            self.ids = []
+            self.pending = np.ones(len(catalog), dtype=bool)
+        else:
+            self.OBs = list(OBs)
+            self.ids = list(range(len(self.OBs)))
+            self.pending = None
+        self.current_id = None
+
+
+    def __len__(self):
+        if self.catalog is not None:
+            return int(np.sum(self.pending))
+        return len(self.OBs)
+
+
+    def select(self, slew_times=None, candidates=1, **criteria):
+        '''Return the next OB.  When using a catalog, criteria are passed to
+        OBCatalog.select to restrict the candidates (e.g. filter='R' or
+        ra_range=(30, 90)).
+
+        If slew_times is given, the first candidates pending OBs are
+        considered and the one with the shortest slew is taken.  slew_times
+        is called with the list of OBs and returns their slew times.
+        '''
+        limit = max(candidates, 1) if slew_times is not None else 1
+        pending = list(islice(self.pending_OBs(**criteria), limit))
+        if len(pending) == 0:
+            self.current_id = None
+            return None
+        i = 0
+        if len(pending) > 1:
+            i = int(np.argmin(slew_times([OB for id, OB in pending])))
+        id, OB = pending[i]
+        if self.catalog is not None:
+            # The OB is already built
+            self.pending[id] = False
+            self.current_id = id
+            return OB
+        return self.take(id)
+
+
+    def pending_OBs(self, **criteria):
+        '''Iterate over (id, OB) for the pending OBs in order, without
+        removing them.  When using a catalog, each OB is built as it is
+        reached and criteria are passed to OBCatalog.select.
+        '''
+        if self.catalog is not None:
+            mask = self.catalog.select(mask=self.pending, **criteria)
+            for id in np.flatnonzero(mask):
+                yield int(id), self.catalog.get(int(id))
+        else:
+            yield from list(zip(self.ids, self.OBs))
+
 
+    def key(self, id, OB):
+        '''A key identifying an OB by its contents (see OB_key).  When using
+        a catalog the key is that of its catalog entry.
+        '''
+        if self.catalog is not None:
+            return OB_key(self.catalog.entry(id))
+        return OB_key(OB)
 
-    def select(self):
-        if len(self.OBs) > 0:
-            return self.OBs.pop(0)
+
+    def pending_keys(self):
+        '''Iterate over (id, key) for the pending OBs in order.  When using a
+        catalog the entries are read but no OBs are built.
+        '''
+        if self.catalog is not None:
+            for id in np.flatnonzero(self.pending):
+                yield int(id), OB_key(self.catalog.entry(int(id)))
         else:
+            for id, OB in list(zip(self.ids, self.OBs)):
+                yield id, OB_key(OB)
+
+
+    def signature(self):
+        '''Identify the pending OBs compactly (e.g. to check that a trace is
+        replayed with the same OBs): the catalog file if any, the number of
+        pending OBs, and a hash of the pending IDs (for a list, and the OB
+        keys).  No catalog OBs are built.
+        '''
+        if self.catalog is not None:
+            pending = np.packbits(self.pending).tobytes()\
+                      + str(len(self.pending)).encode()
+            return {'catalog': str(self.catalog.file), 'pending': len(self),
+                    'hash': hashlib.sha1(pending).hexdigest()[:16]}
+        pending = json.dumps(list(self.pending_keys())).encode()
+        return {'catalog': None, 'pending': len(self),
+                'hash': hashlib.sha1(pending).hexdigest()[:16]}
+
+
+    def detconfigs(self):
+        '''Return the detector configs of the pending OBs.  When using a
+        catalog each distinct one is built once from the index.
+        '''
+        if self.catalog is not None:
+            return self.catalog.detconfigs(mask=self.pending)
+        return [getattr(OB, 'detconfig', None) for OB in self.OBs]
+
+
+    def resolve_targets(self, resolver, lock=None):
+        '''Resolve the targets of the pending OBs with a TargetResolver, and
+        return a list of (name, error) for those which could not be
+        resolved.  When using a catalog the names come from its index and an
+        OB is only built for names which are not found locally.  The lock
+        (if any) is held while reading the OBs.
+        '''
+        lock = nullcontext() if lock is None else lock
+        if self.catalog is None:
+            with lock:
+                OBs = list(self.OBs)
+            return resolver.resolve_all(OBs)
+        with lock:
+            names = self.catalog.named_targets(mask=self.pending)
+        def target_for(name):
+            with lock:
+                return self.catalog.get(names[name]).target
+        return resolver.resolve_names(names.keys(), target_for)
+
+
+    def candidates(self, limit=None):
+        '''Return a list of (id, OB) for the first limit pending OBs.
+        '''
+        return list(islice(self.pending_OBs(), limit))
+
+
+    def skip(self, ids):
+        '''Remove OBs with the given IDs (e.g. already completed OBs).
+        '''
+        if self.catalog is not None:
+            self.pending[list(ids)] = False
+            return
+        ids = set(ids)
+        keep = [i for i,id in enumerate(self.ids) if id not in ids]
+        self.OBs = [self.OBs[i] for i in keep]
+        self.ids = [self.ids[i] for i in keep]
+
+
+    def requeue(self, id, OB):
+        '''Put an OB back in the queue, e.g. to repeat an OB whose frames were
+        bad.
+        '''
+        if self.catalog is not None:
+            self.pending[id] = True
+            return
+        self.OBs.append(OB)
+        self.ids.append(id)
+
+
+    def take(self, id):
+        '''Remove and return the OB with the given ID, making it the current
+        OB.  Returns None if there is no such OB.
+        '''
+        if self.catalog is not None:
+            if id < 0 or id >= len(self.pending) or not self.pending[id]:
+                return None
+            self.pending[id] = False
+            self.current_id = id
+            return self.catalog.get(id)
+        if id not in self.ids:
             return None
+        i = self.ids.index(id)
+        self.current_id = self.ids.pop(i)
+        return self.OBs.pop(i)
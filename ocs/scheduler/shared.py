@@ -0,0 +1,197 @@
+from time import monotonic
+import threading
+import numpy as np
+
+from astropy import units as u
+from astropy import coordinates as c
+from astropy.time import Time
+
+from .scheduler import Scheduler
+
+
+##-------------------------------------------------------------------------
+## OB Queue Shared by Several Observatories
+##-------------------------------------------------------------------------
+class SharedQueue():
+    '''One queue of OBs for several observatories.  Each observatory gets a
+    view of the queue (see QueueView) to use as its scheduler.
+
+    When an observatory asks for an OB, the first few pending OBs (in queue
+    order) are considered and it is handed the first one which it can start
+    at least as soon as any other observatory.  The start time for an OB at
+    an observatory is the time until the observatory is free (the predicted
+    end of the OB it was last given), plus the slew from its current
+    pointing, plus any wait until the target is above the site's horizon
+    and the sky is dark for the whole OB.  Only observatories which are
+    open (or are the one asking) compete for OBs.
+    '''
+    def __init__(self, OBs=[], catalog=None, resolver=None, candidates=20,
+                 lookahead=4*3600, step=300):
+        self.scheduler = Scheduler(OBs=OBs, catalog=catalog)
+        self.resolver = resolver
+        self.candidates = candidates
+        self.lookahead = lookahead
+        self.step = step
+        self.lock = threading.RLock()
+        self.observatories = {}
+        self.busy_until = {}
+
+
+    def __len__(self):
+        return len(self.scheduler)
+
+
+    @property
+    def OBs(self):
+        return self.scheduler.OBs
+
+
+    def register(self, key, observatory):
+        '''Add an observatory which will ask for OBs as key.  Only the
+        attributes of a RollOffRoof which need no device calls are used:
+        location, get_horizon, slew_time, ephemeris, dark_sun_alt,
+        simulate_darkness, roof_open, and we_are_done.
+        '''
+        if key in self.observatories.keys():
+            raise KeyError(f'Observatory {key} is already registered')
+        self.observatories[key] = observatory
+        self.busy_until[key] = 0
+
+
+    def view(self, key):
+        return QueueView(self, key)
+
+
+    def start_time(self, observatory, OB, free_in=0, time=None):
+        '''Seconds from time until observatory could start OB, or None if it
+        can not within the lookahead.
+        '''
+        time = Time.now() if time is None else time
+        coord = self.resolver.coord(OB.target)
+        duration = float(OB.estimate_duration())
+        ready = free_in + float(observatory.slew_time(coord, time + free_in*u.s))
+        delays = ready + np.arange(0, self.lookahead + self.step, self.step)
+        starts = time + delays*u.s
+        ends = starts + duration*u.s
+        obstime = Time(np.concatenate([starts.jd, ends.jd]), format='jd')
+        altaz = coord.transform_to(c.AltAz(obstime=obstime,
+                                           location=observatory.location))
+        alt, az = altaz.alt.deg, altaz.az.deg
+        ok = alt > np.array([observatory.get_horizon(a) for a in az])
+        if observatory.simulate_darkness is False:
+            ok &= observatory.ephemeris.sun_alt(obstime) < observatory.dark_sun_alt
+        n = len(delays)
+        ok = ok[:n] & ok[n:]
+        if not np.any(ok):
+            return None
+        return float(delays[np.argmax(ok)])
+
+
+    def competitors(self, key):
+        return [k for k,o in self.observatories.items()
+                if k == key or (o.roof_open is True and o.we_are_done is False)]
+
+
+    def select(self, key, time=None):
+        '''Return (id, OB) for the observatory registered as key, or (None,
+        None) if no pending OB is best done there.
+        '''
+        time = Time.now() if time is None else time
+        with self.lock:
+            now = monotonic()
+            self.busy_until[key] = now
+            competitors = self.competitors(key)
+            for id, OB in self.scheduler.candidates(limit=self.candidates):
+                starts = {}
+                for k in competitors:
+                    free_in = max(0, self.busy_until[k] - now)
+                    try:
+                        starts[k] = self.start_time(self.observatories[k], OB,
+                                                    free_in=free_in, time=time)
+                    except Exception:
+                        # Leave OBs which can not be evaluated (e.g. the
+                        # target does not resolve) to whoever asks for them
+                        starts = {key: 0}
+                        break
+                mine = starts.get(key, None)
+                if mine is None:
+                    continue
+                if all([s is None or mine <= s for s in starts.values()]):
+                    OB = self.scheduler.take(id)
+                    self.busy_until[key] = now + mine\
+                                           + float(OB.estimate_duration())
+                    return id, OB
+            return None, None
+
+
+class QueueView():
+    '''The view of a SharedQueue used as the scheduler of one observatory.
+    It has the methods of Scheduler which RollOffRoof uses.
+    '''
+    def __init__(self, queue, key):
+        self.queue = queue
+        self.key = key
+        self.current_id = None
+
+
+    def __len__(self):
+        return len(self.queue)
+
+
+    @property
+    def OBs(self):
+        return self.queue.OBs
+
+
+    def select(self, **criteria):
+        self.current_id, OB = self.queue.select(self.key)
+        return OB
+
+
+    def pending_OBs(self):
+        with self.queue.lock:
+            pending = list(self.queue.scheduler.pending_OBs())
+        yield from pending
+
+
+    def key(self, id, OB):
+        with self.queue.lock:
+            return self.queue.scheduler.key(id, OB)
+
+
+    def pending_keys(self):
+        with self.queue.lock:
+            pending = list(self.queue.scheduler.pending_keys())
+        yield from pending
+
+
+    def signature(self):
+        with self.queue.lock:
+            return self.queue.scheduler.signature()
+
+
+    def detconfigs(self):
+        with self.queue.lock:
+            return self.queue.scheduler.detconfigs()
+
+
+    def resolve_targets(self, resolver):
+        return self.queue.scheduler.resolve_targets(resolver,
+                                                    lock=self.queue.lock)
+
+
+    def skip(self, ids):
+        with self.queue.lock:
+            self.queue.scheduler.skip(ids)
+
+
+    def requeue(self, id, OB):
+        with self.queue.lock:
+            self.queue.scheduler.requeue(id, OB)
+
+
+    def take(self, id):
+        with self.queue.lock:
+            OB = self.queue.scheduler.take(id)
+        self.current_id = id if OB is not None else None
+        return OB
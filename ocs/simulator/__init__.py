@@ -4,6 +4,10 @@ from .weather import Weather
 from .roof import Roof
 from .telescope import Telescope
 
+from pathlib import Path
+from copy import deepcopy
+import random
+
 config = {
           # Roof
           'roof_time_to_open': 5,
@@ -27,3 +31,51 @@ config = {
           'expose_fail_after': None,
           'expose_random_fail_rate': 0,
          }
+
+
+# Files an observatory writes, which each instance needs its own copy of
+INSTANCE_FILES = ['logfile', 'jsonlogfile', 'ledger_file', 'checkpoint_file',
+                  'trace_file', 'metrics_file', 'focus_model_file',
+                  'slew_model_file']
+
+
+def isolate(config, instance, directory, seed=None, port_offset=None):
+    '''Return a copy of an observatory configuration (see
+    ocs.load_configuration) for one of several simulated observatories run
+    side by side.  The instance gets its own logger, data directory, weather
+    safety file, and each of the INSTANCE_FILES under directory.  The
+    metrics and status server ports are moved up by port_offset, or turned
+    off if it is not given.  If seed is given, the random number generator
+    of each simulator device is seeded from it so that the instance's random
+    failures are reproducible.
+    '''
+    config = deepcopy(config)
+    directory = Path(directory).expanduser()
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    config['instance'] = instance
+    config['datadir'] = str(directory)
+    for key in INSTANCE_FILES:
+        if config.get(key, None) is not None:
+            config[key] = str(directory/Path(config[key]).name)
+    for key in ['metrics_port', 'status_port']:
+        if config.get(key, None) is not None:
+            config[key] = int(config[key]) + port_offset\
+                          if port_offset is not None else None
+    if config.get('weather', None) is Weather:
+        config.setdefault('weather_config', {})
+        config['weather_config']['safety_file'] = str(directory/'safe.txt')
+    if seed is None:
+        return config
+    for component in ['roof', 'telescope', 'instrument']:
+        if simulated(config.get(component, None)):
+            device_config = config.setdefault(f'{component}_config', {})
+            device_config['seed'] = rng.getrandbits(32)
+    for j,device in enumerate(config.get('detector', [])):
+        if simulated(device) and j < len(config.get('detector_config', [])):
+            config['detector_config'][j]['seed'] = rng.getrandbits(32)
+    return config
+
+
+def simulated(device):
+    return getattr(device, '__module__', '').startswith('ocs.simulator')
@@ -1,14 +1,53 @@
 #!python3
 from time import sleep
+import threading
 import random
+import numpy as np
+from astropy.io import fits
 
 from ocs.exceptions import *
 
 
+def simulate_star_field(shape=(512, 512), fwhm=3, nstars=50, sky=100,
+                        readnoise=5, seed=None, x=None, y=None, flux=None):
+    '''Generate an image of gaussian stars on a flat sky background.  Star
+    positions (x, y) and fluxes may be given, otherwise they are random.
+    '''
+    rng = np.random.default_rng(seed)
+    ny, nx = shape
+    image = np.full(shape, sky, dtype=np.float32)
+    sigma = max(fwhm, 0.5) / (2*np.sqrt(2*np.log(2)))
+    r = int(np.ceil(4*sigma))
+    dy, dx = np.mgrid[-r:r+1, -r:r+1]
+    if x is None or y is None:
+        y = rng.uniform(r, ny-r-1, nstars)
+        x = rng.uniform(r, nx-r-1, nstars)
+    else:
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        inside = (x >= r) & (x < nx-r-1) & (y >= r) & (y < ny-r-1)
+        x, y = x[inside], y[inside]
+        if flux is not None:
+            flux = np.asarray(flux)[inside]
+    if flux is None:
+        flux = rng.uniform(500, 20000, len(x))
+    peak = flux / (sigma**2)
+    iy, ix = y.astype(int), x.astype(int)
+    stamps = peak[:,None,None] * np.exp(-((dx[None] - (x - ix)[:,None,None])**2
+                                        + (dy[None] - (y - iy)[:,None,None])**2)
+                                       / (2*sigma**2))
+    np.add.at(image, (iy[:,None,None] + dy[None], ix[:,None,None] + dx[None]),
+              stamps)
+    image = rng.poisson(np.clip(image, 0, None)).astype(np.float32)
+    image += rng.normal(0, readnoise, shape).astype(np.float32)
+    return image
+
+
 class DetectorController():
     def __init__(self, logger=None, exposure_overhead=0,
                  expose_fail_after=None, expose_random_fail_rate=0,
-                 simulate_exposure_time=True,):
+                 simulate_exposure_time=True, simulate_image=False,
+                 image_shape=(512, 512), focuser=0, best_focus=1000,
+                 best_fwhm=2.5, focus_scale=100, seed=None):
         self.name = 'simulator'
         self.exposure_count = 0
         self.exptime = 0
@@ -16,6 +55,19 @@ class DetectorController():
         self.simulate_exposure_time = simulate_exposure_time
         self.expose_fail_after = expose_fail_after
         self.expose_random_fail_rate = expose_random_fail_rate
+        self.simulate_image = simulate_image
+        self.image_shape = tuple(image_shape)
+        self.focuser = focuser
+        self.best_focus = best_focus
+        self.best_fwhm = best_fwhm
+        self.focus_scale = focus_scale
+        self.rng = random.Random(seed)
+        self.integration_callback = None
+        self.aborted = threading.Event()
+
+
+    def setup_detector(self, dc):
+        self.set_exptime(dc.exptime)
 
 
     def set_exptime(self, exptime):
@@ -34,15 +86,48 @@ class DetectorController():
         return
 
 
+    def fwhm_at(self, position):
+        '''Seeing blurred by defocus, using a hyperbolic focus curve.
+        '''
+        if position is None:
+            return self.best_fwhm
+        defocus = (position - self.best_focus) / self.focus_scale
+        return self.best_fwhm * np.sqrt(1 + defocus**2)
+
+
+    def set_integration_callback(self, callback):
+        '''Call callback() when each exposure finishes integrating, before
+        the overhead (readout).  None removes it.
+        '''
+        self.integration_callback = callback
+
+
+    def abort_exposure(self):
+        '''End the current exposure early: expose returns None.
+        '''
+        self.aborted.set()
+
+
     def expose(self, additional_header=None):
-        sleeptime = self.exposure_overhead + self.exptime
+        self.aborted.clear()
+        if self.simulate_exposure_time is True:
+            if self.aborted.wait(timeout=self.exptime):
+                return None
+        if self.integration_callback is not None:
+            self.integration_callback()
         if self.simulate_exposure_time is True:
-            sleep(sleeptime)
+            sleep(self.exposure_overhead)
         self.exposure_count += 1
         if self.expose_fail_after is not None:
             if self.exposure_count >= self.expose_fail_after:
                 raise DetectorFailure('Exposure count exceeded')
         if self.expose_random_fail_rate is not None:
-            if random.random() < self.expose_random_fail_rate:
+            if self.rng.random() < self.expose_random_fail_rate:
                 raise DetectorFailure('Random failure')
-        return None
+        if self.simulate_image is False:
+            return None
+        hdr = fits.Header() if additional_header is None else additional_header
+        fwhm = self.fwhm_at(hdr.get(f'FOC{self.focuser+1}POS', None))
+        data = simulate_star_field(shape=self.image_shape, fwhm=fwhm,
+                                   seed=self.rng.getrandbits(32))
+        return fits.HDUList([fits.PrimaryHDU(data=data, header=hdr)])
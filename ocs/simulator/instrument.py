@@ -8,12 +8,16 @@ from ocs.exceptions import *
 
 class InstrumentController():
     def __init__(self, logger=None, time_to_configure=0,
-                 configure_fail_after=None, configure_random_fail_rate=0):
+                 configure_fail_after=None, configure_random_fail_rate=0,
+                 focus_temperature=10, seed=None):
         self.name = 'simulator'
         self.time_to_configure = time_to_configure
         self.configure_count = 0
         self.configure_fail_after = configure_fail_after
         self.configure_random_fail_rate = configure_random_fail_rate
+        self.focus_positions = {}
+        self.focus_temperature = focus_temperature
+        self.rng = random.Random(seed)
 
 
     def configure(self, instconfig):
@@ -24,9 +28,24 @@ class InstrumentController():
             if self.configure_count >= self.configure_fail_after:
                 raise InstrumentFailure('Configure count exceeded')
         if self.configure_random_fail_rate is not None:
-            if random.random() < self.configure_random_fail_rate:
+            if self.rng.random() < self.configure_random_fail_rate:
                 raise InstrumentFailure('Random failure')
 
 
+    def get_focus(self, focuser=0):
+        return self.focus_positions.get(focuser, 1000)
+
+
+    def set_focus(self, position, focuser=0):
+        self.focus_positions[focuser] = position
+
+
+    def get_focus_temperature(self, focuser=0):
+        return self.focus_temperature
+
+
     def collect_header_metadata(self):
-        return fits.Header()
+        h = fits.Header()
+        for focuser, position in sorted(self.focus_positions.items()):
+            h[f'FOC{focuser+1}POS'] = (position, 'Focuser Position')
+        return h
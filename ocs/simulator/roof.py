@@ -8,8 +8,10 @@ from ocs.exceptions import *
 class Roof():
     def __init__(self, logger=None, roof_time_to_open=0, roof_time_to_close=0,
                  open_fail_after=None, close_fail_after=None,
-                 open_random_fail_rate=0, close_random_fail_rate=0):
+                 open_random_fail_rate=0, close_random_fail_rate=0,
+                 seed=None):
         self.is_open = False
+        self.moving = False
         self.open_count = 0
         self.close_count = 0
         self.roof_time_to_open = roof_time_to_open
@@ -18,29 +20,40 @@ class Roof():
         self.close_fail_after = close_fail_after
         self.open_random_fail_rate = open_random_fail_rate
         self.close_random_fail_rate = close_random_fail_rate
+        self.rng = random.Random(seed)
 
 
     def open(self):
         self.is_open = True
         if self.roof_time_to_open is not None:
+            self.moving = True
             sleep(self.roof_time_to_open)
+            self.moving = False
         self.open_count += 1
         if self.open_fail_after is not None:
             if self.open_count >= self.open_fail_after:
                 raise RoofFailure('Open count exceeded')
         if self.open_random_fail_rate is not None:
-            if random.random() < self.open_random_fail_rate:
+            if self.rng.random() < self.open_random_fail_rate:
                 raise RoofFailure('Random failure')
 
 
     def close(self):
         self.close_count += 1
         if self.roof_time_to_close is not None:
+            self.moving = True
             sleep(self.roof_time_to_close)
+            self.moving = False
         if self.close_fail_after is not None:
             if self.close_count >= self.close_fail_after:
                 raise RoofFailure('Clouse count exceeded')
         if self.close_random_fail_rate is not None:
-            if random.random() < self.close_random_fail_rate:
+            if self.rng.random() < self.close_random_fail_rate:
                 raise RoofFailure('Random failure')
         self.is_open = False
+
+
+    def shutterstatus(self):
+        if self.moving is True:
+            return 'opening' if self.is_open is True else 'closing'
+        return 'open' if self.is_open is True else 'closed'
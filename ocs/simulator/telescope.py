@@ -2,16 +2,31 @@
 from time import sleep
 import random
 from astropy.io import fits
+from astropy.time import Time
 
 from ocs.exceptions import *
+from ocs.slewmodel import SlewModel, hadec, pier_side
 
 
 class Telescope():
     def __init__(self, logger=None, time_to_slew=0, time_to_park=0,
+                 time_to_offset=0, slew_model=False, slew_model_file=None,
+                 park_hadec=[0, 90],
                  slew_fail_after=None, park_fail_after=None,
-                 slew_random_fail_rate=0, park_random_fail_rate=0):
+                 slew_random_fail_rate=0, park_random_fail_rate=0,
+                 seed=None):
         self.parked = True
         self.istracking = False
+        # With slew_model, slews take as long as the (learned) model predicts
+        self.slew_model = SlewModel(file=slew_model_file)\
+                          if slew_model is True else None
+        self.park_hadec = tuple(park_hadec)
+        self.pointing = None
+        self.pier = None
+        self.sitelon = 0
+        self.offset_east = 0
+        self.offset_north = 0
+        self.time_to_offset = time_to_offset
         self.slew_count = 0
         self.park_count = 0
         self.time_to_slew = time_to_slew
@@ -20,21 +35,43 @@ class Telescope():
         self.park_fail_after = park_fail_after
         self.slew_random_fail_rate = slew_random_fail_rate
         self.park_random_fail_rate = park_random_fail_rate
+        self.rng = random.Random(seed)
 
 
     def slew(self, target):
         self.parked = False
         self.istracking = True
-        sleep(self.time_to_slew)
+        if self.slew_model is not None:
+            now = Time.now()
+            if self.pointing is None:
+                start = self.park_hadec
+            else:
+                start = hadec(*self.pointing, now, self.sitelon)
+            end = hadec(target.ra.deg, target.dec.deg, now, self.sitelon)
+            sleep(float(self.slew_model.predict(start, end, pier=self.pier)))
+            self.pointing = (target.ra.deg, target.dec.deg)
+            self.pier = str(pier_side(end[0]))
+        else:
+            sleep(self.time_to_slew)
         self.slew_count += 1
+        self.offset_east = 0
+        self.offset_north = 0
         if self.slew_fail_after is not None:
             if self.slew_count >= self.slew_fail_after:
                 raise TelescopeFailure('Slew count exceeded')
         if self.slew_random_fail_rate is not None:
-            if random.random() < self.slew_random_fail_rate:
+            if self.rng.random() < self.slew_random_fail_rate:
                 raise TelescopeFailure('Random failure')
 
 
+    def offset(self, east, north):
+        '''Move relative to the current pointing by east and north arcsec.
+        '''
+        sleep(self.time_to_offset)
+        self.offset_east += east
+        self.offset_north += north
+
+
     def park(self):
         sleep(self.time_to_park)
         self.park_count += 1
@@ -42,10 +79,12 @@ class Telescope():
             if self.park_count >= self.park_fail_after:
                 raise TelescopeFailure('Park count exceeded')
         if self.park_random_fail_rate is not None:
-            if random.random() < self.park_random_fail_rate:
+            if self.rng.random() < self.park_random_fail_rate:
                 raise TelescopeFailure('Random failure')
         self.istracking = False
         self.parked = True
+        self.pointing = None
+        self.pier = None
 
 
     def atpark(self):
@@ -56,6 +95,10 @@ class Telescope():
         self.parked = False 
 
 
+    def sideofpier(self):
+        return self.pier
+
+
     def tracking(self):
         return self.istracking
 
@@ -2,18 +2,28 @@
 from pathlib import Path
 import re
 from datetime import datetime
-import random
 import numpy as np
 
 from ocs.exceptions import *
 
 
 class Weather():
-    def __init__(self, logger=None):
-        self.safety_file = Path('~/.safe.txt').expanduser()
-        now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
-        with open(self.safety_file, 'a') as FO:
-            FO.write(f'{now} safe\n')
+    '''Simulated weather read from a safety file with one line per reading
+    ("{timestamp} safe" or "{timestamp} unsafe").  Observatories sharing a
+    safety file share their weather, so give each its own file, or give a
+    source instead: a function which returns True when it is safe.
+    '''
+    def __init__(self, logger=None, safety_file='~/.safe.txt', source=None):
+        self.source = source
+        # With a source only the time of the last unsafe reading is kept,
+        # which is all has_been_safe needs, so nothing grows over a night
+        self.last_unsafe = None
+        self.safety_file = Path(safety_file).expanduser()
+        if self.source is None:
+            self.safety_file.parent.mkdir(parents=True, exist_ok=True)
+            now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+            with open(self.safety_file, 'a') as FO:
+                FO.write(f'{now} safe\n')
 
 
     def _evaluate_safety_line(self, line):
@@ -28,6 +38,11 @@ class Weather():
 
 
     def is_safe(self, age_limit=300):
+        if self.source is not None:
+            safe = bool(self.source())
+            if safe is False:
+                self.last_unsafe = datetime.now()
+            return safe
         with open(self.safety_file) as safety_file:
             lines = safety_file.readlines()
         timestamp, safe = self._evaluate_safety_line(lines[-1])
@@ -39,6 +54,10 @@ class Weather():
 
 
     def has_been_safe(self, entered_state_at):
+        if self.source is not None:
+            safe = self.is_safe()
+            return safe and (self.last_unsafe is None\
+                             or self.last_unsafe <= entered_state_at)
         with open(self.safety_file) as safety_file:
             lines = safety_file.readlines()
         i = -1
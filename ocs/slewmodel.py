@@ -0,0 +1,183 @@
+from pathlib import Path
+from datetime import datetime
+import numpy as np
+import yaml
+
+from astropy import units as u
+from astropy.time import Time
+
+
+def wrap_ha(ha):
+    '''Wrap hour angles in degrees to the range -180 to 180.
+    '''
+    return (np.asarray(ha) + 180) % 360 - 180
+
+
+def hadec(ra, dec, time, longitude):
+    '''Hour angle and declination in degrees for RA and Dec in degrees at the
+    given time(s) and site longitude (degrees east).
+    '''
+    lst = Time(time).sidereal_time('apparent', longitude=longitude*u.deg).deg
+    return wrap_ha(lst - np.asarray(ra)), np.asarray(dec)
+
+
+def pier_side(ha):
+    '''The side of the pier a German equatorial mount is normally on when
+    pointing at hour angle ha in degrees: 'east' (looking west) for targets
+    past the meridian, 'west' (looking east) before it.
+    '''
+    return np.where(np.asarray(ha) >= 0, 'east', 'west')
+
+
+##-------------------------------------------------------------------------
+## Slew Time Model
+##-------------------------------------------------------------------------
+class SlewModel():
+    '''Persistent model of telescope slew time learned from past slews.
+
+    Each axis moves independently with a fixed overhead (acceleration and
+    settling) plus a constant rate, and the slew ends when the slower axis
+    is done.  Slews which change the side of the pier on a German
+    equatorial mount (a meridian flip) take an additional flip time:
+
+    t = max(settle_ha + |dHA|/rate_ha, settle_dec + |dDec|/rate_dec)
+        + flip_time * flip
+
+    If the mount reports its side of the pier ('east' or 'west') a flip is
+    when the side changes, so a mount which tracked past the meridian is
+    handled.  Otherwise a flip is when the hour angle changes sign.
+
+    Until there are min_points logged slews the default parameters are used.
+    predict accepts arrays so many candidate slews can be evaluated at once.
+    '''
+    def __init__(self, file=None, min_points=10, max_points=500,
+                 rate=2.0, settle=5.0, flip_time=30.0):
+        self.file = Path(file).expanduser() if file is not None else None
+        self.min_points = min_points
+        self.max_points = max_points
+        self.defaults = {'settle_ha': settle, 'rate_ha': rate,
+                         'settle_dec': settle, 'rate_dec': rate,
+                         'flip_time': flip_time}
+        self.params = dict(self.defaults)
+        self.points = []
+        if self.file is not None and self.file.exists():
+            with open(self.file) as FO:
+                self.points = yaml.safe_load(FO) or []
+        self.fit()
+
+
+    ##-------------------------------------------------------------------------
+    ## Logging Slews
+    def add(self, start, end, duration, save=True, pier0=None, pier1=None):
+        '''Add a slew from start to end, each (hour angle, dec) in degrees,
+        which took duration seconds, and refit.  pier0 and pier1 are the
+        mount's side of the pier before and after the slew if known.
+        '''
+        self.points.append({'ha0': float(start[0]), 'dec0': float(start[1]),
+                            'ha1': float(end[0]), 'dec1': float(end[1]),
+                            'pier0': pier0, 'pier1': pier1,
+                            'duration': float(duration),
+                            'date': datetime.utcnow().isoformat()})
+        self.points = self.points[-self.max_points:]
+        self.fit()
+        if save is True:
+            self.save()
+
+
+    def save(self):
+        if self.file is None:
+            return
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.file.with_suffix('.tmp')
+        with open(tmp, 'w') as FO:
+            yaml.safe_dump(self.points, FO)
+        tmp.replace(self.file)
+
+
+    ##-------------------------------------------------------------------------
+    ## Model
+    @staticmethod
+    def features(ha0, dec0, ha1, dec1, pier0=None, pier1=None):
+        ha0, ha1 = np.asarray(ha0), np.asarray(ha1)
+        dha = np.abs(wrap_ha(ha1 - ha0))
+        ddec = np.abs(np.asarray(dec1) - np.asarray(dec0))
+        flip = (np.sign(ha0) != np.sign(ha1)) & (ha0 != 0) & (ha1 != 0)
+        if pier0 is not None or pier1 is not None:
+            # Where a side of the pier is known, a flip is a change of side.
+            # An unknown side is the usual one for the hour angle (either
+            # side is possible on the meridian).
+            shape = np.broadcast(ha0, ha1).shape
+            sides = []
+            for pier, ha in [(pier0, ha0), (pier1, ha1)]:
+                pier = np.broadcast_to(np.array(pier, dtype=object), shape)
+                known = np.array([p is not None for p in pier.flat],
+                                 dtype=bool).reshape(shape)
+                side = np.where(known, pier, pier_side(ha))
+                sides.append((side, known, known | (ha != 0)))
+            (side0, known0, usable0), (side1, known1, usable1) = sides
+            use = (known0 | known1) & usable0 & usable1
+            flip = np.where(use, side0 != side1, flip)
+        return dha, ddec, np.asarray(flip).astype(float)
+
+
+    def axis_times(self, dha, ddec, params=None):
+        p = self.params if params is None else params
+        return (p['settle_ha'] + dha/p['rate_ha'],
+                p['settle_dec'] + ddec/p['rate_dec'])
+
+
+    def fit(self, iterations=10):
+        '''Fit the model parameters to the logged slews.  Which axis limits
+        each slew depends on the parameters, so the fit alternates between
+        assigning each slew to its slower axis and a linear least squares fit
+        for the settle times, inverse rates, and flip time.
+        '''
+        if len(self.points) < self.min_points:
+            self.params = dict(self.defaults)
+            return self.params
+        columns = ['ha0', 'dec0', 'ha1', 'dec1', 'duration']
+        ha0, dec0, ha1, dec1, t = [np.array([p[c] for p in self.points])
+                                   for c in columns]
+        # Slews logged before the side of the pier was recorded have none
+        pier0, pier1 = [[p.get(c, None) for p in self.points]
+                        for c in ['pier0', 'pier1']]
+        dha, ddec, flip = self.features(ha0, dec0, ha1, dec1, pier0, pier1)
+        params = dict(self.defaults)
+        for i in range(iterations):
+            tha, tdec = self.axis_times(dha, ddec, params)
+            ha_limited = tha >= tdec
+            # t = settle_ha + dha*inv_rate_ha (ha limited) or
+            #     settle_dec + ddec*inv_rate_dec (dec limited), + flip_time*flip
+            A = np.column_stack([ha_limited, dha*ha_limited,
+                                 ~ha_limited, ddec*~ha_limited, flip])
+            A = A.astype(float)
+            # Leave out terms which the data do not constrain
+            used = np.any(A != 0, axis=0)
+            coeffs = np.zeros(A.shape[1])
+            coeffs[used] = np.linalg.lstsq(A[:,used], t, rcond=None)[0]
+            new = dict(params)
+            for name, j in [('settle_ha', 0), ('settle_dec', 2),
+                            ('flip_time', 4)]:
+                if used[j]:
+                    new[name] = float(max(coeffs[j], 0))
+            for name, j in [('rate_ha', 1), ('rate_dec', 3)]:
+                if used[j] and coeffs[j] > 0:
+                    new[name] = float(1/coeffs[j])
+            converged = all([np.isclose(new[k], params[k]) for k in params])
+            params = new
+            if converged:
+                break
+        self.params = params
+        return self.params
+
+
+    def predict(self, start, end, pier=None):
+        '''Predict slew times in seconds from start to end, each (hour angle,
+        dec) in degrees.  Either may contain arrays.  pier is the mount's
+        current side of the pier if known; the mount is assumed to end up on
+        the usual side for the target's hour angle.
+        '''
+        dha, ddec, flip = self.features(start[0], start[1], end[0], end[1],
+                                        pier0=pier)
+        tha, tdec = self.axis_times(dha, ddec)
+        return np.maximum(tha, tdec) + self.params['flip_time']*flip
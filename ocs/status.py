@@ -0,0 +1,233 @@
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import queue
+import json
+import math
+
+
+def to_json(obj):
+    return json.dumps(obj, default=str)
+
+
+def same(a, b):
+    '''Compare two status values, treating NaN as equal to NaN (so a field
+    which stays NaN is not published as a change on every update).
+    '''
+    if isinstance(a, float) and isinstance(b, float):
+        return a == b or (math.isnan(a) and math.isnan(b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all([same(a[k], b[k]) for k in a.keys()])
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all([same(x, y) for x,y in zip(a, b)])
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+##-------------------------------------------------------------------------
+## Status Stream
+##-------------------------------------------------------------------------
+class StatusStream():
+    '''Publish the observatory status as deltas.
+
+    Each update is compared with the current status and only fields which
+    changed are published, as a message with an increasing sequence number:
+    {'seq': 12, 'timestamp': ..., 'changes': {'state': 'slewing'}}
+    Fields removed from the status are listed in the message as 'removed'.
+
+    Updates are written to a single upserted "current" document (_id
+    "current") in the status collection and appended to a capped history
+    collection.  They are also pushed to local subscribers, including
+    clients of the server-sent events endpoint started by serve.
+    '''
+    def __init__(self, db=None, collection='status',
+                 history_collection='status_history', history_size=10000,
+                 subscriber_queue_size=100):
+        self.db = db
+        self.collection_name = collection
+        self.history_name = history_collection
+        self.history_size = history_size
+        self.subscriber_queue_size = subscriber_queue_size
+        self.collection = None
+        self.history = None
+        self.lock = threading.Lock()
+        self.current = {}
+        self.unwritten = {}
+        self.unwritten_removed = set()
+        self.seq = 0
+        self.timestamp = None
+        self.subscribers = []
+        self.server = None
+
+
+    def setup_collections(self):
+        '''Get the collections, creating the capped history collection if it
+        does not exist.  Done on first use so that creating the stream does
+        not block on the database.
+        '''
+        if self.history_name not in self.db.list_collection_names():
+            self.db.create_collection(self.history_name, capped=True,
+                                      size=self.history_size*1024,
+                                      max=self.history_size)
+        self.collection = self.db[self.collection_name]
+        self.history = self.db[self.history_name]
+
+
+    def update(self, status, remove=[]):
+        '''Publish the fields of status which changed, and remove the fields
+        listed in remove.  Returns the delta message, or None if nothing
+        changed.
+        '''
+        with self.lock:
+            changes = {key: value for key,value in status.items()
+                       if key not in self.current\
+                       or not same(self.current[key], value)}
+            removed = [key for key in remove
+                       if key in self.current and key not in status]
+            if len(changes) == 0 and len(removed) == 0:
+                return None
+            self.seq += 1
+            self.timestamp = datetime.now()
+            self.current.update(changes)
+            self.unwritten.update(changes)
+            self.unwritten_removed -= set(changes.keys())
+            for key in removed:
+                del self.current[key]
+                self.unwritten.pop(key, None)
+                self.unwritten_removed.add(key)
+            message = {'seq': self.seq, 'timestamp': self.timestamp,
+                       'changes': changes}
+            if len(removed) > 0:
+                message['removed'] = removed
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # Drop slow clients rather than slow down the observatory
+                    self.subscribers.remove(subscriber)
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(None)
+        if self.db is not None:
+            self.write_db(message)
+        return message
+
+
+    def write_db(self, message):
+        '''Write to the database.  Changes from earlier updates which failed
+        to be written are included in the current document.
+        '''
+        if self.collection is None:
+            self.setup_collections()
+        with self.lock:
+            changes = dict(self.unwritten)
+            removed = set(self.unwritten_removed)
+        document = {'$set': dict(changes, seq=message['seq'],
+                                 timestamp=message['timestamp'])}
+        if len(removed) > 0:
+            document['$unset'] = {key: '' for key in removed}
+        self.collection.update_one({'_id': 'current'}, document, upsert=True)
+        with self.lock:
+            for key in changes.keys():
+                if self.unwritten.get(key, None) is changes[key]:
+                    del self.unwritten[key]
+            self.unwritten_removed -= {key for key in removed
+                                       if key not in self.current}
+        self.history.insert_one(dict(message))
+
+
+    def snapshot(self):
+        with self.lock:
+            return {'seq': self.seq, 'timestamp': self.timestamp,
+                    'status': dict(self.current)}
+
+
+    def subscribe(self):
+        '''Return a queue which receives each delta message.  A subscriber
+        which falls behind is dropped and receives None.
+        '''
+        subscriber = queue.Queue(maxsize=self.subscriber_queue_size)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+
+    ##-------------------------------------------------------------------------
+    ## Server-Sent Events
+    def serve(self, port=8765, host='localhost', keepalive=15):
+        '''Serve the status over HTTP from a daemon thread:
+        - /status returns the full current status as JSON
+        - /events is a server-sent events stream which starts with a
+          "snapshot" event then sends a "delta" event for each update
+        '''
+        stream = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/status':
+                    body = to_json(stream.snapshot()).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                elif self.path == '/events':
+                    self.send_events()
+                else:
+                    self.send_error(404)
+
+            def send_event(self, event, data, id=None):
+                lines = f'event: {event}\n'
+                if id is not None:
+                    lines += f'id: {id}\n'
+                lines += f'data: {to_json(data)}\n\n'
+                self.wfile.write(lines.encode())
+                self.wfile.flush()
+
+            def send_events(self):
+                subscriber = stream.subscribe()
+                try:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Cache-Control', 'no-cache')
+                    self.end_headers()
+                    snapshot = stream.snapshot()
+                    self.send_event('snapshot', snapshot, id=snapshot['seq'])
+                    while stream.server is not None:
+                        try:
+                            message = subscriber.get(timeout=keepalive)
+                        except queue.Empty:
+                            self.wfile.write(b': keepalive\n\n')
+                            self.wfile.flush()
+                            continue
+                        if message is None:
+                            break
+                        # Skip deltas already included in the snapshot
+                        if message['seq'] > snapshot['seq']:
+                            self.send_event('delta', message, id=message['seq'])
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    stream.unsubscribe(subscriber)
+
+            def log_message(self, format, *args):
+                pass
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        return self.server
+
+
+    def shutdown(self):
+        if self.server is not None:
+            server = self.server
+            self.server = None
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,178 @@
+from pathlib import Path
+import threading
+import json
+import csv
+
+from astropy import units as u
+from astropy import coordinates as c
+
+
+def has_coordinates(target):
+    '''True if the target was given its own coordinates (RA and Dec) rather
+    than just a name to be resolved.
+    '''
+    for ra, dec in [('RA', 'Dec'), ('ra', 'dec')]:
+        if getattr(target, ra, None) is not None\
+           and getattr(target, dec, None) is not None:
+            return True
+    return False
+
+
+def normalize_name(name):
+    '''Normalize an object name for lookup: case and whitespace are ignored,
+    so "M 31", "m31" and "M31" are the same.
+    '''
+    return ''.join(str(name).split()).upper()
+
+
+##-------------------------------------------------------------------------
+## Target Name Resolution
+##-------------------------------------------------------------------------
+class TargetResolver():
+    '''Resolve target names to coordinates without touching the network
+    where possible.
+
+    Targets with their own coordinates (RA and Dec) always use them and are
+    never cached, so a target which happens to share a name with a catalog
+    entry (e.g. a mosaic tile called "M31") goes where it says.  For targets
+    with only a name, lookups are tried in order:
+    - coordinates already resolved in this process
+    - the persistent on disk cache of previously resolved names
+    - the bundled catalog, then any extra_catalogs
+    - the target's own coord() method (which may use a name server), with
+      the result added to the on disk cache
+
+    The bundled catalog only has the 110 Messier objects (with their NGC
+    numbers and common names as aliases).  Other NGC and IC objects and
+    named stars are not in it, so they need the name server the first time
+    unless a site adds a catalog of them (same CSV columns) as one of the
+    extra_catalogs.
+    '''
+    def __init__(self, cache_file=None, catalog_file=None, extra_catalogs=[]):
+        if catalog_file is None:
+            catalog_file = Path(__file__).parent/'config'/'messier.csv'
+        self.cache_file = Path(cache_file).expanduser()\
+                          if cache_file is not None else None
+        self.lock = threading.Lock()
+        self.coords = {}
+        self.catalog = self.read_catalog(catalog_file)
+        for file in extra_catalogs:
+            self.catalog.update(self.read_catalog(Path(file).expanduser()))
+        self.cache = {}
+        if self.cache_file is not None and self.cache_file.exists():
+            with open(self.cache_file) as FO:
+                self.cache = json.load(FO)
+
+
+    @staticmethod
+    def read_catalog(catalog_file):
+        '''Read a CSV catalog with name, ra, dec, and aliases (; separated)
+        columns into a dict keyed by normalized name and alias.
+        '''
+        catalog = {}
+        with open(catalog_file) as FO:
+            for row in csv.DictReader(FO):
+                radec = (float(row['ra']), float(row['dec']))
+                names = [row['name']] + row.get('aliases', '').split(';')
+                for name in names:
+                    if name.strip() != '':
+                        catalog[normalize_name(name)] = radec
+        return catalog
+
+
+    def lookup(self, name):
+        '''Return (ra, dec) in degrees from the cache or catalog, or None.
+        '''
+        key = normalize_name(name)
+        if key in self.cache.keys():
+            return tuple(self.cache[key])
+        return self.catalog.get(key, None)
+
+
+    def coord(self, target):
+        '''Return a SkyCoord for the target.
+        '''
+        if has_coordinates(target):
+            return target.coord()
+        key = normalize_name(target.name)
+        coord = self.coords.get(key, None)
+        if coord is not None:
+            return coord
+        coord = self.local_coord(target.name)
+        if coord is None:
+            coord = target.coord()
+            self.add_to_cache(key, coord)
+            with self.lock:
+                self.coords[key] = coord
+        return coord
+
+
+    def local_coord(self, name):
+        '''Return a SkyCoord for a name already resolved or in the cache or
+        catalog, or None, without using the network.
+        '''
+        key = normalize_name(name)
+        coord = self.coords.get(key, None)
+        if coord is not None:
+            return coord
+        radec = self.lookup(name)
+        if radec is None:
+            return None
+        coord = c.SkyCoord(radec[0], radec[1], unit=(u.deg, u.deg),
+                           frame='icrs')
+        with self.lock:
+            self.coords[key] = coord
+        return coord
+
+
+    def add_to_cache(self, key, coord):
+        icrs = coord.icrs
+        with self.lock:
+            self.cache[key] = [float(icrs.ra.deg), float(icrs.dec.deg)]
+            self.save()
+
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_file.with_suffix('.tmp')
+        with open(tmp, 'w') as FO:
+            json.dump(self.cache, FO, indent=1)
+        tmp.replace(self.cache_file)
+
+
+    def resolve_all(self, OBs):
+        '''Resolve the targets of a list of OBs up front.  Returns a list of
+        (name, error) for targets which could not be resolved.
+        '''
+        failures = []
+        seen = set()
+        for OB in OBs:
+            target = getattr(OB, 'target', None)
+            if target is None or has_coordinates(target) or target.name in seen:
+                continue
+            seen.add(target.name)
+            try:
+                self.coord(target)
+            except Exception as err:
+                failures.append((target.name, err))
+        return failures
+
+
+    def resolve_names(self, names, target_for):
+        '''Resolve target names up front (e.g. the target names in an OB
+        catalog's index).  Only for names which are not found locally is
+        target_for(name) called to get a target to resolve with its own
+        coord() method.  Returns a list of (name, error) for targets which
+        could not be resolved.
+        '''
+        failures = []
+        for name in names:
+            if self.local_coord(name) is not None:
+                continue
+            try:
+                self.coord(target_for(name))
+            except Exception as err:
+                failures.append((name, err))
+        return failures
@@ -0,0 +1,322 @@
+from pathlib import Path
+from collections import deque
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+import threading
+import json
+import numpy as np
+
+from astropy.io import fits
+from astropy.coordinates import SkyCoord
+
+from . import exceptions
+from .framebuffer import image_data
+from .devicestate import mirror_read
+
+
+##-------------------------------------------------------------------------
+## Encoding Device Arguments and Results
+##-------------------------------------------------------------------------
+def encode(value):
+    '''Convert a device argument or result to something JSON can store.
+    Images are stored as their header, shape and dtype only.
+    '''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, fits.Header):
+        return {'__type__': 'Header',
+                'cards': [[card.keyword, encode(card.value), card.comment]
+                          for card in value.cards]}
+    if isinstance(value, fits.HDUList):
+        data = image_data(value)
+        return {'__type__': 'HDUList', 'header': encode(value[0].header),
+                'shape': list(data.shape) if data is not None else None,
+                'dtype': data.dtype.str if data is not None else None}
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): encode(v) for k,v in value.items()}
+    if isinstance(value, np.ndarray):
+        return {'__type__': 'ndarray', 'shape': list(value.shape),
+                'dtype': value.dtype.str}
+    if isinstance(value, SkyCoord):
+        return {'__type__': 'SkyCoord', 'ra': float(value.ra.deg),
+                'dec': float(value.dec.deg)}
+    return {'__type__': type(value).__name__, 'str': str(value)}
+
+
+def decode(value):
+    '''Rebuild a result stored by encode.  Images are filled with zeros.
+    '''
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    kind = value.get('__type__', None)
+    if kind is None:
+        return {k: decode(v) for k,v in value.items()}
+    if kind == 'Header':
+        header = fits.Header()
+        for keyword, v, comment in value['cards']:
+            if isinstance(v, dict):
+                v = v.get('str', None)
+            header.append((keyword, v, comment), end=True)
+        return header
+    if kind == 'HDUList':
+        data = np.zeros(value['shape'], dtype=value['dtype'])\
+               if value['shape'] is not None else None
+        return fits.HDUList([fits.PrimaryHDU(data=data,
+                                             header=decode(value['header']))])
+    if kind == 'ndarray':
+        return np.zeros(value['shape'], dtype=value['dtype'])
+    if kind == 'SkyCoord':
+        return SkyCoord(value['ra'], value['dec'], unit='deg')
+    return value['str']
+
+
+##-------------------------------------------------------------------------
+## Trace Recorder
+##-------------------------------------------------------------------------
+class TraceRecorder():
+    '''Record a trace of a night as JSON lines, one per event:
+    - "start": the observatory name and the signature of the pending OBs
+      (see Scheduler.signature)
+    - "call": a device call with its arguments, result (or error), start
+      time and duration, and whether it was a DeviceMirror read (poll)
+    - "schedule": an OB selected by the scheduler
+    - "conditions": the transition conditions evaluated for a trigger
+    - "end": the end of the night
+
+    Each event has a sequence number and the time (t) in seconds since the
+    trace started.  See Trace for reading and replaying a trace.
+    '''
+    def __init__(self, file):
+        self.file = Path(file).expanduser()
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.FO = open(self.file, 'w')
+        self.start = perf_counter()
+        self.seq = 0
+
+
+    def write(self, kind, **kwargs):
+        with self.lock:
+            if self.FO is None:
+                return
+            entry = {'seq': self.seq, 't': round(perf_counter() - self.start, 6),
+                     'kind': kind}
+            entry.update(kwargs)
+            self.FO.write(json.dumps(encode(entry), default=str) + '\n')
+            self.seq += 1
+
+
+    def close(self):
+        with self.lock:
+            if self.FO is not None:
+                self.FO.close()
+                self.FO = None
+
+
+    def record_device(self, device, device_name, methods=None):
+        '''Replace methods on a device instance (by default all public
+        methods) with versions which record each call.
+        '''
+        if methods is None:
+            methods = [m for m in dir(device) if not m.startswith('_')]
+        for method in methods:
+            function = getattr(device, method, None)
+            if function is None or not callable(function)\
+               or isinstance(function, type):
+                continue
+            setattr(device, method, self.recording(function, device_name, method))
+
+
+    def recording(self, function, device_name, method):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            call = {'device': device_name, 'method': method,
+                    'args': args, 'kwargs': kwargs,
+                    'thread': threading.current_thread().name,
+                    'poll': mirror_read(),
+                    'start': round(start - self.start, 6)}
+            try:
+                result = function(*args, **kwargs)
+            except Exception as err:
+                self.write('call', **call, duration=perf_counter() - start,
+                           error={'type': type(err).__name__,
+                                  'message': str(err)})
+                raise
+            self.write('call', **call, duration=perf_counter() - start,
+                       result=result)
+            return result
+        return wrapper
+
+
+    def record_scheduler(self, scheduler):
+        '''Record each OB handed out by the scheduler's select method.
+        '''
+        select = scheduler.select
+        @wraps(select)
+        def wrapper(*args, **kwargs):
+            OB = select(*args, **kwargs)
+            self.write('schedule', id=scheduler.current_id,
+                       OB=str(OB) if OB is not None else None)
+            return OB
+        scheduler.select = wrapper
+
+
+##-------------------------------------------------------------------------
+## Trace Replay
+##-------------------------------------------------------------------------
+class Trace():
+    '''A recorded trace (see TraceRecorder) for replaying a night.
+
+    Device calls are replayed in order for each device method: the Nth call
+    of telescope.slew returns the result (or raises the error) of the Nth
+    recorded call, without waiting.  Scheduler decisions and the values of
+    the transition conditions for each trigger are also replayed, so the
+    state machine follows the recorded night regardless of the time or
+    what the replayed devices return.  Calls beyond those recorded return
+    the last recorded result and are counted as divergences.
+
+    Reads made by the DeviceMirror depend on timing (the poller), so they
+    are kept apart from the control logic's calls: a mirror read during the
+    replay gets the last value the mirror read before the next control call
+    still to be replayed, and is never counted as a divergence.
+    '''
+    def __init__(self, file):
+        self.file = Path(file).expanduser()
+        self.calls = {}
+        self.last = {}
+        self.polls = {}
+        self.poll_seqs = {}
+        self.schedule = deque()
+        self.conditions = deque()
+        self.start = None
+        self.end = None
+        self.divergences = 0
+        self.lock = threading.Lock()
+        with open(self.file) as FO:
+            for line in FO:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry['kind'] == 'call':
+                    key = (entry['device'], entry['method'])
+                    if entry.get('poll', False) is True\
+                       or entry.get('thread', None) == 'device_state':
+                        if 'error' not in entry.keys():
+                            self.polls.setdefault(key, []).append(entry)
+                            self.poll_seqs.setdefault(key, []).append(entry['seq'])
+                    else:
+                        self.calls.setdefault(key, deque()).append(entry)
+                elif entry['kind'] == 'schedule':
+                    self.schedule.append(entry)
+                elif entry['kind'] == 'conditions':
+                    self.conditions.append(entry)
+                elif entry['kind'] == 'start':
+                    self.start = entry
+                elif entry['kind'] == 'end':
+                    self.end = entry
+
+
+    def diverged(self):
+        with self.lock:
+            self.divergences += 1
+
+
+    def replay_poll(self, key):
+        pending = [calls[0]['seq'] for calls in list(self.calls.values())
+                   if len(calls) > 0]
+        position = min(pending) if len(pending) > 0 else np.inf
+        polls = self.polls.get(key, [])
+        n = bisect_left(self.poll_seqs.get(key, []), position)
+        if n > 0:
+            entry = polls[n-1]
+        elif len(polls) > 0:
+            entry = polls[0]
+        else:
+            entry = self.last.get(key, None)
+        if entry is None or 'error' in entry.keys():
+            return None
+        return decode(entry.get('result', None))
+
+
+    def replay_call(self, device_name, method):
+        key = (device_name, method)
+        if mirror_read():
+            return self.replay_poll(key)
+        try:
+            entry = self.calls.get(key, deque()).popleft()
+        except IndexError:
+            self.diverged()
+            entry = self.last.get(key, None)
+            if entry is None:
+                return None
+        self.last[key] = entry
+        if 'error' in entry.keys():
+            error = getattr(exceptions, entry['error']['type'],
+                            exceptions.HardwareFailure)
+            if not isinstance(error, type) or not issubclass(error, Exception):
+                error = exceptions.HardwareFailure
+            raise error(entry['error']['message'])
+        return decode(entry.get('result', None))
+
+
+    def matches_queue(self, scheduler):
+        '''True if the scheduler holds the same pending OBs as the recorded
+        night did at the start (or the trace does not say).
+        '''
+        if self.start is None or 'queue' not in self.start.keys():
+            return True
+        return self.start['queue'] == scheduler.signature()
+
+
+    def replay_scheduler(self, scheduler):
+        '''Replace the scheduler's select method with one which takes the OBs
+        in the recorded order.  The scheduler must hold the same OBs as the
+        recorded night.
+        '''
+        def select(*args, **kwargs):
+            try:
+                entry = self.schedule.popleft()
+            except IndexError:
+                self.diverged()
+                scheduler.current_id = None
+                return None
+            if entry['id'] is None:
+                scheduler.current_id = None
+                return None
+            OB = scheduler.take(entry['id'])
+            if OB is None:
+                self.diverged()
+            return OB
+        scheduler.select = select
+
+
+class ReplayDevice():
+    '''Stand in for a device which replays its calls from a Trace.  Takes
+    the same arguments as the device classes so that it can be used in
+    their place.
+    '''
+    def __init__(self, trace, device_name, logger=None, **kwargs):
+        self.trace = trace
+        self.device_name = device_name
+
+
+    def __str__(self):
+        return f'replay:{self.device_name}'
+
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        def replay(*args, **kwargs):
+            return self.trace.replay_call(self.device_name, method)
+        replay.__name__ = method
+        return replay
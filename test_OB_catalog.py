@@ -0,0 +1,133 @@
+import time
+import pytest
+from astropy import units as u
+from astropy import coordinates as c
+
+from ocs.scheduler import Scheduler, OBCatalog, write_catalog, ALLOWED_CLASSES
+from ocs.targets import TargetResolver
+
+
+allowed = ALLOWED_CLASSES + ['test_OB_catalog.Block']
+
+
+class Block():
+    def __init__(self, target=None, instconfig=None):
+        self.target = target
+        self.instconfig = instconfig
+
+
+def build_entries(n):
+    return [{'class': 'test_OB_catalog.Block',
+             'target': {'name': f'T{i%100}', 'ra': (i*0.36) % 360},
+             'instconfig': {'filter': 'LRGB'[i%4]}}
+            for i in range(n)]
+
+
+def test_catalog_scheduler(tmp_path):
+    catalog_file = write_catalog(build_entries(100000), tmp_path / 'OBs.jsonl')
+    catalog = OBCatalog(catalog_file, allowed=allowed)
+    assert len(catalog) == 100000
+    # Second open uses the cached index
+    t0 = time.time()
+    catalog = OBCatalog(catalog_file, allowed=allowed)
+    assert time.time() - t0 < 1
+
+    scheduler = Scheduler(catalog=catalog)
+    OB = scheduler.select()
+    assert scheduler.current_id == 0
+    assert OB.target == {'name': 'T0', 'ra': 0.0}
+    scheduler.skip([1, 2])
+    OB = scheduler.select(filter='R')
+    assert scheduler.current_id == 5
+    assert OB.instconfig['filter'] == 'R'
+    OB = scheduler.select(target='T42', filter='G')
+    assert scheduler.current_id == 42
+    assert scheduler.take(42) is None
+    OB = scheduler.select(ra_range=(359, 1))
+    assert scheduler.current_id == 998
+    assert len(scheduler) == 100000 - 6
+
+
+def test_pending_OBs(tmp_path):
+    catalog_file = write_catalog(build_entries(10), tmp_path / 'OBs.jsonl')
+    scheduler = Scheduler(catalog=OBCatalog(catalog_file, allowed=allowed))
+    scheduler.take(0)
+    scheduler.skip([2])
+    pending = list(scheduler.pending_OBs())
+    assert [id for id, OB in pending] == [1, 3, 4, 5, 6, 7, 8, 9]
+    assert pending[0][1].target == {'name': 'T1', 'ra': 0.36}
+    assert len(scheduler.candidates(limit=2)) == 2
+    # The signature of the pending OBs needs no OBs to be built
+    scheduler.catalog.get = None
+    signature = scheduler.signature()
+    assert signature['pending'] == 8
+    assert signature['catalog'] == str(catalog_file)
+    assert signature != Scheduler(catalog=scheduler.catalog).signature()
+
+
+def test_select_quickest_slew(tmp_path):
+    def slew_times(OBs):
+        return [abs(OB.target['ra'] - 1.5) for OB in OBs]
+    catalog_file = write_catalog(build_entries(10), tmp_path / 'OBs.jsonl')
+    scheduler = Scheduler(catalog=OBCatalog(catalog_file, allowed=allowed))
+    # Only the first candidates pending OBs are considered
+    OB = scheduler.select(slew_times=slew_times, candidates=3)
+    assert scheduler.current_id == 2
+    assert OB.target['ra'] == 0.72
+    scheduler.select(slew_times=slew_times, candidates=1)
+    assert scheduler.current_id == 0
+
+    OBs = [Block(target={'ra': ra}) for ra in [0, 1, 1.6, 1.4]]
+    scheduler = Scheduler(OBs=OBs)
+    OB = scheduler.select(slew_times=slew_times, candidates=3)
+    assert scheduler.current_id == 2
+    assert OB is OBs[2]
+    scheduler.select()
+    assert scheduler.current_id == 0
+    assert [id for id, OB in scheduler.pending_OBs()] == [1, 3]
+
+
+class Target():
+    def __init__(self, name, ra=None, dec=None):
+        self.name = name
+        self.ra = ra
+        self.dec = dec
+
+    def coord(self):
+        if self.name == 'Nowhere':
+            raise ValueError('Unknown target')
+        return c.SkyCoord(10*u.deg, 20*u.deg)
+
+
+def test_resolve_targets_from_index(tmp_path):
+    names = ['M31', 'M 42', 'X1', 'Nowhere']
+    entries = [{'target': {'name': names[i%4]}} for i in range(1000)]
+    entries += [{'target': {'name': 'Tile', 'ra': 1, 'dec': 2}}]
+    catalog = OBCatalog(write_catalog(entries, tmp_path / 'OBs.jsonl'),
+                        builder=lambda entry: Block(target=Target(**entry['target'])))
+    built = []
+    get = catalog.get
+    catalog.get = lambda id: built.append(id) or get(id)
+    scheduler = Scheduler(catalog=catalog)
+    scheduler.take(2)
+    built.clear()
+    resolver = TargetResolver()
+    failures = scheduler.resolve_targets(resolver)
+    assert [name for name, err in failures] == ['Nowhere']
+    # Only the OBs whose target names are not found locally are built
+    assert built == [6, 3]
+    assert resolver.local_coord('X1').dec.deg == 20
+
+
+def test_class_not_allowed(tmp_path):
+    catalog_file = write_catalog([{'class': 'os.system', 'command': 'true'}],
+                                 tmp_path / 'OBs.jsonl')
+    catalog = OBCatalog(catalog_file)
+    with pytest.raises(ValueError):
+        catalog.get(0)
+
+
+if __name__ == '__main__':
+    import tempfile
+    from pathlib import Path
+    test_catalog_scheduler(Path(tempfile.mkdtemp()))
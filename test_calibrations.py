@@ -0,0 +1,109 @@
+import threading
+import time
+
+from ocs.calibrations import CalibrationPlan
+from ocs.checkpoint import Checkpoint
+from ocs.scheduler import Scheduler, OBCatalog, write_catalog
+from ocs.simulator.detector import DetectorController
+
+
+class DetectorConfig():
+    def __init__(self, exptime, nexp=1, instrument='cam', gain=1, binning='1x1'):
+        self.exptime = exptime
+        self.nexp = nexp
+        self.instrument = instrument
+        self.gain = gain
+        self.binning = binning
+
+
+class OB():
+    def __init__(self, detconfig):
+        self.detconfig = detconfig
+
+
+def test_plan_from_OBs():
+    OBs = [OB([DetectorConfig(20, nexp=5), DetectorConfig(20, instrument='guide')]),
+           OB([DetectorConfig(60), DetectorConfig(20, instrument='guide')]),
+           OB([DetectorConfig(60, gain=2)]),
+           OB(None)]
+    # The 20s darks cover the 20s flats, except at gain 2
+    plan = CalibrationPlan(nbias=3, ndark=2, flat_exptimes=[5, 20])
+    plan.add_OBs(OBs)
+    kinds = sorted([(cal.kind, cal.detector, cal.exptime)
+                    for cal in plan.calibrations.values()])
+    assert kinds == [('bias', 0, 0), ('bias', 0, 0), ('bias', 1, 0),
+                     ('dark', 0, 20), ('dark', 0, 60), ('dark', 0, 60),
+                     ('dark', 1, 20),
+                     ('darkflat', 0, 5), ('darkflat', 0, 5), ('darkflat', 0, 20),
+                     ('darkflat', 1, 5)]
+    assert plan.frames_remaining() == 3*3 + 2*8
+
+
+def test_plan_from_catalog_index(tmp_path):
+    def dc(exptime, **kwargs):
+        return dict({'class': 'test_calibrations.DetectorConfig',
+                     'exptime': exptime}, **kwargs)
+    entries = [{'class': 'test_calibrations.OB',
+                'detconfig': [dc([20, 60, 120][i%3]), dc(20, instrument='guide')]}
+               for i in range(3000)]
+    entries.append({'class': 'test_calibrations.OB', 'detconfig': None})
+    catalog = OBCatalog(write_catalog(entries, tmp_path/'OBs.jsonl'),
+                        allowed=['test_calibrations'])
+    # Each distinct detector config is built once, no OBs are built
+    built = []
+    builder = catalog.builder
+    catalog.builder = lambda spec: built.append(spec) or builder(spec)
+    scheduler = Scheduler(catalog=catalog)
+    scheduler.skip(range(0, 3000, 3))
+    plan = CalibrationPlan(nbias=1, ndark=1)
+    plan.add_detconfigs(scheduler.detconfigs())
+    assert len(built) == 3
+    assert sorted([(cal.kind, cal.detector, cal.exptime)
+                   for cal in plan.calibrations.values()])\
+           == [('bias', 0, 0), ('bias', 1, 0), ('dark', 0, 60),
+               ('dark', 0, 120), ('dark', 1, 20)]
+
+
+def test_missing_and_record():
+    plan = CalibrationPlan(nbias=2, ndark=1)
+    plan.add(0, DetectorConfig(30))
+    plan.add(0, DetectorConfig(10))
+    order = []
+    while plan.next() is not None:
+        cal = plan.next()
+        dc = cal.detconfig()
+        assert dc.exptime == cal.exptime and dc.nexp == 1
+        order.append((cal.imagetyp, cal.exptime))
+        plan.record(cal)
+    assert order == [('BIAS', 0), ('BIAS', 0), ('DARK', 10), ('DARK', 30)]
+    assert plan.missing() == []
+    assert plan.frames_remaining() == 0
+
+
+def test_resume_from_checkpoint(tmp_path):
+    plan = CalibrationPlan(nbias=2, ndark=2)
+    plan.add(0, DetectorConfig(30))
+    checkpoint = Checkpoint(tmp_path/'checkpoint.jsonl')
+    for i in range(3):
+        cal = plan.next()
+        plan.record(cal)
+        checkpoint.write('calibration', key=cal.key)
+    checkpoint.write('state', state='waiting_closed')
+    checkpoint.close()
+
+    snapshot = Checkpoint(tmp_path/'checkpoint.jsonl').load()
+    resumed = CalibrationPlan(nbias=2, ndark=2)
+    resumed.add(0, DetectorConfig(30))
+    resumed.restore(snapshot['calibrations'])
+    assert [str(cal) for cal in resumed.missing()]\
+           == [str(cal) for cal in plan.missing()]
+    assert resumed.frames_remaining() == 1
+
+
+def test_abort_exposure():
+    detector = DetectorController(simulate_image=True, image_shape=(8, 8))
+    detector.set_exptime(30)
+    threading.Timer(0.1, detector.abort_exposure).start()
+    start = time.time()
+    assert detector.expose() is None
+    assert time.time() - start < 5
@@ -0,0 +1,100 @@
+from ocs.checkpoint import Checkpoint, OB_key, match_OBs
+from ocs.scheduler import Scheduler, OBCatalog, write_catalog
+
+
+class DetectorConfig():
+    def __init__(self, exptime):
+        self.exptime = exptime
+
+
+class Block():
+    '''An OB which prints the same whatever its detector config and
+    alignment.
+    '''
+    def __init__(self, target, detconfig=None, align=None):
+        self.target = target
+        self.detconfig = detconfig
+        self.align = align
+
+    def __str__(self):
+        return f'ScienceBlock {self.target}'
+
+
+def test_checkpoint_resume(tmp_path):
+    journal = tmp_path / 'checkpoint.jsonl'
+    checkpoint = Checkpoint(journal)
+    assert checkpoint.load() is None
+
+    checkpoint.write('state', state='observing', error_count=1,
+                     we_are_done=False, roof_open=True, current_OB=OB_key('OB0'),
+                     position=0, frames=[2, 2], requeue_counts={})
+    checkpoint.write('OB', key=OB_key('OB0'), id=0, failed=False)
+    checkpoint.write('state', state='observing', error_count=1,
+                     we_are_done=False, roof_open=True, current_OB=OB_key('OB1'),
+                     position=1, frames=[1, 0],
+                     requeue_counts={OB_key('OB0'): 1})
+    checkpoint.close()
+    # Simulate a crash part way through writing a line
+    with open(journal, 'a') as FO:
+        FO.write('{"event": "state", "sta')
+
+    snapshot = Checkpoint(journal).load()
+    assert snapshot['completed'] == [OB_key('OB0')]
+    assert snapshot['current_OB'] == OB_key('OB1')
+    assert snapshot['position'] == 1
+    assert snapshot['frames'] == [1, 0]
+    assert snapshot['requeue_counts'] == {OB_key('OB0'): 1}
+
+    # OBs are matched by content, so the list may be edited before resuming
+    scheduler = Scheduler(OBs=['OBnew', 'OB1', 'OB0', 'OB2', 'OB3'])
+    scheduler.skip(match_OBs(scheduler.pending_keys(), snapshot['completed']))
+    ids = match_OBs(scheduler.pending_keys(), [snapshot['current_OB']])
+    assert scheduler.take(ids[0]) == 'OB1'
+    assert scheduler.current_id == 1
+    assert scheduler.select() == 'OBnew'
+    assert scheduler.select() == 'OB2'
+
+    # A finished night has nothing to resume
+    checkpoint = Checkpoint(journal)
+    checkpoint.write('end')
+    checkpoint.close()
+    assert Checkpoint(journal).load() is None
+
+
+def test_match_identical_OBs():
+    scheduler = Scheduler(OBs=['OB0', 'OB1', 'OB0', 'OB0'])
+    assert match_OBs(scheduler.pending_keys(), [OB_key('OB0')]*2) == [0, 2]
+    assert match_OBs(scheduler.pending_keys(),
+                     [OB_key('OB2'), OB_key('OB1')]) == [1]
+
+
+def test_OB_key_uses_contents(tmp_path):
+    OBs = [Block('M31', detconfig=[DetectorConfig(30)]),
+           Block('M31', detconfig=[DetectorConfig(60)]),
+           Block('M31', detconfig=[DetectorConfig(30)], align='BlindAlign')]
+    assert len(set([str(OB) for OB in OBs])) == 1
+    assert len(set([OB_key(OB) for OB in OBs])) == 3
+    # The key does not depend on the object's identity
+    assert OB_key(Block('M31', detconfig=[DetectorConfig(60)])) == OB_key(OBs[1])
+    scheduler = Scheduler(OBs=OBs)
+    completed = [scheduler.key(1, OBs[1])]
+    assert match_OBs(scheduler.pending_keys(), completed) == [1]
+
+    # Catalog OBs are keyed by their entries, without building them
+    entries = [{'class': 'test_checkpoint.Block', 'target': {'name': 'M31'},
+                'detconfig': [{'class': 'test_checkpoint.DetectorConfig',
+                               'exptime': t}]} for t in [30, 60, 30]]
+    catalog = OBCatalog(write_catalog(entries, tmp_path/'OBs.jsonl'),
+                        allowed=['test_checkpoint'])
+    scheduler = Scheduler(catalog=catalog)
+    OB = scheduler.select()
+    completed = [scheduler.key(scheduler.current_id, OB)]
+    catalog.get = None
+    resumed = Scheduler(catalog=catalog)
+    assert match_OBs(resumed.pending_keys(), completed) == [0]
+
+
+if __name__ == '__main__':
+    import tempfile
+    from pathlib import Path
+    test_checkpoint_resume(Path(tempfile.mkdtemp()))
@@ -0,0 +1,83 @@
+from ocs.conditions import ConditionContext, ConditionMachine, condition
+
+
+transitions = [
+    {'trigger': 'acquire', 'source': 'waiting', 'dest': 'closing',
+     'conditions': ['done']},
+    {'trigger': 'acquire', 'source': 'waiting', 'dest': 'waiting',
+     'conditions': ['no_target']},
+    {'trigger': 'acquire', 'source': 'waiting', 'dest': 'acquiring',
+     'conditions': []},
+    {'trigger': 'reset', 'source': ['closing', 'acquiring'], 'dest': 'waiting',
+     'conditions': []},
+]
+
+
+class Model():
+    def __init__(self, memoize=True):
+        self.calls = {}
+        self.target = None
+        self.conditions = ConditionContext(transitions=transitions,
+                                           enabled=memoize)
+        self.machine = ConditionMachine(model=self, states=['waiting', 'closing',
+                                                            'acquiring'],
+                                        transitions=transitions,
+                                        initial='waiting', queued=True,
+                                        before_state_change=self.conditions.stop,
+                                        finalize_event='end_conditions')
+
+    def count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def end_conditions(self):
+        self.conditions.end(dest=self.state)
+
+    @condition
+    def done(self):
+        self.count('done')
+        return False
+
+    @condition
+    def not_done(self):
+        return not self.done()
+
+    @condition
+    def no_target(self):
+        self.count('no_target')
+        # Checks done again, as the observatory's conditions do
+        return self.not_done() and self.target is None
+
+
+def test_conditions_evaluated_once():
+    model = Model()
+    model.acquire()
+    assert model.state == 'waiting'
+    assert model.calls == {'done': 1, 'no_target': 1}
+    record = model.conditions.records[-1]
+    assert record['trigger'] == 'acquire'
+    assert record['dest'] == 'waiting'
+    assert record['decisive'] == [('done', False), ('no_target', True)]
+    # A new trigger evaluates the conditions again
+    model.target = 'M31'
+    model.acquire()
+    assert model.state == 'acquiring'
+    assert model.calls == {'done': 2, 'no_target': 2}
+    assert model.conditions.records[-1]['decisive'] == [('done', False),
+                                                        ('no_target', False)]
+    model.reset()
+    assert model.conditions.records[-1]['decisive'] == []
+
+
+def test_conditions_outside_trigger():
+    model = Model()
+    model.done()
+    model.done()
+    assert model.calls == {'done': 2}
+    assert len(model.conditions.records) == 0
+
+
+def test_memoization_disabled():
+    model = Model(memoize=False)
+    model.acquire()
+    assert model.calls == {'done': 2, 'no_target': 1}
+    assert len(model.conditions.records) == 1
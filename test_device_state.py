@@ -0,0 +1,88 @@
+from time import sleep
+import threading
+
+from ocs.devicestate import DeviceMirror
+from ocs.simulator.telescope import Telescope
+from ocs.simulator.roof import Roof
+
+
+class CountingTelescope(Telescope):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.atpark_calls = 0
+
+    def atpark(self):
+        self.atpark_calls += 1
+        return super().atpark()
+
+
+def test_reads_from_memory():
+    telescope = CountingTelescope()
+    mirror = DeviceMirror()
+    mirror.watch(telescope, 'telescope', {'atpark': ('atpark', None)})
+    assert mirror.peek('telescope.atpark') is None
+    assert mirror.get('telescope.atpark') is True
+    for i in range(10):
+        assert mirror.get('telescope.atpark') is True
+    assert telescope.atpark_calls == 1
+    assert mirror.age('telescope.atpark') < 1
+    # A stale value is read again
+    sleep(0.02)
+    mirror.get('telescope.atpark', max_age=0.01)
+    assert telescope.atpark_calls == 2
+
+
+def test_command_invalidates():
+    telescope = CountingTelescope()
+    mirror = DeviceMirror()
+    mirror.watch(telescope, 'telescope', {'atpark': ('atpark', None),
+                                          'tracking': ('tracking', None)})
+    mirror.invalidate_on(telescope, 'telescope', ['unpark', 'set_tracking'])
+    assert mirror.get('telescope.atpark') is True
+    assert mirror.get('telescope.tracking') is False
+    telescope.unpark()
+    assert mirror.peek('telescope.atpark') is None
+    assert mirror.get('telescope.atpark') is False
+    telescope.set_tracking(True)
+    assert mirror.get('telescope.tracking') is True
+
+
+def test_result_discarded_if_invalidated_during_read():
+    telescope = Telescope()
+    mirror = DeviceMirror()
+    started, release = threading.Event(), threading.Event()
+    def slow_atpark():
+        value = telescope.parked
+        started.set()
+        release.wait()
+        return value
+    mirror.add('telescope.atpark', slow_atpark, None)
+    reader = threading.Thread(target=mirror.refresh, args=('telescope.atpark',))
+    reader.start()
+    started.wait()
+    mirror.invalidate('telescope')
+    telescope.parked = False
+    release.set()
+    reader.join()
+    assert mirror.peek('telescope.atpark') is None
+    assert mirror.get('telescope.atpark') is False
+
+
+def test_background_polling():
+    roof = Roof(roof_time_to_open=0, roof_time_to_close=0)
+    mirror = DeviceMirror()
+    mirror.watch(roof, 'roof', {'shutterstatus': ('shutterstatus', 0.01)})
+    mirror.invalidate_on(roof, 'roof', ['open', 'close'])
+    mirror.start()
+    try:
+        sleep(0.1)
+        assert mirror.peek('roof.shutterstatus') == 'closed'
+        roof.open()
+        for i in range(100):
+            if mirror.peek('roof.shutterstatus') is not None:
+                break
+            sleep(0.01)
+        assert mirror.peek('roof.shutterstatus') == 'open'
+    finally:
+        mirror.stop()
+    assert mirror.thread is None
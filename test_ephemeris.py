@@ -0,0 +1,53 @@
+import numpy as np
+from astropy import units as u
+from astropy import coordinates as c
+from astropy.time import Time
+
+from ocs.ephemeris import NightlyEphemeris
+
+
+def test_ephemeris_matches_astropy(tmp_path):
+    location = c.EarthLocation(lat=20.0288*u.deg, lon=-155.7149*u.deg,
+                               height=677*u.m)
+    ephem = NightlyEphemeris(location, cache_dir=tmp_path)
+    times = Time('2021-06-01T06:00:00') + np.linspace(0, 20, 7)*u.hour
+    altaz = c.AltAz(obstime=times, location=location)
+    sun_alt = c.get_sun(times).transform_to(altaz).alt.deg
+    for i,time in enumerate(times):
+        assert abs(ephem.sun_alt(time) - sun_alt[i]) < 0.1
+        assert ephem.is_dark(time) == (sun_alt[i] < -12)
+    # Midnight local time (10:00 UT) is night, local noon is day
+    assert ephem.twilight_phase(Time('2021-06-01T10:00:00')) == 'night'
+    assert ephem.twilight_phase(Time('2021-06-01T22:00:00')) == 'day'
+
+    moon = c.get_body('moon', times[0], location=location)
+    target = c.SkyCoord(10.675, 41.27, unit=(u.deg, u.deg))
+    assert abs(ephem.moon_separation(target, times[0])
+               - moon.separation(target).deg) < 0.1
+
+    # A second instance reads the cached tables
+    assert len(list(tmp_path.glob('ephem_*.npz'))) > 0
+    cached = NightlyEphemeris(location, cache_dir=tmp_path)
+    assert abs(cached.sun_alt(times[3]) - ephem.sun_alt(times[3])) < 1e-9
+
+
+def test_night_end_before_dusk(tmp_path):
+    location = c.EarthLocation(lat=20.0288*u.deg, lon=-155.7149*u.deg,
+                               height=677*u.m)
+    ephem = NightlyEphemeris(location, cache_dir=tmp_path)
+    # Starting in the afternoon (14:00 HST): not dark, but the night is to come
+    afternoon = Time('2021-06-02T00:00:00')
+    assert ephem.is_dark(afternoon) is False
+    end = ephem.night_end(afternoon)
+    assert end > afternoon
+    dusk, dawn = ephem.dark_window(ephem.night_of(afternoon))
+    assert dusk > afternoon
+    assert abs((end - dawn).to(u.s).value) < 1
+    # At midnight the night in progress ends at the same time
+    midnight = Time('2021-06-02T10:00:00')
+    assert ephem.is_dark(midnight) is True
+    assert abs((ephem.night_end(midnight) - end).to(u.s).value) < 1
+    # After dawn the night is over, and the next one ends a day later
+    morning = end + 1*u.hour
+    assert ephem.is_dark(morning) is False
+    assert abs((ephem.night_end(morning) - end).to(u.hour).value - 24) < 0.2
@@ -0,0 +1,110 @@
+from time import sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor
+
+from ocs.exposureclock import ExposureClock
+
+
+def expose(clock, index, nexp, exptime, setup_time):
+    sleep(setup_time)
+    clock.start(index, nexp, exptime)
+    starts = []
+    j = 0
+    while j < nexp or clock.extra_frame_fits(index, exptime):
+        starts.append(monotonic())
+        sleep(exptime)
+        j += 1
+        if j <= nexp:
+            clock.update(index, nexp - j, exptime)
+    return starts
+
+
+def run(free_run):
+    clock = ExposureClock(2, free_run=free_run, timeout=5)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        fast = pool.submit(expose, clock, 0, 2, 0.05, 0)
+        slow = pool.submit(expose, clock, 1, 1, 0.3, 0.2)
+        return fast.result(), slow.result()
+
+
+def test_synchronized_start():
+    fast, slow = run(free_run=False)
+    assert len(fast) == 2
+    assert len(slow) == 1
+    # The fast detector waited for the slow one to be set up
+    assert abs(fast[0] - slow[0]) < 0.05
+
+
+def test_free_run():
+    fast, slow = run(free_run=True)
+    assert len(slow) == 1
+    # The fast detector keeps exposing while the slow one is still going
+    assert len(fast) >= 4
+    assert fast[-1] + 0.05 <= slow[0] + 0.3 + 0.05
+
+
+def test_broken_barrier():
+    clock = ExposureClock(2, timeout=5)
+    clock.abort()
+    assert clock.start(0, 1, 0.1) is False
+
+
+def test_move_during_readout():
+    clock = ExposureClock(2, timeout=5)
+
+    def expose_and_read_out(index, nexp, exptime, readout):
+        clock.start(index, nexp, exptime + readout)
+        for j in range(nexp):
+            frame_id = clock.begin_frame(index, last_required=(j == nexp-1))
+            sleep(exptime)
+            clock.end_integration(index, frame_id)
+            sleep(readout)
+        clock.finished(index)
+        return monotonic()
+
+    start = monotonic()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        threads = [pool.submit(expose_and_read_out, 0, 2, 0.1, 0.3),
+                   pool.submit(expose_and_read_out, 1, 1, 0.2, 0.3)]
+        assert clock.wait_integrated(timeout=5) is True
+        integrated = monotonic()
+        done = max([thread.result() for thread in threads])
+    # The last frame finished integrating at 0.5s and read out until 0.8s
+    assert 0.45 < integrated - start < 0.6
+    assert done - integrated > 0.2
+
+
+def test_detector_reports_integration():
+    from functools import partial
+    from ocs.simulator.detector import DetectorController
+    detector = DetectorController(exposure_overhead=0.3)
+    detector.set_exptime(0.1)
+    clock = ExposureClock(1, timeout=5)
+    clock.start(0, 1, 0.4)
+    frame_id = clock.begin_frame(0, last_required=True)
+    detector.set_integration_callback(partial(clock.end_integration, 0, frame_id))
+    start = monotonic()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        exposure = pool.submit(detector.expose)
+        assert clock.wait_integrated(timeout=5) is True
+        integrated = monotonic()
+        exposure.result()
+        done = monotonic()
+    # The move can start when the shutter closes, not after the readout
+    assert 0.08 < integrated - start < 0.25
+    assert done - integrated > 0.2
+
+
+def test_integration_ends_with_expose_if_not_reported():
+    # Without a report from the detector, a frame which is slow to start
+    # (e.g. camera setup) is not taken as integrated after exptime
+    clock = ExposureClock(1, timeout=5)
+    clock.start(0, 1, 0.1)
+    frame_id = clock.begin_frame(0, last_required=True)
+    def expose():
+        sleep(0.3)
+        clock.end_integration(0, frame_id)
+    start = monotonic()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pool.submit(expose)
+        assert clock.wait_integrated(timeout=5) is True
+    assert monotonic() - start > 0.25
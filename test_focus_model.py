@@ -0,0 +1,51 @@
+import numpy as np
+
+from ocs.focusmodel import FocusModel
+
+
+def test_focus_model_prediction(tmp_path):
+    model_file = tmp_path / 'focus_model.yaml'
+    model = FocusModel(file=model_file, max_uncertainty=20)
+    position, uncertainty = model.predict('L', 0, 10)
+    assert position is None
+    assert model.good_enough(uncertainty) is False
+
+    rng = np.random.default_rng(1)
+    for T in [5, 8, 10, 12, 15]:
+        model.add('L', 0, T, 1000 + 10*T + rng.normal(0, 3))
+
+    reloaded = FocusModel(file=model_file, max_uncertainty=20)
+    position, uncertainty = reloaded.predict('L', 0, 11)
+    assert np.isclose(position, 1110, atol=10)
+    assert reloaded.good_enough(uncertainty) is True
+    # Other filters and focusers are modeled separately
+    assert reloaded.predict('R', 0, 11)[0] is None
+    assert reloaded.predict('L', 1, 11)[0] is None
+
+
+def test_focus_model_degenerate():
+    model = FocusModel(min_points=2, max_uncertainty=20, min_scatter=5)
+    # Too few points to measure the scatter about a line: no prediction
+    model.add('L', 0, 5, 1050, save=False)
+    model.add('L', 0, 10, 1100, save=False)
+    model.add('L', 0, 15, 1150, save=False)
+    assert model.predict('L', 0, 8) == (None, np.inf)
+    # A perfect fit still has the minimum scatter
+    model.add('L', 0, 20, 1200, save=False)
+    position, uncertainty = model.predict('L', 0, 10)
+    assert np.isclose(position, 1100)
+    assert uncertainty >= 5
+    assert model.good_enough(uncertainty) is True
+    # Points all at one temperature fit only the mean
+    model.add('R', 0, 10, 1100, save=False)
+    model.add('R', 0, 10, 1100, save=False)
+    assert model.predict('R', 0, 10)[0] is None
+    model.add('R', 0, 10, 1100, save=False)
+    assert model.predict('R', 0, 10)[1] >= 5
+    assert model.predict('R', 0, 12)[1] == np.inf
+
+
+if __name__ == '__main__':
+    import tempfile
+    from pathlib import Path
+    test_focus_model_prediction(Path(tempfile.mkdtemp()))
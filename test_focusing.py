@@ -0,0 +1,131 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
+import threading
+import time
+from logging import INFO
+import numpy as np
+from astropy.io import fits
+import pytest
+
+from odl.detector_config import CMOSDetectorConfig
+
+from ocs.exceptions import FocusRunFailure
+from ocs.focusing import FocusFitParabola, fit_parabola
+from ocs.devicestate import DeviceMirror
+from ocs.observatory import RollOffRoof, analysis_context, mirrored_header
+from ocs.simulator import InstrumentController, DetectorController, Telescope
+
+
+def test_fit_parabola():
+    positions = np.arange(850, 1151, 50)
+    fwhm = 2 + ((positions - 1020)/100)**2
+    best, best_fwhm = fit_parabola(positions, fwhm)
+    assert np.isclose(best, 1020)
+    assert np.isclose(best_fwhm, 2)
+    # Unmeasured frames are ignored
+    fwhm[[0, 3]] = np.nan
+    assert np.isclose(fit_parabola(positions, fwhm)[0], 1020)
+
+
+def test_fit_parabola_failures():
+    positions = np.arange(850, 1151, 50)
+    with pytest.raises(FocusRunFailure):
+        fit_parabola(positions, np.full(len(positions), np.nan))
+    with pytest.raises(FocusRunFailure):
+        fit_parabola(positions, 5 - ((positions - 1000)/100)**2)
+
+
+class Focuser():
+    '''The parts of a RollOffRoof used by a focus run, with simulated
+    devices.
+    '''
+    focus_fit_parabola = RollOffRoof.focus_fit_parabola
+    take_focus_series = RollOffRoof.take_focus_series
+    focus_measurement = RollOffRoof.focus_measurement
+    submit_analysis = RollOffRoof.submit_analysis
+    restart_analysis_pool = RollOffRoof.restart_analysis_pool
+
+    def __init__(self, pool, simulate_image=True, best_focus=1030):
+        self.current_OB = FocusFitParabola(detconfig=CMOSDetectorConfig(exptime=1, nexp=1),
+                                           n_focus_positions=7, focus_step=50)
+        self.telescope = Telescope()
+        self.instrument = InstrumentController()
+        self.detector = [DetectorController(simulate_image=simulate_image,
+                                            simulate_exposure_time=False,
+                                            image_shape=(256, 256),
+                                            best_focus=best_focus, seed=1)]
+        self.analysis_pool = pool
+        self.analysis_workers = 2
+        self.analysis_lock = threading.Lock()
+        self.header_max_age = 2
+        self.device_state = DeviceMirror()
+        self.device_state.watch(self.telescope, 'telescope',
+                                {'header': ('collect_header_metadata', None)})
+        self.device_state.watch(self.instrument, 'instrument',
+                                {'header': ('collect_header_metadata', None)})
+        self.device_state.invalidate_on(self.instrument, 'instrument',
+                                        ['set_focus'])
+
+    def log(self, msg, *args, level=INFO):
+        pass
+
+
+def test_focus_fit_parabola():
+    with ProcessPoolExecutor(max_workers=2, mp_context=analysis_context()) as pool:
+        focuser = Focuser(pool, best_focus=1030)
+        fitted = focuser.focus_fit_parabola()
+        assert abs(fitted[0] - 1030) < 25
+        assert focuser.instrument.get_focus(focuser=0) == fitted[0]
+
+        # A run with no image data fails and leaves the focus where it was
+        focuser = Focuser(pool, simulate_image=False)
+        with pytest.raises(FocusRunFailure):
+            focuser.focus_fit_parabola()
+        assert focuser.instrument.get_focus(focuser=0) == 1000
+
+
+def test_focus_with_broken_pool():
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=analysis_context())
+    # A worker process dies, which breaks the pool
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+    focuser = Focuser(pool, best_focus=1030)
+    try:
+        fitted = focuser.focus_fit_parabola()
+        assert abs(fitted[0] - 1030) < 25
+        assert focuser.analysis_pool is not pool
+    finally:
+        focuser.analysis_pool.shutdown()
+
+
+def test_failed_focus_measurement():
+    pool = ProcessPoolExecutor(max_workers=1, mp_context=analysis_context())
+    focuser = Focuser(pool)
+    future = Future()
+    future.set_exception(ValueError('no stars'))
+    assert np.isnan(focuser.focus_measurement(future, pool)['fwhm'])
+    assert focuser.analysis_pool is pool
+    future = Future()
+    future.set_exception(BrokenProcessPool('worker died'))
+    assert np.isnan(focuser.focus_measurement(future, pool)['fwhm'])
+    assert focuser.analysis_pool is not pool
+    focuser.analysis_pool.shutdown()
+
+
+def test_mirrored_header():
+    reads = []
+    def header():
+        reads.append(time.monotonic())
+        return fits.Header({'READ': len(reads)})
+    device_state = DeviceMirror()
+    device_state.add('telescope.header', header, None)
+    hdr = mirrored_header(device_state, ['telescope.header'], max_age=0.05)
+    assert hdr['READ'] == 1
+    assert 0 <= hdr['HDRAGE'] < 0.05
+    # A header older than max_age is read again
+    time.sleep(0.1)
+    assert mirrored_header(device_state, ['telescope.header'])['READ'] == 1
+    hdr = mirrored_header(device_state, ['telescope.header'], max_age=0.05)
+    assert hdr['READ'] == 2
+    assert hdr['HDRAGE'] < 0.05
@@ -0,0 +1,42 @@
+import os
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from ocs.framebuffer import FrameRing, downsample
+
+
+def read_latest(name):
+    ring = FrameRing.attach(name)
+    metadata, data = ring.latest()
+    preview = downsample(data, 4)
+    ring.close()
+    return metadata, preview
+
+
+def test_frame_ring():
+    name = f'test_ocs_{os.getpid()}'
+    ring = FrameRing(name, nslots=3, slot_bytes=64*64*2, create=True)
+    try:
+        assert ring.latest() is None
+        frames = [np.full((64, 64), i, dtype=np.uint16) for i in range(5)]
+        for i,frame in enumerate(frames):
+            assert ring.publish(frame, filename=f'frame{i}.fits') == i
+        assert len(ring) == 5
+        # Only the last three frames are still in the buffer
+        assert ring.read(1) is None
+        metadata, data = ring.read(2)
+        assert metadata['filename'] == 'frame2.fits'
+        assert np.all(data == 2)
+        assert ring.publish(np.zeros((65, 64), dtype=np.uint16)) is None
+
+        # Read from a separate (not forked) process
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            metadata, preview = pool.submit(read_latest, name).result()
+        assert metadata['frame'] == 4
+        assert metadata['shape'] == [64, 64]
+        assert preview.shape == (16, 16)
+        assert np.all(preview == 4)
+    finally:
+        ring.close()
@@ -0,0 +1,35 @@
+import warnings
+import shutil
+from astropy import units as u
+from astropy import coordinates as c
+from astropy.time import Time
+from astropy.utils import iers
+
+from ocs.iersdata import IERSData, IERS_A_NAME, LEAP_SECOND_NAME
+
+
+def test_iers_data_offline(tmp_path):
+    # Bundled tables
+    data = IERSData(cache_dir=tmp_path)
+    status = data.load()
+    assert status['iers_file'] == str(iers.IERS_A_FILE)
+    assert status['measured_until'] < status['predicted_until']
+
+    # A pre-fetched copy in the cache directory takes precedence
+    shutil.copy(iers.IERS_A_FILE, tmp_path/IERS_A_NAME)
+    shutil.copy(iers.IERS_LEAP_SECOND_FILE, tmp_path/LEAP_SECOND_NAME)
+    status = data.load()
+    assert status['iers_file'] == str(tmp_path/IERS_A_NAME)
+    assert iers.conf.auto_download is False
+
+    # Staleness is judged against the measured data
+    measured_until = Time(status['measured_until'])
+    assert data.status(now=measured_until + 1*u.day)['stale'] is False
+    assert data.status(now=measured_until + 60*u.day)['stale'] is True
+
+    # Transforms need no network and emit no warnings
+    location = c.EarthLocation(lat=20*u.deg, lon=-155*u.deg, height=677*u.m)
+    altaz = c.AltAz(obstime=Time.now(), location=location)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        c.SkyCoord(10, 41, unit=(u.deg, u.deg)).transform_to(altaz)
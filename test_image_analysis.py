@@ -0,0 +1,45 @@
+import numpy as np
+
+from ocs.imageanalysis import measure_frame, frame_quality, quality_problems
+from ocs.simulator.detector import simulate_star_field, DetectorController
+
+
+def test_measure_fwhm():
+    for fwhm in [2, 3, 5]:
+        image = simulate_star_field(fwhm=fwhm, seed=1)
+        result = measure_frame(image)
+        assert result['nstars'] > 40
+        assert np.isclose(result['fwhm'], fwhm, rtol=0.2)
+
+
+def test_blank_frame():
+    result = measure_frame(np.random.default_rng(1).normal(100, 5, (256, 256)))
+    assert result['nstars'] == 0
+    assert np.isnan(result['fwhm'])
+
+
+def test_simulated_focus_curve():
+    detector = DetectorController(simulate_image=True, best_focus=1000)
+    positions = np.arange(700, 1301, 100)
+    fwhm = [measure_frame(simulate_star_field(fwhm=detector.fwhm_at(p), seed=2))['fwhm']
+            for p in positions]
+    assert positions[np.argmin(fwhm)] == 1000
+
+
+def test_frame_quality():
+    image = simulate_star_field(fwhm=3, seed=3)
+    image = np.clip(image, 0, 65535).astype(np.uint16)
+    image[10:12, 10:12] = 65535
+    quality = frame_quality(image, factor=2)
+    assert quality['nsaturated'] == 4
+    assert np.isclose(quality['background'], 100, rtol=0.05)
+    assert np.isclose(quality['fwhm'], 3, rtol=0.2)
+    assert quality_problems(quality, {'max_fwhm': 5, 'min_nstars': 10}) == []
+    assert len(quality_problems(quality, {'max_fwhm': 2, 'max_nsaturated': 0})) == 2
+
+
+if __name__ == '__main__':
+    test_measure_fwhm()
+    test_blank_frame()
+    test_simulated_focus_curve()
+    test_frame_quality()
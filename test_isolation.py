@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+from copy import deepcopy
+from pathlib import Path
+import threading
+
+from ocs import create_log
+from ocs.exceptions import TelescopeFailure
+from ocs.simulator import isolate, Weather, Roof, Telescope, DetectorController
+
+
+def failures(seed, n=200):
+    telescope = Telescope(park_random_fail_rate=0.2, seed=seed)
+    result = []
+    for i in range(n):
+        try:
+            telescope.park()
+            result.append(False)
+        except TelescopeFailure:
+            result.append(True)
+    return result
+
+
+def test_seeded_failures_are_reproducible():
+    assert failures(1) == failures(1)
+    assert failures(1) != failures(2)
+
+
+def test_failures_independent_across_threads():
+    # Other threads drawing random numbers do not change a device's failures
+    expected = failures(5)
+    results = {}
+    def run(j):
+        results[j] = failures(5) if j == 0 else failures(j)
+    threads = [threading.Thread(target=run, args=(j,)) for j in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert results[0] == expected
+
+
+def test_seeded_images():
+    images = [DetectorController(simulate_image=True, simulate_exposure_time=False,
+                                 image_shape=(32, 32), seed=3).expose()[0].data
+              for i in range(2)]
+    assert (images[0] == images[1]).all()
+
+
+def test_weather_safety_files(tmp_path):
+    a = Weather(safety_file=tmp_path/'a'/'safe.txt')
+    b = Weather(safety_file=tmp_path/'b'/'safe.txt')
+    now = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    with open(a.safety_file, 'a') as FO:
+        FO.write(f'{now} unsafe\n')
+    assert a.is_safe() is False
+    assert b.is_safe() is True
+
+
+def test_weather_source():
+    readings = [True, False, True]
+    weather = Weather(source=lambda: readings.pop(0))
+    start = datetime.now() - timedelta(seconds=1)
+    assert weather.is_safe() is True
+    assert weather.is_safe() is False
+    assert bool(weather.has_been_safe(start)) is False
+    # Safe since the unsafe reading
+    readings.extend([True, True])
+    assert weather.has_been_safe(datetime.now()) is True
+
+
+def test_loggers():
+    a = create_log(logname='isolation_a', use_queue=False)
+    b = create_log(logname='isolation_b', use_queue=False)
+    assert a is not b
+    assert create_log(logname='isolation_a', use_queue=False) is a
+
+
+def test_isolate(tmp_path):
+    config = {'name': 'simulatedobs', 'datadir': '~',
+              'logfile': '/var/log/log_simulatedobs.txt',
+              'weather': Weather, 'weather_config': {},
+              'roof': Roof, 'roof_config': {'roof_time_to_open': 0},
+              'telescope': Telescope,
+              'detector': [DetectorController, DetectorController],
+              'detector_config': [{}, {}],
+              'ledger_file': '~/ledger.jsonl', 'checkpoint_file': '~/ckpt.json',
+              'trace_file': '~/trace.jsonl', 'metrics_file': '~/metrics.json',
+              'focus_model_file': '~/focus.yaml',
+              'slew_model_file': '~/slew.yaml',
+              'metrics_port': 9100, 'status_port': 8765}
+    original = deepcopy(config)
+    a = isolate(config, 'a', tmp_path/'a', seed=1)
+    b = isolate(config, 'b', tmp_path/'b', seed=2, port_offset=1)
+    assert config == original
+    assert a['instance'] == 'a'
+    assert a['datadir'] != b['datadir']
+    assert a['logfile'] == str(tmp_path/'a'/'log_simulatedobs.txt')
+    for key in ['ledger_file', 'checkpoint_file', 'trace_file', 'metrics_file',
+                'focus_model_file', 'slew_model_file']:
+        assert a[key] == str(tmp_path/'a'/Path(config[key]).name)
+        assert a[key] != b[key]
+    assert a['metrics_port'] is None and a['status_port'] is None
+    assert (b['metrics_port'], b['status_port']) == (9101, 8766)
+    assert a['weather_config']['safety_file'] != b['weather_config']['safety_file']
+    assert a['roof_config']['roof_time_to_open'] == 0
+    seeds = [a['roof_config']['seed'], a['telescope_config']['seed'],
+             a['detector_config'][0]['seed'], a['detector_config'][1]['seed']]
+    assert len(set(seeds)) == 4
+    assert isolate(config, 'a', tmp_path/'a', seed=1) == a
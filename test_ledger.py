@@ -0,0 +1,55 @@
+from datetime import datetime
+from astropy.time import Time
+
+from ocs.ledger import OBLedger
+
+
+def test_ledger_append_and_query(tmp_path):
+    night1 = tmp_path / 'ledger_night1.jsonl'
+    night2 = tmp_path / 'ledger_night2.jsonl'
+    long_name = 'A target name which is much longer than forty characters'
+
+    ledger = OBLedger(file=night1, capacity=2)
+    for i in range(5):
+        ledger.add_row({'type': 'ScienceBlock', 'target': 'M31',
+                        'filter': 'R', 'nframes': 4, 'failed': False})
+    ledger.add_row({'type': 'ScienceBlock', 'target': long_name,
+                    'filter': 'R', 'nframes': 4, 'failed': True})
+    assert len(ledger) == 6
+    table = ledger.to_table()
+    assert len(table) == 6
+    assert table['target'][-1] == long_name
+
+    ledger2 = OBLedger(file=night2)
+    ledger2.add_row({'type': 'ScienceBlock', 'target': 'M78',
+                     'filter': 'R', 'nframes': 2, 'failed': False})
+    ledger2.add_row({'type': 'ScienceBlock', 'target': 'M31',
+                     'filter': 'B', 'nframes': 4, 'failed': False})
+
+    combined = OBLedger.read([night1, night2])
+    assert len(combined) == 8
+    assert combined.frames_per_target(filter='R') == {'M31': 20, 'M78': 2}
+    assert combined.targets_with_frames(10, filter='R') == ['M31']
+    assert combined.targets_with_frames(1, filter=['R', 'B']) == ['M31', 'M78']
+
+
+def test_ledger_since(tmp_path):
+    file = tmp_path / 'ledger.jsonl'
+    ledger = OBLedger(file=file)
+    for date, target in [('2026-10-18T08:00:00', 'M31'),
+                         ('2026-10-19T06:00:00', 'M33'),
+                         ('2026-10-19T07:00:00', 'M42')]:
+        ledger.add_row({'date': date, 'target': target, 'nframes': 1})
+    # A restart tonight continues the ledger without last night's OBs
+    tonight = OBLedger(file=file, since=Time('2026-10-18T22:00:00'))
+    assert tonight['target'] == ['M33', 'M42']
+    tonight.add_row({'target': 'M45', 'nframes': 1})
+    assert len(OBLedger.read(file)) == 4
+    since = datetime(2026, 10, 19, 6, 30)
+    assert OBLedger.read(file, since=since)['target'] == ['M42', 'M45']
+
+
+if __name__ == '__main__':
+    import tempfile
+    from pathlib import Path
+    test_ledger_append_and_query(Path(tempfile.mkdtemp()))
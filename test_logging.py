@@ -0,0 +1,86 @@
+from logging import DEBUG, INFO, WARNING
+from logging.handlers import QueueHandler
+import json
+import time
+
+from ocs import create_log
+from ocs.observatory import RollOffRoof
+
+
+class Counted():
+    '''A log argument which counts how often it is formatted.'''
+    def __init__(self):
+        self.n = 0
+
+    def __str__(self):
+        self.n += 1
+        return 'counted'
+
+
+def read_lines(file, n, timeout=5):
+    '''Wait for the queue listener to write n lines to file.'''
+    end = time.time() + timeout
+    while time.time() < end:
+        lines = file.read_text().splitlines() if file.exists() else []
+        if len(lines) >= n:
+            return lines
+        time.sleep(0.01)
+    return lines
+
+
+def test_queue_and_json(tmp_path):
+    jsonlogfile = tmp_path/'log.jsonl'
+    log = create_log(loglevel_console='WARNING', jsonlogfile=jsonlogfile,
+                     loglevel_json='INFO', logname='test_queue_and_json')
+    assert [type(h) for h in log.handlers] == [QueueHandler]
+    # The logger level is the lowest handler level
+    assert log.level == INFO
+    arg = Counted()
+    log.debug('debug %s', arg)
+    assert arg.n == 0
+    log.info('%d stars, FWHM %.1f, %s', 12, 2.345, arg,
+             extra={'state': 'observing', 'OB': 'ScienceBlock @ M31'})
+    lines = read_lines(jsonlogfile, 2)
+    assert arg.n > 0
+    entry = json.loads(lines[-1])
+    assert entry['message'] == '12 stars, FWHM 2.3, counted'
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'test_queue_and_json'
+    assert entry['thread'] == 'MainThread'
+    assert entry['state'] == 'observing'
+    assert entry['OB'] == 'ScienceBlock @ M31'
+    assert json.loads(lines[0])['message'] == 'Log Started: test_queue_and_json'
+
+
+class OB():
+    blocktype = 'ScienceBlock'
+    target = '50% moon'
+
+
+class Logged():
+    '''The parts of a RollOffRoof used by its log method.'''
+    log = RollOffRoof.log
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.state = 'waiting_closed'
+        self.current_OB = OB()
+
+
+def test_log_skips_disabled_levels(tmp_path):
+    jsonlogfile = tmp_path/'log.jsonl'
+    logger = create_log(loglevel_console='WARNING', jsonlogfile=jsonlogfile,
+                        loglevel_json='INFO', use_queue=False,
+                        logname='test_log_skips_disabled_levels')
+    observatory = Logged(logger)
+    arg = Counted()
+    observatory.log('%s', arg, level=DEBUG)
+    assert arg.n == 0
+    # A % in the prefix is not taken as a format
+    observatory.log('%d of %s', 3, arg, level=WARNING)
+    assert arg.n > 0
+    entry = json.loads(jsonlogfile.read_text().splitlines()[-1])
+    assert entry['message'].startswith('waiting_closed ')
+    assert entry['message'].endswith('|ScienceBlock @ 50% moon       : 3 of counted')
+    assert entry['state'] == 'waiting_closed'
+    assert entry['OB'] == 'ScienceBlock @ 50% moon'
@@ -0,0 +1,63 @@
+from urllib.request import urlopen
+
+from ocs.metrics import Histogram, Metrics
+
+
+def test_histogram_buckets():
+    h = Histogram(buckets=(1, 5, 0.1))
+    for value in [0.05, 0.1, 0.5, 3, 100]:
+        h.observe(value)
+    # Buckets are sorted and a value on a bucket edge counts in that bucket
+    assert h.cumulative() == [(0.1, 2), (1, 3), (5, 4), (float('inf'), 5)]
+    assert h.count == 5
+    assert h.max == 100
+    assert abs(h.sum - 103.65) < 1e-9
+
+
+def test_prometheus_text():
+    metrics = Metrics(buckets=(1, 10))
+    metrics.observe('device_call_seconds', 0.5, device='roof', method='open')
+    metrics.observe('device_call_seconds', 20, device='roof', method='open')
+    metrics.observe('mongo_seconds', 2)
+    metrics.observe('writeto_seconds', 2, instrument='cam "A"\\b\n')
+    lines = metrics.to_prometheus().splitlines()
+    assert lines[:6] == ['# TYPE ocs_device_call_seconds histogram',
+                         'ocs_device_call_seconds_bucket{device="roof",method="open",le="1"} 1',
+                         'ocs_device_call_seconds_bucket{device="roof",method="open",le="10"} 1',
+                         'ocs_device_call_seconds_bucket{device="roof",method="open",le="+Inf"} 2',
+                         'ocs_device_call_seconds_sum{device="roof",method="open"} 20.500000',
+                         'ocs_device_call_seconds_count{device="roof",method="open"} 2']
+    assert 'ocs_mongo_seconds_bucket{le="10"} 1' in lines
+    assert 'ocs_mongo_seconds_count 1' in lines
+    assert 'ocs_writeto_seconds_count{instrument="cam \\"A\\"\\\\b\\n"} 1' in lines
+
+
+def test_labeler_and_dump(tmp_path):
+    metrics = Metrics()
+    state = {'state': 'open'}
+    class Device():
+        def move(self):
+            return 'moved'
+    device = Device()
+    metrics.instrument_device(device, 'roof', ['move', 'missing'],
+                              labeler=lambda: dict(state))
+    assert device.move() == 'moved'
+    state['state'] = 'closed'
+    device.move()
+    counts = {labels['state']: n for name, labels, n, total, mean, maxval
+              in metrics.summary()}
+    assert counts == {'open': 1, 'closed': 1}
+    file = metrics.dump(tmp_path/'metrics'/'ocs.prom')
+    assert file.read_text() == metrics.to_prometheus()
+
+
+def test_serve():
+    metrics = Metrics()
+    metrics.observe('mongo_seconds', 2)
+    server = metrics.serve(port=0)
+    try:
+        with urlopen(f'http://localhost:{server.server_port}/metrics') as response:
+            assert 'ocs_mongo_seconds_count 1' in response.read().decode()
+    finally:
+        metrics.shutdown()
+    assert metrics.server is None
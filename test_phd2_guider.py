@@ -0,0 +1,71 @@
+import json
+import socket
+import threading
+import time
+import pytest
+
+from ocs.phd2guiding.guider import Guider, GuiderException
+
+
+class FakePHD2():
+    '''A PHD2 server which sends the Version and AppState events to each
+    client.  The first client's connection is dropped when it makes a
+    request, later clients get an answer to each request.
+    '''
+    def __init__(self):
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('localhost', 0))
+        self.server.listen(2)
+        self.port = self.server.getsockname()[1]
+        self.requests = []
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def send(self, conn, message):
+        conn.sendall(json.dumps(message).encode() + b'\r\n')
+
+    def serve(self):
+        for client in range(2):
+            conn, address = self.server.accept()
+            self.send(conn, {'Event': 'Version', 'PHDVersion': '2.6.11',
+                             'PHDSubver': ''})
+            self.send(conn, {'Event': 'AppState', 'State': 'Stopped'})
+            FO = conn.makefile('rb')
+            for line in FO:
+                request = json.loads(line)
+                self.requests.append((client, request['method']))
+                if client == 0:
+                    break
+                self.send(conn, {'jsonrpc': '2.0', 'result': 'Stopped',
+                                 'id': request['id']})
+            FO.close()
+            conn.close()
+        self.server.close()
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_reconnect_after_drop_mid_call():
+    phd2 = FakePHD2()
+    guider = Guider(instance=phd2.port - 4399, reconnect_delay=0.05)
+    guider.Connect()
+    try:
+        assert wait_for(guider.IsHealthy)
+        # The server drops the connection instead of answering
+        with pytest.raises(GuiderException):
+            guider.Call('get_app_state')
+        assert wait_for(lambda: guider.ReconnectCount == 1 and guider.IsHealthy())
+        assert guider.Call('get_app_state')['result'] == 'Stopped'
+        assert phd2.requests == [(0, 'get_app_state'), (1, 'get_app_state')]
+    finally:
+        guider.Disconnect()
+    assert guider.conn is None
+    assert guider.Connected is False
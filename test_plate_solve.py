@@ -0,0 +1,77 @@
+from time import perf_counter
+import numpy as np
+
+from ocs.platesolve import (StarCatalog, PlateSolver, build_catalog, project,
+                            deproject)
+from ocs.simulator.detector import simulate_star_field
+
+
+def make_catalog(directory, ra0=150, dec0=30, n=20000, seed=1):
+    '''Random stars in a 4 degree patch around ra0, dec0.'''
+    rng = np.random.default_rng(seed)
+    ra = ra0 + rng.uniform(-2, 2, n)/np.cos(np.radians(dec0))
+    dec = dec0 + rng.uniform(-2, 2, n)
+    mag = rng.uniform(8, 16, n)
+    build_catalog(ra, dec, mag, directory)
+    return StarCatalog(directory)
+
+
+def render(catalog, ra, dec, scale, shape=(1024, 1024), seed=2):
+    '''Render the catalog stars around ra, dec, north up and east left.'''
+    stars = catalog.cone(ra, dec, 0.5)
+    xi, eta = project(stars['ra'], stars['dec'], ra, dec)
+    x = (shape[1] - 1)/2 - xi/scale
+    y = (shape[0] - 1)/2 + eta/scale
+    flux = 20000 * 10**(-0.4*(stars['mag'] - 8))
+    return simulate_star_field(shape=shape, seed=seed, x=x, y=y, flux=flux)
+
+
+def test_projection_round_trip():
+    xi, eta = project(151.0, 30.5, 150, 30)
+    ra, dec = deproject(xi, eta, 150, 30)
+    assert np.isclose(ra, 151.0) and np.isclose(dec, 30.5)
+
+
+def test_cone_search(tmp_path):
+    catalog = make_catalog(tmp_path)
+    stars = catalog.cone(150, 30, 0.5)
+    all_stars = np.load(tmp_path/'stars.npy')
+    ra, dec = np.radians(all_stars['ra'] - 150), np.radians(all_stars['dec'])
+    cos_sep = np.sin(np.radians(30))*np.sin(dec)\
+              + np.cos(np.radians(30))*np.cos(dec)*np.cos(ra)
+    expected = np.degrees(np.arccos(np.clip(cos_sep, -1, 1))) <= 0.5
+    assert len(stars) == np.sum(expected)
+    assert len(catalog.cone(10, -60, 1)) == 0
+
+
+def test_cone_search_ra_wrap(tmp_path):
+    build_catalog([359.9, 0.1, 180], [0, 0, 0], [10, 10, 10], tmp_path)
+    catalog = StarCatalog(tmp_path)
+    assert len(catalog.cone(0, 0, 0.5)) == 2
+
+
+def test_solve_pointing_error(tmp_path):
+    catalog = make_catalog(tmp_path)
+    scale = 1.5
+    solver = PlateSolver(catalog, scale)
+    # Telescope is actually pointed 90" east and 40" south of the target
+    xi, eta = 90, -40
+    ra, dec = deproject(xi, eta, 150, 30)
+    image = render(catalog, ra, dec, scale)
+    start = perf_counter()
+    solution = solver.solve(image, 150, 30)
+    elapsed = perf_counter() - start
+    assert solution is not None
+    assert solution['nmatched'] >= 10
+    assert abs(solution['offset_east'] - xi) < 1
+    assert abs(solution['offset_north'] - eta) < 1
+    assert abs(solution['rotation']) < 0.1
+    assert np.isclose(solution['scale'], scale, rtol=0.01)
+    assert elapsed < 1
+
+
+def test_solve_blank_frame(tmp_path):
+    catalog = make_catalog(tmp_path)
+    solver = PlateSolver(catalog, 1.5)
+    image = np.random.default_rng(3).normal(100, 5, (512, 512))
+    assert solver.solve(image, 150, 30) is None
@@ -0,0 +1,98 @@
+from astropy import coordinates as c
+from astropy.time import Time
+
+from ocs.scheduler import SharedQueue
+from ocs.targets import TargetResolver
+from ocs.ephemeris import NightlyEphemeris
+
+
+class Target():
+    def __init__(self, name):
+        self.name = name
+
+
+class OB():
+    def __init__(self, target, duration=600):
+        self.target = Target(target)
+        self.duration = duration
+
+    def estimate_duration(self):
+        return self.duration
+
+
+class Site():
+    '''The parts of a RollOffRoof a SharedQueue uses.
+    '''
+    def __init__(self, lat=20.0288, lon=-155.7149, slew=10, roof_open=True):
+        self.location = c.EarthLocation(lat=lat, lon=lon, height=0)
+        self.ephemeris = NightlyEphemeris(self.location)
+        self.dark_sun_alt = -12
+        self.simulate_darkness = False
+        self.slew = slew
+        self.roof_open = roof_open
+        self.we_are_done = False
+
+    def get_horizon(self, az):
+        return 20
+
+    def slew_time(self, coords, time=None):
+        return self.slew
+
+
+# Local midnight in Hawaii, when M31 is near the meridian there
+midnight = Time('2021-10-01T10:00:00')
+
+
+def make_queue(sites, OBs):
+    queue = SharedQueue(OBs=OBs, resolver=TargetResolver())
+    for key, site in sites.items():
+        queue.register(key, site)
+    return queue
+
+
+def test_soonest_site_gets_OB():
+    queue = make_queue({'slow': Site(slew=300), 'fast': Site(slew=10)},
+                       [OB('M31')])
+    assert queue.select('slow', time=midnight) == (None, None)
+    id, OB_ = queue.select('fast', time=midnight)
+    assert id == 0
+    assert OB_.target.name == 'M31'
+    assert len(queue) == 0
+
+
+def test_closed_site_does_not_compete():
+    queue = make_queue({'slow': Site(slew=300),
+                        'fast': Site(slew=10, roof_open=False)},
+                       [OB('M31')])
+    assert queue.select('slow', time=midnight)[0] == 0
+
+
+def test_site_in_daylight():
+    # It is noon in South Africa
+    queue = make_queue({'hawaii': Site(slew=300),
+                        'sutherland': Site(lat=-32.38, lon=20.81, slew=10)},
+                       [OB('M31'), OB('M42')])
+    assert queue.select('sutherland', time=midnight) == (None, None)
+    assert queue.select('hawaii', time=midnight)[0] == 0
+    assert len(queue) == 1
+
+
+def test_busy_site():
+    # After taking a long OB, the fast site is busy so the slow site gets the
+    # next one
+    queue = make_queue({'slow': Site(slew=300), 'fast': Site(slew=10)},
+                       [OB('M31', duration=3600), OB('M31')])
+    assert queue.select('fast', time=midnight)[0] == 0
+    assert queue.select('slow', time=midnight)[0] == 1
+
+
+def test_view():
+    queue = make_queue({'a': Site()}, [OB('M31'), OB('M31')])
+    view = queue.view('a')
+    OB_ = view.take(1)
+    assert view.current_id == 1
+    assert view.take(1) is None
+    assert view.current_id is None
+    view.requeue(1, OB_)
+    view.skip([0])
+    assert [id for id, OB_ in queue.scheduler.candidates()] == [1]
@@ -0,0 +1,61 @@
+import numpy as np
+
+from ocs.slewmodel import SlewModel
+
+
+def test_slew_model_fit(tmp_path):
+    truth = SlewModel(rate=1.5, settle=8, flip_time=40)
+    truth.params.update({'rate_dec': 3, 'settle_dec': 4})
+    model = SlewModel(file=tmp_path/'slews.yaml', min_points=10)
+    rng = np.random.default_rng(2)
+    for i in range(40):
+        start = (rng.uniform(-90, 90), rng.uniform(-30, 80))
+        end = (rng.uniform(-90, 90), rng.uniform(-30, 80))
+        duration = truth.predict(start, end) + rng.normal(0, 0.5)
+        model.add(start, end, duration, save=(i == 39))
+    # Most of these slews are limited by the slower hour angle axis
+    for key in ['settle_ha', 'rate_ha', 'flip_time']:
+        assert np.isclose(model.params[key], truth.params[key], rtol=0.1)
+
+    # Batch prediction, including a meridian flip
+    start = (np.full(3, -10.), np.zeros(3))
+    end = (np.array([-20., 50., -10.]), np.array([0., 0., 60.]))
+    predicted = model.predict(start, end)
+    expected = truth.predict(start, end)
+    assert np.allclose(predicted, expected, rtol=0.1)
+    assert predicted[1] > 40
+
+    # The logged slews persist
+    assert SlewModel(file=tmp_path/'slews.yaml').params == model.params
+
+
+def test_slew_model_defaults():
+    model = SlewModel(rate=2, settle=5)
+    assert np.isclose(model.predict((10, 0), (30, 10)), 15)
+
+
+def test_slew_model_side_of_pier(tmp_path):
+    model = SlewModel(rate=2, settle=5, flip_time=30)
+    # Without the side of the pier a flip is a change of hour angle sign
+    assert np.isclose(model.predict((10, 0), (30, 0)), 15)
+    assert np.isclose(model.predict((-10, 0), (10, 0)), 45)
+    # A mount which tracked past the meridian on the west side flips to
+    # reach a target west of the meridian, but not one east of it
+    assert np.isclose(model.predict((10, 0), (30, 0), pier='west'), 45)
+    predicted = model.predict((10, 0), (np.array([30, -10]), np.zeros(2)),
+                              pier='west')
+    assert np.allclose(predicted, [45, 15])
+
+    # Logged sides of the pier are used in the fit, and persist
+    file = tmp_path/'slews.yaml'
+    truth = SlewModel(rate=2, settle=5, flip_time=60)
+    model = SlewModel(file=file, min_points=10)
+    rng = np.random.default_rng(3)
+    for i in range(30):
+        ha0, ha1 = rng.uniform(0, 60, 2)
+        pier0 = ['east', 'west'][i%2]
+        duration = truth.predict((ha0, 0), (ha1, 0), pier=pier0)
+        model.add((ha0, 0), (ha1, 0), duration, save=(i == 29),
+                  pier0=pier0, pier1='east')
+    assert np.isclose(model.params['flip_time'], 60)
+    assert SlewModel(file=file).params == model.params
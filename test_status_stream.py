@@ -0,0 +1,112 @@
+import json
+import socket
+from http.client import HTTPConnection
+
+from ocs.status import StatusStream
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def test_status_deltas():
+    stream = StatusStream()
+    first = stream.update({'state': 'sleeping', 'error_count': 0,
+                           'nodename': 'obs'})
+    assert first['seq'] == 1
+    assert set(first['changes'].keys()) == {'state', 'error_count', 'nodename'}
+    assert stream.update({'state': 'sleeping', 'error_count': 0,
+                          'nodename': 'obs'}) is None
+    second = stream.update({'state': 'waiting_closed', 'error_count': 0,
+                            'nodename': 'obs'})
+    assert second['seq'] == 2
+    assert second['changes'] == {'state': 'waiting_closed'}
+    assert stream.snapshot()['status']['state'] == 'waiting_closed'
+
+    # A subscriber which falls behind is dropped
+    stream.subscriber_queue_size = 1
+    subscriber = stream.subscribe()
+    stream.update({'error_count': 1})
+    stream.update({'error_count': 2})
+    assert subscriber.get_nowait() is None
+    assert len(stream.subscribers) == 0
+
+
+def test_status_server_sent_events():
+    stream = StatusStream()
+    stream.update({'state': 'sleeping'})
+    port = free_port()
+    stream.serve(port=port)
+    try:
+        connection = HTTPConnection('localhost', port, timeout=5)
+        connection.request('GET', '/status')
+        assert json.loads(connection.getresponse().read())['status'] == {'state': 'sleeping'}
+
+        connection = HTTPConnection('localhost', port, timeout=5)
+        connection.request('GET', '/events')
+        response = connection.getresponse()
+        assert response.getheader('Content-Type') == 'text/event-stream'
+        assert response.readline() == b'event: snapshot\n'
+        assert response.readline() == b'id: 1\n'
+        assert json.loads(response.readline()[6:])['status']['state'] == 'sleeping'
+        response.readline()
+        stream.update({'state': 'waiting_closed'})
+        assert response.readline() == b'event: delta\n'
+        assert response.readline() == b'id: 2\n'
+        assert json.loads(response.readline()[6:])['changes'] == {'state': 'waiting_closed'}
+        connection.close()
+    finally:
+        stream.shutdown()
+
+
+class Collection():
+    def __init__(self):
+        self.documents = {}
+
+    def update_one(self, query, update, upsert=False):
+        document = self.documents.setdefault(query['_id'], {})
+        document.update(update['$set'])
+        for key in update.get('$unset', {}).keys():
+            document.pop(key, None)
+
+    def insert_one(self, document):
+        self.documents[len(self.documents)] = document
+
+
+class DB(dict):
+    def list_collection_names(self):
+        return list(self.keys())
+
+    def create_collection(self, name, **kwargs):
+        self[name] = Collection()
+
+    def __missing__(self, name):
+        self[name] = Collection()
+        return self[name]
+
+
+def test_nan_is_not_a_change():
+    stream = StatusStream()
+    quality = {'fwhm': float('nan'), 'nstars': 0, 'limits': [1.0, float('nan')]}
+    assert stream.update({'frame_quality0': quality, 'alt': float('nan')})['seq'] == 1
+    assert stream.update({'frame_quality0': dict(quality), 'alt': float('nan')}) is None
+    message = stream.update({'frame_quality0': dict(quality, nstars=3)})
+    assert list(message['changes'].keys()) == ['frame_quality0']
+
+
+def test_remove_fields():
+    db = DB()
+    stream = StatusStream(db=db)
+    stream.update({'state': 'observing', 'current_OB': 'M31'})
+    message = stream.update({'state': 'observing'}, remove=['current_OB', 'unknown'])
+    assert message['changes'] == {}
+    assert message['removed'] == ['current_OB']
+    assert stream.snapshot()['status'] == {'state': 'observing'}
+    assert 'current_OB' not in db['status'].documents['current']
+    assert stream.update({'state': 'observing'}, remove=['current_OB']) is None
+    # A removed field can come back
+    message = stream.update({'current_OB': 'M42'})
+    assert message['changes'] == {'current_OB': 'M42'}
+    assert db['status'].documents['current']['current_OB'] == 'M42'
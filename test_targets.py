@@ -0,0 +1,73 @@
+import json
+
+from astropy import units as u
+from astropy import coordinates as c
+
+from ocs.targets import TargetResolver
+
+
+class Target():
+    '''Stand in for an odl Target: a name and optionally RA and Dec.
+    '''
+    def __init__(self, name, RA=None, Dec=None):
+        self.name = name
+        self.RA = RA
+        self.Dec = Dec
+        self.lookups = 0
+
+    def coord(self):
+        if self.RA is not None:
+            return c.SkyCoord(self.RA, self.Dec, unit=(u.deg, u.deg))
+        self.lookups += 1
+        return c.SkyCoord(123.0, 45.0, unit=(u.deg, u.deg))
+
+
+def test_name_from_catalog():
+    resolver = TargetResolver()
+    target = Target('m 31')
+    coord = resolver.coord(target)
+    assert abs(coord.ra.deg - 10.68) < 0.1
+    assert abs(coord.dec.deg - 41.27) < 0.1
+    assert target.lookups == 0
+
+
+def test_extra_catalog(tmp_path):
+    stars = tmp_path/'stars.csv'
+    stars.write_text('name,ra,dec,aliases\nVega,279.2347,+38.7837,alf Lyr\n')
+    resolver = TargetResolver(extra_catalogs=[stars])
+    target = Target('alf Lyr')
+    assert abs(resolver.coord(target).dec.deg - 38.78) < 0.01
+    assert target.lookups == 0
+    # The bundled catalog is still used
+    assert resolver.local_coord('NGC 224') is not None
+
+
+def test_explicit_coordinates_win(tmp_path):
+    resolver = TargetResolver(cache_file=tmp_path/'targets.json')
+    # A mosaic tile named after a catalog object goes where it says
+    tile = Target('M31', RA=11.5, Dec=42.0)
+    coord = resolver.coord(tile)
+    assert abs(coord.ra.deg - 11.5) < 1e-6
+    assert abs(coord.dec.deg - 42.0) < 1e-6
+    # and does not change where the name resolves to
+    assert abs(resolver.coord(Target('M31')).ra.deg - 10.68) < 0.1
+    # Two targets with the same name and different coordinates stay distinct
+    other = resolver.coord(Target('M31', RA=9.5, Dec=40.0))
+    assert abs(other.ra.deg - 9.5) < 1e-6
+    assert not (tmp_path/'targets.json').exists()
+    assert resolver.resolve_all([tile]) == []
+
+
+def test_name_server_result_cached(tmp_path):
+    cache_file = tmp_path/'targets.json'
+    resolver = TargetResolver(cache_file=cache_file)
+    target = Target('Some Galaxy')
+    resolver.coord(target)
+    resolver.coord(target)
+    assert target.lookups == 1
+    with open(cache_file) as FO:
+        assert json.load(FO)['SOMEGALAXY'] == [123.0, 45.0]
+    # A new resolver (e.g. the next night) reads the cache
+    target = Target('some galaxy')
+    assert abs(TargetResolver(cache_file=cache_file).coord(target).ra.deg - 123) < 1e-6
+    assert target.lookups == 0
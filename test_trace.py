@@ -0,0 +1,123 @@
+from collections import deque
+import numpy as np
+import pytest
+
+from astropy.io import fits
+from astropy.coordinates import SkyCoord
+
+from ocs.trace import TraceRecorder, Trace, ReplayDevice, encode, decode
+from ocs.conditions import ConditionContext
+from ocs.devicestate import DeviceMirror
+from ocs.scheduler import Scheduler
+from ocs.simulator.telescope import Telescope
+from ocs.simulator.roof import Roof
+from ocs.simulator.detector import DetectorController
+from ocs.exceptions import RoofFailure
+
+
+def test_encode_decode():
+    header = fits.Header([('OBJECT', 'M31', 'target'), ('EXPTIME', 10.0)])
+    hdul = fits.HDUList([fits.PrimaryHDU(data=np.ones((4, 6), dtype=np.uint16),
+                                         header=header)])
+    result = decode(encode({'hdul': hdul, 'coord': SkyCoord(10, 20, unit='deg'),
+                            'flag': np.bool_(True)}))
+    assert result['hdul'][0].data.shape == (4, 6)
+    assert result['hdul'][0].header['OBJECT'] == 'M31'
+    assert np.isclose(result['coord'].dec.deg, 20)
+    assert result['flag'] is True
+
+
+def test_record_and_replay(tmp_path):
+    file = tmp_path/'night.jsonl'
+    trace = TraceRecorder(file)
+    telescope = Telescope()
+    roof = Roof(close_fail_after=1)
+    detector = DetectorController(simulate_image=True, image_shape=(32, 48),
+                                  simulate_exposure_time=False)
+    trace.record_device(telescope, 'telescope')
+    trace.record_device(roof, 'roof')
+    trace.record_device(detector, 'detector0')
+    scheduler = Scheduler(OBs=['OB0', 'OB1', 'OB2'])
+    trace.write('start', name='test', queue=scheduler.signature())
+    trace.record_scheduler(scheduler)
+
+    recorded = [telescope.atpark()]
+    telescope.unpark()
+    recorded.append(telescope.atpark())
+    with pytest.raises(RoofFailure):
+        roof.close()
+    detector.set_exptime(1)
+    hdul = detector.expose()
+    scheduler.skip([1])
+    assert scheduler.select() == 'OB0'
+    assert scheduler.select() == 'OB2'
+    assert scheduler.select() is None
+    trace.write('conditions', trigger='acquire', source='waiting_open',
+                dest='acquiring', values={'done_observing': False})
+    trace.close()
+
+    replay = Trace(file)
+    telescope = ReplayDevice(replay, 'telescope')
+    roof = ReplayDevice(replay, 'roof')
+    detector = ReplayDevice(replay, 'detector0')
+    assert [telescope.atpark(), telescope.unpark(), telescope.atpark()]\
+           == [recorded[0], None, recorded[1]]
+    with pytest.raises(RoofFailure):
+        roof.close()
+    detector.set_exptime(1)
+    assert detector.expose()[0].data.shape == hdul[0].data.shape
+    # More calls than recorded repeat the last result
+    assert replay.divergences == 0
+    assert telescope.atpark() is recorded[1]
+    assert replay.divergences == 1
+
+    assert replay.matches_queue(Scheduler(OBs=['OB0', 'OB2', 'OB1'])) is False
+    scheduler = Scheduler(OBs=['OB0', 'OB1', 'OB2'])
+    assert replay.matches_queue(scheduler) is True
+    replay.replay_scheduler(scheduler)
+    assert [scheduler.select() for i in range(3)] == ['OB0', 'OB2', None]
+
+    conditions = ConditionContext()
+    conditions.replay = replay.conditions
+    conditions.begin('acquire', 'waiting_open')
+    assert conditions.evaluate('done_observing', lambda: True) is False
+    conditions.end()
+    assert conditions.replay_mismatches == 0
+
+
+def test_replay_with_mirror(tmp_path):
+    file = tmp_path/'night.jsonl'
+    trace = TraceRecorder(file)
+    telescope = Telescope(time_to_park=0.05)
+    trace.record_device(telescope, 'telescope')
+    mirror = DeviceMirror()
+    mirror.watch(telescope, 'telescope', {'atpark': ('atpark', 0.001),
+                                          'tracking': ('tracking', 0.001)})
+    mirror.invalidate_on(telescope, 'telescope', ['park', 'unpark'])
+    mirror.start()
+    recorded = [telescope.atpark()]
+    telescope.unpark()
+    recorded.append(mirror.get('telescope.atpark'))
+    recorded.append(telescope.atpark())
+    telescope.park()
+    recorded.append(telescope.atpark())
+    mirror.stop()
+    trace.close()
+
+    replay = Trace(file)
+    assert len(replay.polls[('telescope', 'atpark')]) > 0
+    assert all([entry['thread'] != 'device_state'
+                for entry in replay.calls[('telescope', 'atpark')]])
+    telescope = ReplayDevice(replay, 'telescope')
+    mirror = DeviceMirror()
+    mirror.watch(telescope, 'telescope', {'atpark': ('atpark', 0.001),
+                                          'tracking': ('tracking', 0.001)})
+    mirror.invalidate_on(telescope, 'telescope', ['park', 'unpark'])
+    replayed = [telescope.atpark()]
+    telescope.unpark()
+    replayed.append(mirror.get('telescope.atpark'))
+    replayed.append(telescope.atpark())
+    telescope.park()
+    replayed.append(telescope.atpark())
+    assert replayed == recorded == [True, False, False, True]
+    assert replay.divergences == 0